@@ -0,0 +1,31 @@
+import gc
+import sys
+import tracemalloc
+
+import psil.interpreter
+
+# Each handler is made in a frame that also holds a large temporary list,
+# as in the map/lambda patterns of html.psil, and is then kept in a
+# long-lived registry.
+Setup = """
+(define (make-handler i)
+  (define rows (make-list (map (lambda (j) (list j (* j i))) (range 200))))
+  (define total (apply + (make-list (map cadr rows))))
+  (lambda (x) (+ x total)))
+"""
+
+Registry = "(define {0} (make-list (map make-handler (range {1}))))"
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+psil.interpreter.psil(Setup)
+tracemalloc.start()
+for trim in (False, True):
+    psil.interpreter.TrimClosures = trim
+    name = "registry-trimmed" if trim else "registry-full"
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    psil.interpreter.psil(Registry.format(name, count))
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    print("{0:8} {1:10.1f} KiB retained by {2} closures".format("trimmed" if trim else "full", retained / 1024, count))
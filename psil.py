@@ -4,10 +4,55 @@ import psil.interpreter
 
 Interactive = True
 
+Serve = None
+
+Workers = None
+
+CompileAll = None
+
+Watch = False
+
 a = 1
 while a < len(sys.argv) and sys.argv[a].startswith("-"):
     if sys.argv[a] == "-c":
         psil.interpreter.Compile = True
+    elif sys.argv[a] == "-s":
+        psil.interpreter.Source = True
+    elif sys.argv[a] == "--tier":
+        a += 1
+        psil.interpreter.TierThreshold = int(sys.argv[a])
+    elif sys.argv[a] == "-O":
+        psil.interpreter.Optimize = True
+    elif sys.argv[a] == "--freeze-quoted":
+        psil.interpreter.FreezeQuoted = True
+    elif sys.argv[a] == "--hash-cons":
+        psil.interpreter.HashConsQuoted = True
+    elif sys.argv[a] == "--check-limits":
+        import psil.limits
+        psil.limits.CompileChecks = True
+    elif sys.argv[a] == "--heap":
+        import psil.machine
+        psil.machine.install()
+    elif sys.argv[a] == "--serve":
+        a += 1
+        Serve = sys.argv[a]
+    elif sys.argv[a] == "--compile-all":
+        a += 1
+        CompileAll = sys.argv[a]
+    elif sys.argv[a] == "--threads":
+        a += 1
+        import psil.futures
+        psil.futures.Workers = int(sys.argv[a])
+    elif sys.argv[a] == "--memprofile":
+        import atexit
+        import psil.memprofile
+        psil.memprofile.start()
+        atexit.register(psil.memprofile.report)
+    elif sys.argv[a] == "--watch":
+        Watch = True
+    elif sys.argv[a] == "--workers":
+        a += 1
+        Workers = int(sys.argv[a])
     elif sys.argv[a] == "-e":
         a += 1
         psil.interpreter.psil(sys.argv[a])
@@ -18,27 +63,66 @@ while a < len(sys.argv) and sys.argv[a].startswith("-"):
         if a < len(sys.argv):
             doctest.testfile(sys.argv[a])
         else:
+            import psil.analysis
+            import psil.build
+            import psil.futures
+            import psil.limits
+            import psil.machine
+            import psil.memprofile
+            import psil.optimize
+            import psil.persistent
+            import psil.reload
+            import psil.repl
             import psil.rt
+            import psil.server
+            import psil.tiered
+            doctest.testmod(psil.analysis, optionflags=doctest.ELLIPSIS)
+            doctest.testmod(psil.build, optionflags=doctest.ELLIPSIS)
             doctest.testmod(psil.compiler, optionflags=doctest.ELLIPSIS)
             doctest.testmod(psil.deparse, optionflags=doctest.ELLIPSIS)
+            doctest.testmod(psil.futures, optionflags=doctest.ELLIPSIS)
+            doctest.testmod(psil.hashcons, optionflags=doctest.ELLIPSIS)
             doctest.testmod(psil.interpreter, optionflags=doctest.ELLIPSIS)
+            doctest.testmod(psil.limits, optionflags=doctest.ELLIPSIS)
+            doctest.testmod(psil.machine, optionflags=doctest.ELLIPSIS)
+            doctest.testmod(psil.memo, optionflags=doctest.ELLIPSIS)
+            doctest.testmod(psil.memprofile, optionflags=doctest.ELLIPSIS)
+            doctest.testmod(psil.metrics, optionflags=doctest.ELLIPSIS)
+            doctest.testmod(psil.optimize, optionflags=doctest.ELLIPSIS)
+            doctest.testmod(psil.persistent, optionflags=doctest.ELLIPSIS)
+            doctest.testmod(psil.ports, optionflags=doctest.ELLIPSIS)
             doctest.testmod(psil.reader, optionflags=doctest.ELLIPSIS)
+            doctest.testmod(psil.reload, optionflags=doctest.ELLIPSIS)
+            doctest.testmod(psil.repl, optionflags=doctest.ELLIPSIS)
             doctest.testmod(psil.rt, optionflags=doctest.ELLIPSIS)
+            doctest.testmod(psil.runtime, optionflags=doctest.ELLIPSIS)
+            doctest.testmod(psil.server, optionflags=doctest.ELLIPSIS)
             doctest.testmod(psil.symbol, optionflags=doctest.ELLIPSIS)
+            doctest.testmod(psil.tiered, optionflags=doctest.ELLIPSIS)
             doctest.testfile("psil.test", optionflags=doctest.ELLIPSIS)
             doctest.testfile("integ.test", optionflags=doctest.ELLIPSIS)
         sys.exit(0)
     a += 1
 
-if a < len(sys.argv):
+if CompileAll is not None:
+    import psil.build
+    sys.exit(1 if psil.build.compile_all(CompileAll, Workers) else 0)
+elif Serve is not None:
+    import psil.server
+    psil.server.serve(Serve, Workers)
+elif a < len(sys.argv) and Watch:
+    import psil.reload
+    psil.reload.watch([sys.argv[a]])
+elif a < len(sys.argv):
     # TODO: command line args to script
     psil.interpreter.include(sys.argv[a])
 elif Interactive:
     from psil.interpreter import Globals, rep
+    from psil.repl import meta
     Globals.symbols["quit"] = lambda: sys.exit(0)
     import traceback
     print("PSIL interactive mode")
-    print("Use (quit) to exit")
+    print("Use (quit) to exit, :time :bench :compile :expand :profile :results for timing")
     try:
         import readline
     except ImportError:
@@ -51,7 +135,10 @@ elif Interactive:
             print()
             break
         try:
-            rep(s)
+            if s.startswith(":"):
+                meta(s)
+            else:
+                rep(s)
         except SystemExit:
             raise
         except:
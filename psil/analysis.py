@@ -0,0 +1,175 @@
+"""Static analysis of expanded forms.
+
+>>> sorted(free_variables(read("(x . rest)"), [read("(define y 1)"), read("(lambda (z) (list x y z w 'q `(,v u)))")]))
+['list', 'v', 'w']
+>>> sorted(free_variables(read("()"), [read("(when do (list else))")]))
+['do', 'else', 'list']
+>>> names, assigned = frame_names(read("(a b)"), [read("(define c 1)"), read("(set! b 2)"), read("(define c 3)")])
+>>> sorted(names), sorted(assigned)
+(['a', 'b', 'c'], ['b', 'c'])
+"""
+
+from .reader import read
+from .symbol import Symbol
+
+SpecialForms = set([
+    Symbol.define,
+    Symbol.defmacro,
+    Symbol.if_,
+    Symbol.lambda_,
+    Symbol.quote,
+    Symbol.quasiquote,
+    Symbol.set,
+    Symbol.and_,
+    Symbol.or_,
+    Symbol.cond,
+    Symbol.when,
+    Symbol.else_,
+    Symbol.while_,
+    Symbol.dotimes,
+    Symbol.for_,
+    Symbol.do,
+    Symbol.named_let,
+])
+
+def quasiquote_holes(t, depth=1):
+    """
+    >>> list(quasiquote_holes(read("(a ,b (c ,@d `(e ,f ,,g)))")))
+    [<b>, <d>, <g>]
+    """
+    if isinstance(t, list):
+        if len(t) > 0 and t[0] is Symbol.unquote:
+            if depth == 1:
+                yield t[1]
+            else:
+                for x in quasiquote_holes(t[1], depth - 1):
+                    yield x
+        elif len(t) > 0 and t[0] is Symbol.quasiquote:
+            for x in quasiquote_holes(t[1], depth + 1):
+                yield x
+        else:
+            for x in t:
+                if isinstance(x, list) and len(x) > 0 and x[0] is Symbol.unquote_splicing:
+                    if depth == 1:
+                        yield x[1]
+                    else:
+                        for y in quasiquote_holes(x[1], depth - 1):
+                            yield y
+                else:
+                    for y in quasiquote_holes(x, depth):
+                        yield y
+
+def param_names(params):
+    if isinstance(params, Symbol):
+        return set([params.name])
+    r = set()
+    for p in params:
+        if isinstance(p, Symbol):
+            if p.name != ".":
+                r.add(p.name)
+        elif isinstance(p, list) and len(p) > 1 and isinstance(p[1], Symbol):
+            r.add(p[1].name)
+    return r
+
+def loop_names(p):
+    """
+    >>> sorted(loop_names(read("(named-let next ((i 0) (acc 1)) (next i acc))")))
+    ['acc', 'i', 'next']
+    """
+    head = p[0]
+    if head is Symbol.dotimes or head is Symbol.for_:
+        return set([p[1][0].name])
+    if head is Symbol.do:
+        return set(b[0].name for b in p[1])
+    if head is Symbol.named_let:
+        return set([p[1].name] + [b[0].name for b in p[2]])
+    return set()
+
+def _defines(p, r):
+    """Collect, in order, the names defined in the frame evaluating p."""
+    if not isinstance(p, list) or not p:
+        return
+    head = p[0]
+    if head is Symbol.quote or head is Symbol.quasiquote or head is Symbol.lambda_:
+        return
+    if head is Symbol.define and len(p) > 2:
+        if isinstance(p[1], Symbol):
+            r.append(p[1].name)
+            _defines(p[2], r)
+        elif isinstance(p[1], list) and p[1] and isinstance(p[1][0], Symbol):
+            r.append(p[1][0].name)
+        return
+    if head is Symbol.defmacro:
+        return
+    for x in p:
+        _defines(x, r)
+
+def _assigned(p, r):
+    if not isinstance(p, list) or not p:
+        return
+    head = p[0]
+    if head is Symbol.quote:
+        return
+    if head is Symbol.quasiquote:
+        for x in quasiquote_holes(p[1]):
+            _assigned(x, r)
+        return
+    if head is Symbol.set and len(p) > 1 and isinstance(p[1], Symbol):
+        r.add(p[1].name)
+    for x in p:
+        _assigned(x, r)
+
+def frame_names(params, body):
+    """Return the names a call frame will bind, and those among them that
+    may change after they are first bound (set! or defined twice)."""
+    defined = []
+    for x in body:
+        _defines(x, defined)
+    names = param_names(params)
+    assigned = set()
+    for x in body:
+        _assigned(x, assigned)
+    for name in defined:
+        if name in names:
+            assigned.add(name)
+        names.add(name)
+    return names, assigned & names
+
+def _free(p, bound, r):
+    if isinstance(p, Symbol):
+        if p.name not in bound:
+            r.add(p.name)
+        return
+    if not isinstance(p, list) or not p:
+        return
+    head = p[0]
+    if head is Symbol.quote or head is Symbol.defmacro:
+        return
+    if head is Symbol.quasiquote:
+        for x in quasiquote_holes(p[1]):
+            _free(x, bound, r)
+        return
+    if head is Symbol.lambda_ and len(p) > 1:
+        _body_free(p[1], p[2:], bound, r)
+        return
+    if head is Symbol.define and len(p) > 2 and isinstance(p[1], list):
+        _body_free(p[1][1:], p[2:], bound, r)
+        return
+    if isinstance(head, Symbol) and head in SpecialForms:
+        # only as the head; elsewhere the name is a variable like any other
+        p = p[1:]
+    for x in p:
+        _free(x, bound, r)
+
+def _body_free(params, body, bound, r):
+    names, assigned = frame_names(params, body)
+    inner = bound | names
+    for x in body:
+        _free(x, inner, r)
+
+def free_variables(params, body):
+    """Names referred to by a function with params and body that it does
+    not bind itself."""
+    r = set()
+    _body_free(params, body, set(), r)
+    return r
@@ -0,0 +1,179 @@
+"""Compile a tree of psil modules ahead of time.
+
+Each .psil file under a directory is compiled to the .pyc cache that
+rt._import would otherwise write on first import. Modules are compiled in
+the order of their (import ...) forms, a group at a time across a pool of
+processes, and only when the module or one of the modules it imports,
+directly or not, has changed since its cache was written.
+
+>>> sorted(imports("(import util) (define (f) (import db) (db.query '(import no)))"))
+['db', 'util']
+>>> levels({"app": {"db", "util"}, "db": {"util"}, "util": set()})
+[['util'], ['db'], ['app']]
+>>> levels({"a": {"b"}, "b": {"a"}, "c": {"a"}})
+[['a', 'b'], ['c']]
+
+Imports are found the way rt._import finds them when the program runs from
+the root of the tree, and a cache is stale as soon as a source is newer,
+even within the same second:
+
+>>> import tempfile
+>>> d = tempfile.mkdtemp()
+>>> os.mkdir(os.path.join(d, "sub"))
+>>> for name, code in [("util", "(define x 1)"), ("app", "(import util)"), ("sub/tool", "(import util)")]:
+...     with open(os.path.join(d, name + ".psil"), "w") as f:
+...         f.write(code) and None
+>>> graph = discover(d)
+>>> sorted((os.path.relpath(m, d), sorted(os.path.relpath(x, d) for x in deps)) for m, deps in graph.items())
+[('app', ['util']), ('sub/tool', ['util']), ('util', [])]
+>>> for m in graph: rt.write_cache(m + ".psil", m + ".pyc")
+>>> stale(graph)
+set()
+>>> util = os.path.join(d, "util")
+>>> t = os.stat(util + ".pyc").st_mtime_ns + 1000000
+>>> os.utime(util + ".psil", ns=(t, t))
+>>> sorted(os.path.relpath(m, d) for m in stale(graph))
+['app', 'sub/tool', 'util']
+>>> import shutil; shutil.rmtree(d)
+"""
+
+import os
+import sys
+
+from . import interpreter
+from . import reader
+from . import rt
+from .symbol import Symbol
+
+def imports(code):
+    """Return the names of the modules that code imports."""
+    r = set()
+    def walk(p):
+        if isinstance(p, list) and p:
+            if p[0] is Symbol.quote:
+                return
+            if p[0] is Symbol.new("import") and len(p) > 1 and isinstance(p[1], Symbol):
+                r.add(p[1].name)
+            for x in p:
+                walk(x)
+    t = interpreter.tokenise(code)
+    while True:
+        p = interpreter.parse(t)
+        if p is None:
+            break
+        walk(p)
+    return r
+
+def discover(root):
+    """Map module paths under root (without .psil) to the modules in the
+    tree that each one imports."""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for fn in sorted(filenames):
+            if fn.endswith(".psil"):
+                found.append(os.path.join(dirpath, fn[:-5]))
+    graph = {}
+    for module in found:
+        f = open(module + ".psil")
+        code = f.read()
+        f.close()
+        deps = set()
+        try:
+            names = imports(code)
+        except reader.SyntaxError:
+            # reported when the module is compiled
+            names = ()
+        for name in names:
+            # as rt._import finds it when the program runs from root
+            path = rt.find_module(name, root)
+            if path is not None:
+                deps.add(path[:-5])
+        graph[module] = deps - set([module])
+    return graph
+
+def levels(graph):
+    """Group the modules in graph so that each one comes after the modules
+    it imports. Modules that import each other share a group."""
+    remaining = dict((m, set(deps) & set(graph)) for m, deps in graph.items())
+    done = set()
+    r = []
+    while remaining:
+        ready = sorted(m for m, deps in remaining.items() if deps <= done)
+        if not ready:
+            # a cycle that waits on nothing outside itself
+            def reach(m):
+                seen = set()
+                stack = list(remaining[m] - done)
+                while stack:
+                    x = stack.pop()
+                    if x not in seen:
+                        seen.add(x)
+                        stack.extend(remaining[x] - done)
+                return seen
+            ready = sorted(m for m in remaining if all(m in reach(x) for x in reach(m)))
+        r.append(ready)
+        done.update(ready)
+        for m in ready:
+            del remaining[m]
+    return r
+
+def stale(graph):
+    """Return the modules whose cache is missing, was not written from the
+    module's source as it is now, or is older than the source of anything
+    it imports."""
+    def mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+    newest = {}
+    def source_time(m, seen):
+        if m in newest:
+            return newest[m]
+        seen.add(m)
+        t = mtime(m + ".psil")
+        for d in graph.get(m, ()):
+            if d not in seen:
+                t = max(t, source_time(d, seen))
+        return t
+    r = set()
+    for m in graph:
+        newest[m] = source_time(m, set())
+        if not rt.cache_is_current(m + ".psil", m + ".pyc") or mtime(m + ".pyc") < newest[m]:
+            r.add(m)
+    return r
+
+def _compile(args):
+    module, optimize = args
+    interpreter.Optimize = optimize
+    try:
+        rt.write_cache(module + ".psil", module + ".pyc")
+    except Exception as x:
+        return module, "{0}: {1}".format(x.__class__.__name__, x)
+    return module, None
+
+def compile_all(root, workers = None):
+    """Bring the caches of the modules under root up to date. Return the
+    number of modules that failed to compile."""
+    graph = discover(root)
+    todo = stale(graph)
+    print("{0} of {1} modules to compile".format(len(todo), len(graph)))
+    if not todo:
+        return 0
+    import multiprocessing
+    pool = multiprocessing.Pool(workers)
+    failed = 0
+    try:
+        for level in levels(graph):
+            batch = [(m, interpreter.Optimize) for m in level if m in todo]
+            for module, error in pool.imap_unordered(_compile, batch):
+                if error is None:
+                    print("compiled", module + ".psil")
+                else:
+                    print("failed", module + ".psil", error, file=sys.stderr)
+                    failed += 1
+    finally:
+        pool.close()
+        pool.join()
+    return failed
@@ -1,6 +1,10 @@
 import ast
 import sys
+import threading
 
+from . import limits
+from .analysis import quasiquote_holes
+from .hashcons import Node
 from .symbol import Symbol
 
 AstStatements = (
@@ -15,8 +19,7 @@ AstStatements = (
     ast.If,
     ast.With,
     ast.Raise,
-    ast.TryExcept,
-    ast.TryFinally,
+    ast.Try,
     ast.Assert,
     ast.Import,
     ast.ImportFrom,
@@ -42,6 +45,8 @@ def make_stmt(node):
     return node
 
 def compile_add(p):
+    if len(p) == 1:
+        return ast.Constant(0)
     if len(p) == 2:
         return build_ast(p[1])
     elif len(p) == 3:
@@ -49,41 +54,310 @@ def compile_add(p):
     else:
         return ast.BinOp(compile_add(p[:-1]), ast.Add(), build_ast(p[-1]))
 
+def compile_and(p):
+    if len(p) == 1:
+        return ast.Constant(True)
+    if len(p) == 2:
+        return build_ast(p[1])
+    return ast.BoolOp(ast.And(), [build_ast(x) for x in p[1:]])
+
+def compile_or(p):
+    if len(p) == 1:
+        return ast.Constant(False)
+    if len(p) == 2:
+        return build_ast(p[1])
+    return ast.BoolOp(ast.Or(), [build_ast(x) for x in p[1:]])
+
+def compile_sequence(forms):
+    if len(forms) == 1:
+        return build_ast(forms[0])
+    # a tuple evaluates its elements in order; keep the last
+    return ast.Subscript(ast.Tuple([build_ast(x) for x in forms], ast.Load()), ast.Constant(-1), ast.Load())
+
+def compile_cond(p):
+    """
+    >>> from psil import interpreter
+    >>> interpreter.Compile = True
+    >>> try:
+    ...     interpreter.psil("(print (cond (False 1) (else)) (cond (0) (2)) (cond (False 1)))")
+    ... finally:
+    ...     interpreter.Compile = False
+    None 2 None
+    """
+    r = ast.Constant(None)
+    for clause in reversed(p[1:]):
+        if clause[0] is Symbol.else_:
+            # a bare (else) is (else None)
+            r = compile_sequence(clause[1:]) if len(clause) > 1 else ast.Constant(None)
+        elif len(clause) == 1:
+            r = ast.BoolOp(ast.Or(), [build_ast(clause[0]), r])
+        else:
+            r = ast.IfExp(build_ast(clause[0]), compile_sequence(clause[1:]), r)
+    return r
+
+def compile_when(p):
+    if len(p) == 2:
+        return ast.IfExp(build_ast(p[1]), ast.Constant(None), ast.Constant(None))
+    return ast.IfExp(build_ast(p[1]), compile_sequence(p[2:]), ast.Constant(None))
+
+def _checked(body):
+    # with limits.CompileChecks, each function and loop body counts a step
+    if limits.CompileChecks:
+        return [make_stmt(build_ast([Symbol.new("check-limits")]))] + body
+    return body
+
+def compile_body(forms):
+    """Statements for a function body, returning the last value.
+
+    A cond or when in tail position becomes an if/elif statement with a
+    return in each branch.
+    """
+    body = []
+    for x in forms[:-1]:
+        body.extend(compile_statements(x))
+    p = forms[-1]
+    if isinstance(p, list) and len(p) > 0 and p[0] is Symbol.cond and all(len(x) > 1 for x in p[1:]):
+        orelse = []
+        for clause in reversed(p[1:]):
+            if clause[0] is Symbol.else_:
+                orelse = compile_body(clause[1:])
+            else:
+                orelse = [ast.If(build_ast(clause[0]), compile_body(clause[1:]), orelse)]
+        return body + orelse
+    if isinstance(p, list) and len(p) > 2 and p[0] is Symbol.when:
+        return body + [ast.If(build_ast(p[1]), compile_body(p[2:]), [])]
+    if isinstance(p, list) and len(p) > 0 and isinstance(p[0], Symbol) and p[0] in LoopFuncs:
+        loop, result = LoopFuncs[p[0]](p)
+        return body + loop + [ast.Return(result)]
+    last = make_stmt(build_ast(p))
+    if isinstance(last, ast.Expr):
+        last = ast.Return(last.value)
+    return body + [last]
+
+def compile_statements(p):
+    """Statements that evaluate p for its effect.
+
+    Loops become Python loop statements here, so that set! in their body
+    assigns to the enclosing function or module.
+    """
+    if isinstance(p, list) and len(p) > 0 and isinstance(p[0], Symbol) and p[0] in LoopFuncs:
+        loop, result = LoopFuncs[p[0]](p)
+        if isinstance(result, ast.Constant) and result.value is None:
+            return loop
+        return loop + [ast.Expr(result)]
+    return [make_stmt(build_ast(p))]
+
+def _none():
+    return ast.Constant(None)
+
+def _assign(names, values):
+    if len(names) == 1:
+        return ast.Assign([ast.Name(names[0], ast.Store())], values[0])
+    return ast.Assign([ast.Tuple([ast.Name(x, ast.Store()) for x in names], ast.Store())], ast.Tuple(values, ast.Load()))
+
+def _capture(body, names):
+    """Give the lambdas in a loop body the loop variables they use as
+    keyword-only defaults, so that each keeps the values of its own pass,
+    as with the fresh frame the interpreter makes for every pass.
+
+    >>> from psil import interpreter
+    >>> interpreter.Compile = True
+    >>> try:
+    ...     interpreter.psil('''
+    ...         (define fs (list))
+    ...         (dotimes (i 3) (.append fs (lambda () (display "x") i)))
+    ...         (print (make-list (map (lambda (f) (f)) fs)))''')
+    ... finally:
+    ...     interpreter.Compile = False
+    xxx[0, 1, 2]
+    """
+    for node in ast.walk(ast.Module(body, [])):
+        if isinstance(node, ast.Lambda):
+            args = node.args
+            params = set(x.arg for x in args.args + args.kwonlyargs)
+            used = set(x.id for x in ast.walk(node) if isinstance(x, ast.Name) and isinstance(x.ctx, ast.Load))
+            free = sorted(x for x in used & set(names) if x not in params)
+            args.kwonlyargs = args.kwonlyargs + [ast.arg(arg=x) for x in free]
+            args.kw_defaults = args.kw_defaults + [ast.Name(x, ast.Load()) for x in free]
+    return body
+
+def _loop_body(forms, names = ()):
+    body = []
+    for x in forms:
+        body.extend(compile_statements(x))
+    return _capture(_checked(body), names) or [ast.Pass()]
+
+def loop_while(p):
+    return [ast.While(build_ast(p[1]), _loop_body(p[2:]), [])], _none()
+
+def loop_for(p):
+    seq = build_ast(p[1][1])
+    if p[0] is Symbol.dotimes:
+        seq = ast.Call(ast.Name("range", ast.Load()), [seq], [])
+    result = build_ast(p[1][2]) if len(p[1]) > 2 else _none()
+    name = pydent(p[1][0].name)
+    return [ast.For(ast.Name(name, ast.Store()), seq, _loop_body(p[2:], [name]), [])], result
+
+def loop_do(p):
+    names = [pydent(b[0].name) for b in p[1]]
+    steps = [b for b in p[1] if len(b) > 2]
+    body = _loop_body(p[3:], names)
+    if steps:
+        body = [x for x in body if not isinstance(x, ast.Pass)] + [_assign([pydent(b[0].name) for b in steps], [build_ast(b[2]) for b in steps])]
+    r = [_assign(names, [build_ast(b[1]) for b in p[1]]), ast.While(ast.UnaryOp(ast.Not(), build_ast(p[2][0])), body, [])]
+    for x in p[2][1:-1]:
+        r.extend(compile_statements(x))
+    return r, build_ast(p[2][-1]) if len(p[2]) > 1 else _none()
+
+LoopFuncs = {
+    Symbol.while_: loop_while,
+    Symbol.dotimes: loop_for,
+    Symbol.for_: loop_for,
+    Symbol.do: loop_do,
+}
+
+def compile_loop(p):
+    # a loop used for its value runs in a function of its own
+    loop, result = LoopFuncs[p[0]](p)
+    return ast.Call(ast.Lambda(ast.arguments(posonlyargs=[], args=[], kwonlyargs=[], defaults=[], kw_defaults=[]), loop + [result]), [], [])
+
+def _self_tail_calls(p, name, arity, tail):
+    """Is every use of name in p a call with arity arguments in tail
+    position?"""
+    if p is name:
+        return False
+    if not isinstance(p, list) or not p or p[0] is Symbol.quote:
+        return True
+    head = p[0]
+    if head is name:
+        return tail and len(p) == arity + 1 and all(_self_tail_calls(x, name, arity, False) for x in p[1:])
+    if head is Symbol.if_:
+        return _self_tail_calls(p[1], name, arity, False) and all(_self_tail_calls(x, name, arity, tail) for x in p[2:])
+    if head is Symbol.cond and all(len(x) > 1 for x in p[1:]):
+        return all(_self_tail_calls(x[:-1], name, arity, False) and _self_tail_calls(x[-1], name, arity, tail) for x in p[1:])
+    if head is Symbol.when and len(p) > 2:
+        return _self_tail_calls(p[:-1], name, arity, False) and _self_tail_calls(p[-1], name, arity, tail)
+    return all(_self_tail_calls(x, name, arity, False) for x in p)
+
+def named_let_loops(p):
+    """Can the named let p run as a while loop?"""
+    return all(_self_tail_calls(x, p[1], len(p[2]), False) for x in p[3:-1]) and _self_tail_calls(p[-1], p[1], len(p[2]), True)
+
+def _named_let_tail(p, name, names):
+    if isinstance(p, list) and len(p) > 0:
+        if p[0] is name:
+            return [_assign(names, [build_ast(x) for x in p[1:]]), ast.Continue()]
+        if p[0] is Symbol.if_:
+            return [ast.If(build_ast(p[1]), _named_let_tail(p[2], name, names), _named_let_tail(p[3], name, names) if len(p) > 3 else [ast.Return(_none())])]
+        if p[0] is Symbol.cond and all(len(x) > 1 for x in p[1:]):
+            orelse = [ast.Return(_none())]
+            for clause in reversed(p[1:]):
+                if clause[0] is Symbol.else_:
+                    orelse = _named_let_body(clause[1:], name, names)
+                else:
+                    orelse = [ast.If(build_ast(clause[0]), _named_let_body(clause[1:], name, names), orelse)]
+            return orelse
+        if p[0] is Symbol.when and len(p) > 2:
+            return [ast.If(build_ast(p[1]), _named_let_body(p[2:], name, names), [ast.Return(_none())])]
+    r = compile_body([p])
+    if not isinstance(r[-1], ast.Return):
+        r.append(ast.Return(_none()))
+    return r
+
+def _named_let_body(forms, name, names):
+    body = []
+    for x in forms[:-1]:
+        body.extend(compile_statements(x))
+    return body + _named_let_tail(forms[-1], name, names)
+
+def compile_named_let(p):
+    """
+    A named let whose only uses of its name are calls in tail position
+    becomes a while loop; otherwise it is a recursive local function.
+    """
+    names = [pydent(b[0].name) for b in p[2]]
+    inits = [build_ast(b[1]) for b in p[2]]
+    if named_let_loops(p):
+        args = ast.arguments(posonlyargs=[], args=[ast.arg(arg=x) for x in names], kwonlyargs=[], defaults=[], kw_defaults=[])
+        loop = ast.While(ast.Constant(True), _capture(_checked(_named_let_body(p[3:], p[1], names)), names), [])
+        return ast.Call(ast.Lambda(args, [loop]), inits, [])
+    fn = [Symbol.define, [p[1]] + [b[0] for b in p[2]]] + p[3:]
+    return ast.Call(ast.Call(compile_lambda([Symbol.lambda_, [], fn, p[1]]), [], []), inits, [])
+
 def compile_define(p):
     if isinstance(p[1], list):
-        body = [make_stmt(build_ast(x)) for x in p[2:]]
-        if isinstance(body[-1], ast.Expr):
-            body[-1] = ast.Return(body[-1].value)
-        return ast.FunctionDef(pydent(p[1][0].name), ast.arguments(args=[ast.arg(arg=x.name) for x in p[1][1:]], kwonlyargs=[], defaults=[], kw_defaults=[]), body, [], None)
+        body = _checked(compile_body(p[2:]))
+        return ast.FunctionDef(pydent(p[1][0].name), ast.arguments(posonlyargs=[], args=[ast.arg(arg=x.name) for x in p[1][1:]], kwonlyargs=[], defaults=[], kw_defaults=[]), body, [], None)
     else:
         return ast.Assign([ast.Name(pydent(p[1].name), ast.Store())], build_ast(p[2]))
 
 def compile_divide(p):
     if len(p) == 2:
-        return ast.BinOp(ast.Num(1), ast.Div(), build_ast(p[1]))
+        return ast.BinOp(ast.Constant(1), ast.Div(), build_ast(p[1]))
     elif len(p) == 3:
         return ast.BinOp(build_ast(p[1]), ast.Div(), build_ast(p[2]))
     else:
         return ast.BinOp(compile_divide(p[:-1]), ast.Div(), build_ast(p[-1]))
 
 def compile_floordivide(p):
+    # like the builtin, (// x) is x
     if len(p) == 2:
-        return ast.BinOp(ast.Num(1), ast.FloorDiv(), build_ast(p[1]))
+        return build_ast(p[1])
     elif len(p) == 3:
         return ast.BinOp(build_ast(p[1]), ast.FloorDiv(), build_ast(p[2]))
     else:
-        return ast.BinOp(compile_divide(p[:-1]), ast.FloorDiv(), build_ast(p[-1]))
+        return ast.BinOp(compile_floordivide(p[:-1]), ast.FloorDiv(), build_ast(p[-1]))
+
+def compile_bitand(p):
+    if len(p) == 1:
+        return ast.Constant(-1)
+    if len(p) == 2:
+        return build_ast(p[1])
+    return ast.BinOp(compile_bitand(p[:-1]), ast.BitAnd(), build_ast(p[-1]))
+
+def compile_compare(op):
+    """A chained comparison, true for fewer than two operands as with
+    the builtins."""
+    def compile_op(p):
+        if len(p) < 3:
+            return compile_sequence(p[1:] + [True])
+        return ast.Compare(build_ast(p[1]), [op() for x in p[2:]], [build_ast(x) for x in p[2:]])
+    return compile_op
 
-def compile_equals(p):
-    return ast.Compare(build_ast(p[1]), [ast.Eq() for x in p[2:]], [build_ast(x) for x in p[2:]])
+def compile_make_hash(p):
+    return ast.Dict([build_ast(x) for x in p[1::2]], [build_ast(x) for x in p[2::2]])
+
+def compile_hash_ref(p):
+    if len(p) == 3:
+        return ast.Subscript(build_ast(p[1]), build_ast(p[2]), ast.Load())
+    return ast.Call(ast.Attribute(build_ast(p[1]), "get", ast.Load()), [build_ast(p[2]), build_ast(p[3])], [])
+
+def compile_hash_update(p):
+    # the table and key are used twice, so only simple ones are inlined
+    if isinstance(p[1], list) or isinstance(p[2], list):
+        return ast.Call(ast.Name("hash-update!", ast.Load()), [build_ast(x) for x in p[1:]], [])
+    old = compile_hash_ref([p[0], p[1], p[2]] + p[4:])
+    return ast.Call(ast.Attribute(build_ast(p[1]), "__setitem__", ast.Load()), [build_ast(p[2]), ast.Call(build_ast(p[3]), [old], [])], [])
+
+def compile_set_of(p):
+    if len(p) == 1:
+        return ast.Call(ast.Name("set-of", ast.Load()), [], [])
+    return ast.Set([build_ast(x) for x in p[1:]])
 
 def compile_lambda(p):
+    if limits.CompileChecks:
+        p = p[:2] + [[Symbol.new("check-limits")]] + p[2:]
     if len(p) > 3:
-        return ast.Lambda(ast.arguments(args=[ast.arg(arg=x.name) for x in p[1]], kwonlyargs=[], defaults=[], kw_defaults=[]), [build_ast(x) for x in p[2:]])
+        return ast.Lambda(ast.arguments(posonlyargs=[], args=[ast.arg(arg=x.name) for x in p[1]], kwonlyargs=[], defaults=[], kw_defaults=[]), [build_ast(x) for x in p[2:]])
     else:
-        return ast.Lambda(ast.arguments(args=[ast.arg(arg=x.name) for x in p[1]], kwonlyargs=[], defaults=[], kw_defaults=[]), build_ast(p[2]))
+        return ast.Lambda(ast.arguments(posonlyargs=[], args=[ast.arg(arg=x.name) for x in p[1]], kwonlyargs=[], defaults=[], kw_defaults=[]), build_ast(p[2]))
+
+def compile_method(name):
+    return lambda p: ast.Call(ast.Attribute(build_ast(p[1]), name, ast.Load()), [build_ast(x) for x in p[2:]], [])
 
 def compile_multiply(p):
+    if len(p) == 1:
+        return ast.Constant(1)
     if len(p) == 2:
         return build_ast(p[1])
     elif len(p) == 3:
@@ -91,15 +365,102 @@ def compile_multiply(p):
     else:
         return ast.BinOp(compile_multiply(p[:-1]), ast.Mult(), build_ast(p[-1]))
 
+def quoted_value(p):
+    if isinstance(p, Node):
+        _local.context.nodes = True
+        return ast.Call(ast.Name("_psil_node", ast.Load()), [ast.List([quoted_value(x) for x in p], ast.Load())], [])
+    elif isinstance(p, list):
+        return ast.List([quoted_value(x) for x in p], ast.Load())
+    elif isinstance(p, tuple):
+        return ast.Tuple([quoted_value(x) for x in p], ast.Load())
+    elif isinstance(p, Symbol):
+        return ast.Call(ast.Attribute(ast.Name("_psil_Symbol", ast.Load()), "new", ast.Load()), [ast.Constant(p.name)], [])
+    else:
+        return ast.Constant(p)
+
+# Quoted lists and symbols are built once, by assignments to module level
+# names that psilc places in front of the compiled form.
+class Context(object):
+    """The state of compiling the forms of one module. The names given
+    to quoted data and to lifted lambdas are numbered across all the forms,
+    so that no form rebinds a name an earlier one still uses.
+
+    >>> from psil import interpreter
+    >>> interpreter.Compile = True
+    >>> try:
+    ...     interpreter.psil('''
+    ...         (define f (lambda (l) (make-list (map (lambda (y) (display "") (+ y 1)) l))))
+    ...         (define g (lambda (l) (make-list (map (lambda (y) (display "") (* y 2)) l))))
+    ...         (print (f '(1 2)) (g '(3 4)))''')
+    ... finally:
+    ...     interpreter.Compile = False
+    [2, 3] [6, 8]
+
+    A lifted lambda inside one that is not lifted takes that one with it,
+    so that it still sees the outer parameters:
+
+    >>> interpreter.Compile = True
+    >>> try:
+    ...     interpreter.psil('''
+    ...         (define f (lambda (x) (make-list (map (lambda (y) (display "") (+ x y)) '(1 2)))))
+    ...         (print (f 10))''')
+    ... finally:
+    ...     interpreter.Compile = False
+    [11, 12]
+    """
+    def __init__(self):
+        self.quotes = 0
+        self.lambdas = 0
+        # assignments for the form being compiled
+        self.hoisted = []
+        # whether they build hashcons Nodes
+        self.nodes = False
+        # names imported for them by earlier forms
+        self.imported = set()
+
+# the Context of the psilc call running in this thread
+_local = threading.local()
+
 def compile_quote(p):
-    def q(p):
-        if isinstance(p, list):
-            return ast.List([q(x) for x in p], ast.Load())
-        elif isinstance(p, Symbol):
-            return ast.Call(ast.Attribute(ast.Name("sys", ast.Load()), "intern", ast.Load()), [ast.Str(p.name)], [], None, None)
+    if isinstance(p[1], (str, int, float)):
+        return quoted_value(p[1])
+    context = _local.context
+    context.quotes += 1
+    name = "_quote_{0}".format(context.quotes)
+    context.hoisted.append(ast.Assign([ast.Name(name, ast.Store())], quoted_value(p[1])))
+    return ast.Name(name, ast.Load())
+
+def compile_quasi(t, depth):
+    if not any(True for x in quasiquote_holes(t, depth)):
+        return compile_quote([Symbol.quote, t])
+    if t[0] is Symbol.unquote:
+        if depth == 1:
+            return build_ast(t[1])
+        return ast.List([compile_quote([Symbol.quote, t[0]]), compile_quasi(t[1], depth - 1)], ast.Load())
+    if t[0] is Symbol.quasiquote:
+        return ast.List([compile_quote([Symbol.quote, t[0]]), compile_quasi(t[1], depth + 1)], ast.Load())
+    pieces = []
+    current = []
+    for x in t:
+        if isinstance(x, list) and len(x) > 0 and x[0] is Symbol.unquote_splicing:
+            if depth == 1:
+                if current:
+                    pieces.append(ast.List(current, ast.Load()))
+                    current = []
+                pieces.append(ast.Call(ast.Name("make-list", ast.Load()), [build_ast(x[1])], []))
+            else:
+                current.append(ast.List([compile_quote([Symbol.quote, x[0]]), compile_quasi(x[1], depth - 1)], ast.Load()))
         else:
-            return ast.Num(p)
-    return q(p[1])
+            current.append(compile_quasi(x, depth))
+    if current:
+        pieces.append(ast.List(current, ast.Load()))
+    r = pieces[0]
+    for x in pieces[1:]:
+        r = ast.BinOp(r, ast.Add(), x)
+    return r
+
+def compile_quasiquote(p):
+    return compile_quasi(p[1], 1)
 
 def compile_subtract(p):
     if len(p) == 2:
@@ -116,52 +477,93 @@ CompileFuncs = {
     Symbol.new("/"): compile_divide,
     Symbol.new("//"): compile_floordivide,
     Symbol.new("%"): lambda p: ast.BinOp(build_ast(p[1]), ast.Mod(), build_ast(p[2])),
-    Symbol.new("&"): lambda p: ast.BinOp(build_ast(p[1]), ast.BitAnd(), build_ast(p[2])),
+    Symbol.new("&"): compile_bitand,
     Symbol.new("**"): lambda p: ast.BinOp(build_ast(p[1]), ast.Pow(), build_ast(p[2])),
     Symbol.new(">>"): lambda p: ast.BinOp(build_ast(p[1]), ast.RShift(), build_ast(p[2])),
     Symbol.new("<<"): lambda p: ast.BinOp(build_ast(p[1]), ast.LShift(), build_ast(p[2])),
     Symbol.new("^"): lambda p: ast.BinOp(build_ast(p[1]), ast.BitXor(), build_ast(p[2])),
-    Symbol.new("<"): lambda p: ast.Compare(build_ast(p[1]), [ast.Lt() for x in p[1::2]], [build_ast(x) for x in p[2::2]]),
-    Symbol.new(">"): lambda p: ast.Compare(build_ast(p[1]), [ast.Gt() for x in p[1::2]], [build_ast(x) for x in p[2::2]]),
-    Symbol.new("<="): lambda p: ast.Compare(build_ast(p[1]), [ast.LtE() for x in p[1::2]], [build_ast(x) for x in p[2::2]]),
-    Symbol.new(">="): lambda p: ast.Compare(build_ast(p[1]), [ast.GtE() for x in p[1::2]], [build_ast(x) for x in p[2::2]]),
-    Symbol.new("=="): compile_equals,
-    Symbol.new("!="): lambda p: ast.Compare(build_ast(p[1]), [ast.NotEq() for x in p[1::2]], [build_ast(x) for x in p[2::2]]),
-    Symbol.new("is"): lambda p: ast.Compare(build_ast(p[1]), [ast.Is() for x in p[1::2]], [build_ast(x) for x in p[2::2]]),
-    Symbol.new("is-not"): lambda p: ast.Compare(build_ast(p[1]), [ast.IsNot() for x in p[1::2]], [build_ast(x) for x in p[2::2]]),
+    Symbol.new("<"): compile_compare(ast.Lt),
+    Symbol.new(">"): compile_compare(ast.Gt),
+    Symbol.new("<="): compile_compare(ast.LtE),
+    Symbol.new(">="): compile_compare(ast.GtE),
+    Symbol.new("=="): compile_compare(ast.Eq),
+    Symbol.new("!="): compile_compare(ast.NotEq),
+    Symbol.new("is"): compile_compare(ast.Is),
+    Symbol.new("is-not"): compile_compare(ast.IsNot),
     Symbol.new("define"): compile_define,
-    Symbol.new("dict-set"): lambda p: ast.Assign([ast.Subscript(build_ast(p[1]), ast.Index(build_ast(p[2])), ast.Store())], build_ast(p[3])),
+    Symbol.new("dict-set"): lambda p: ast.Assign([ast.Subscript(build_ast(p[1]), build_ast(p[2]), ast.Store())], build_ast(p[3])),
     #Symbol.new("caadr"): lambda p: compiler.ast.Subscript(compiler.ast.Subscript(build_ast(p[1]), 0, compiler.ast.Const(1)), 0, compiler.ast.Const(0)),
-    Symbol.new("caar"): lambda p: ast.Subscript(ast.Subscript(build_ast(p[1]), ast.Index(ast.Num(0)), ast.Load()), ast.Index(ast.Num(0)), ast.Load()),
+    Symbol.new("caar"): lambda p: ast.Subscript(ast.Subscript(build_ast(p[1]), ast.Constant(0), ast.Load()), ast.Constant(0), ast.Load()),
     #Symbol.new("cadddr"): lambda p: compiler.ast.Subscript(build_ast(p[1]), 0, compiler.ast.Const(3)),
     #Symbol.new("caddr"): lambda p: compiler.ast.Subscript(build_ast(p[1]), 0, compiler.ast.Const(2)),
-    Symbol.new("cadr"): lambda p: ast.Subscript(build_ast(p[1]), ast.Index(ast.Num(1)), ast.Load()),
-    Symbol.new("car"): lambda p: ast.Subscript(build_ast(p[1]), ast.Index(ast.Num(0)), ast.Load()),
-    Symbol.new("cdar"): lambda p: ast.Subscript(ast.Subscript(build_ast(p[1]), ast.Index(ast.Num(0)), ast.Load()), ast.Slice(ast.Num(1), None, None), ast.Load()),
+    Symbol.new("cadr"): lambda p: ast.Subscript(build_ast(p[1]), ast.Constant(1), ast.Load()),
+    Symbol.new("car"): lambda p: ast.Subscript(build_ast(p[1]), ast.Constant(0), ast.Load()),
+    Symbol.new("cdar"): lambda p: ast.Subscript(ast.Subscript(build_ast(p[1]), ast.Constant(0), ast.Load()), ast.Slice(ast.Constant(1), None, None), ast.Load()),
     #Symbol.new("cddr"): lambda p: compiler.ast.Slice(build_ast(p[1]), 0, compiler.ast.Const(2), None),
-    Symbol.new("cdr"): lambda p: ast.Subscript(build_ast(p[1]), ast.Slice(ast.Num(1), None, None), ast.Load()),
-    Symbol.new("cons"): lambda p: ast.BinOp(ast.List([build_ast(p[1])], ast.Load()), ast.Add(), build_ast(p[2])),
-    #Symbol.new("append"): lambda p: ast.Call(ast.Attribute(ast.Name("functools", ast.Load()), "reduce", ast.Load()), [ast.Attribute(ast.Name("operator", ast.Load()), "add", ast.Load()), build_ast(p[1])], [], None, None),
-    #Symbol.new("apply"): lambda p: ast.Call(build_ast(p[1]), [build_ast(p[2])], [], None, None),
-    Symbol.new("if"): lambda p: ast.IfExp(build_ast(p[1]), build_ast(p[2]), build_ast(p[3]) if len(p) >= 4 else ast.Name("None", ast.Load())),
-    Symbol.new("in"): lambda p: ast.Compare(build_ast(p[1]), [ast.In() for x in p[1::2]], [build_ast(x) for x in p[2::2]]),
-    Symbol.new("index"): lambda p: ast.Subscript(build_ast(p[1]), ast.Index(build_ast(p[2])), ast.Load()),
+    Symbol.new("cdr"): lambda p: ast.Subscript(build_ast(p[1]), ast.Slice(ast.Constant(1), None, None), ast.Load()),
+    # a copy as in the builtin, which also takes frozen quoted data
+    Symbol.new("cons"): lambda p: ast.BinOp(ast.List([build_ast(p[1])], ast.Load()), ast.Add(), ast.Call(ast.Name("make-list", ast.Load()), [build_ast(p[2])], [])),
+    #Symbol.new("append"): lambda p: ast.Call(ast.Attribute(ast.Name("functools", ast.Load()), "reduce", ast.Load()), [ast.Attribute(ast.Name("operator", ast.Load()), "add", ast.Load()), build_ast(p[1])], []),
+    #Symbol.new("apply"): lambda p: ast.Call(build_ast(p[1]), [build_ast(p[2])], []),
+    Symbol.new("if"): lambda p: ast.IfExp(build_ast(p[1]), build_ast(p[2]), build_ast(p[3]) if len(p) >= 4 else ast.Constant(None)),
+    Symbol.new("in"): compile_compare(ast.In),
+    Symbol.new("index"): lambda p: ast.Subscript(build_ast(p[1]), build_ast(p[2]), ast.Load()),
     Symbol.new("lambda"): compile_lambda,
     Symbol.new("list"): lambda p: ast.List([build_ast(x) for x in p[1:]], ast.Load()),
-    #Symbol.new("make-list"): lambda p: ast.Call(ast.Name("list", ast.Load()), [build_ast(x) for x in p[1:]], [], None, None),
+    #Symbol.new("make-list"): lambda p: ast.Call(ast.Name("list", ast.Load()), [build_ast(x) for x in p[1:]], []),
     Symbol.new("not"): lambda p: ast.UnaryOp(ast.Not(), build_ast(p[1])),
-    Symbol.new("not-in"): lambda p: ast.Compare(build_ast(p[1]), [ast.NotIn() for x in p[1::2]], [build_ast(x) for x in p[2::2]]),
+    Symbol.new("not-in"): compile_compare(ast.NotIn),
+    Symbol.new("quasiquote"): compile_quasiquote,
     Symbol.new("quote"): compile_quote,
-    Symbol.new("reverse"): lambda p: ast.Call(ast.Name("reversed", ast.Load()), [build_ast(p[1])], [], None, None),
+    Symbol.new("reverse"): lambda p: ast.Call(ast.Name("reversed", ast.Load()), [build_ast(p[1])], []),
     Symbol.new("set!"): lambda p: ast.Assign([ast.Name(p[1].name, ast.Store())], build_ast(p[2])),
     Symbol.new("slice"): lambda p: ast.Subscript(build_ast(p[1]), ast.Slice(build_ast(p[2]), build_ast(p[3]), None), ast.Load()),
-    Symbol.new("string->symbol"): lambda p: ast.Call(ast.Name("intern"), [build_ast(p[1])], None, None, None),
+    Symbol.new("assoc"): compile_method("assoc"),
+    Symbol.new("dissoc"): compile_method("dissoc"),
+    Symbol.new("update"): compile_method("update"),
+    Symbol.new("lookup"): compile_method("lookup"),
+    Symbol.new("conj"): compile_method("conj"),
+    Symbol.new("transient"): compile_method("transient"),
+    Symbol.new("assoc!"): compile_method("assoc"),
+    Symbol.new("dissoc!"): compile_method("dissoc"),
+    Symbol.new("conj!"): compile_method("conj"),
+    Symbol.new("persistent!"): compile_method("persistent"),
+    Symbol.new("and"): compile_and,
+    Symbol.new("or"): compile_or,
+    Symbol.new("cond"): compile_cond,
+    Symbol.new("when"): compile_when,
+    Symbol.new("while"): compile_loop,
+    Symbol.new("dotimes"): compile_loop,
+    Symbol.new("for"): compile_loop,
+    Symbol.new("do"): compile_loop,
+    Symbol.new("named-let"): compile_named_let,
+    Symbol.new("make-hash"): compile_make_hash,
+    Symbol.new("hash-ref"): compile_hash_ref,
+    Symbol.new("hash-set!"): compile_method("__setitem__"),
+    Symbol.new("hash-update!"): compile_hash_update,
+    Symbol.new("hash-has-key?"): lambda p: ast.Compare(build_ast(p[2]), [ast.In()], [build_ast(p[1])]),
+    Symbol.new("hash-count"): lambda p: ast.Call(ast.Name("len", ast.Load()), [build_ast(p[1])], []),
+    Symbol.new("set-of"): compile_set_of,
+    Symbol.new("set-member?"): lambda p: ast.Compare(build_ast(p[2]), [ast.In()], [build_ast(p[1])]),
+    Symbol.new("set-add!"): compile_method("add"),
+    Symbol.new("set-remove!"): compile_method("discard"),
+    Symbol.new("set-union"): compile_method("union"),
+    Symbol.new("set-intersect"): compile_method("intersection"),
+    Symbol.new("set-subtract"): compile_method("difference"),
 }
 
+# symbols that name Python constants, which ast.Name cannot hold
+Constants = {"None": None, "True": True, "False": False}
+
 def build_ast(p, tail = False):
     """
-    #>>> build_ast(parse(tokenise("(+ 2 3)")))
-    #Add((Const(2), Const(3)))
+    >>> from psil import interpreter
+    >>> interpreter.Compile = True
+    >>> try:
+    ...     interpreter.psil("(print None True False (if True 1 2))")
+    ... finally:
+    ...     interpreter.Compile = False
+    None True False 1
     """
     if isinstance(p, list):
         if isinstance(p[0], Symbol):
@@ -169,59 +571,115 @@ def build_ast(p, tail = False):
             if f:
                 return f(p)
             elif p[0].name.startswith("."):
-                return ast.Call(ast.Attribute(build_ast(p[1]), p[0].name[1:], ast.Load()), [build_ast(x) for x in p[2:]], [], None, None)
+                return ast.Call(ast.Attribute(build_ast(p[1]), p[0].name[1:], ast.Load()), [build_ast(x) for x in p[2:]], [])
             else:
-                return ast.Call(ast.Name(pydent(p[0].name), ast.Load()), [build_ast(x) for x in p[1:]], [], None, None)
+                return ast.Call(ast.Name(pydent(p[0].name), ast.Load()), [build_ast(x) for x in p[1:]], [])
         else:
-            return ast.Call(build_ast(p[0]), [build_ast(x) for x in p[1:]], [], None, None)
+            return ast.Call(build_ast(p[0]), [build_ast(x) for x in p[1:]], [])
     elif isinstance(p, Symbol):
+        if p.keyword:
+            # keywords evaluate to themselves
+            return compile_quote([Symbol.quote, p])
+        if p.name in Constants:
+            return ast.Constant(Constants[p.name])
         return ast.Name(pydent(p.name), ast.Load())
     elif isinstance(p, str):
-        return ast.Str(p)
+        return ast.Constant(p)
     elif isinstance(p, (int, float)):
-        return ast.Num(p)
+        return ast.Constant(p)
     else:
         print("unexpected object:", p, file=sys.stderr)
         sys.exit(1)
 
 class LiftLambda(ast.NodeTransformer):
-    def __init__(self):
-        self.counter = 0
+    def __init__(self, context):
+        self.context = context
         self.lifted = []
-    def visit_FunctionDef(self, node):
+    def body(self, stmts):
+        """Visit stmts, putting the functions lifted out of each one just
+        in front of it, so that they are made again on each pass of a
+        loop and see its variables."""
+        outer = self.lifted
         body = []
-        for s in node.body:
+        for s in stmts:
+            self.lifted = []
             r = self.visit(s)
-            if self.lifted:
-                body.extend(self.lifted)
-                self.lifted = []
+            body.extend(self.lifted)
             body.append(r)
-        return ast.FunctionDef(node.name, node.args, body, node.decorator_list, node.returns)
+        self.lifted = outer
+        return body
+    def visit_FunctionDef(self, node):
+        return ast.FunctionDef(node.name, node.args, self.body(node.body), node.decorator_list, node.returns)
+    def visit_For(self, node):
+        node.target = self.visit(node.target)
+        node.iter = self.visit(node.iter)
+        node.body = self.body(node.body)
+        node.orelse = self.body(node.orelse)
+        return node
+    def visit_While(self, node):
+        node.test = self.visit(node.test)
+        node.body = self.body(node.body)
+        node.orelse = self.body(node.orelse)
+        return node
+    visit_If = visit_While
     def visit_Lambda(self, node):
         if isinstance(node.body, list):
-            self.counter += 1
-            name = "_lambda_{0}".format(self.counter)
-            self.lifted.append(ast.FunctionDef(name, node.args, [make_stmt(self.visit(x)) for x in node.body[:-1] + [node.body[-1] if isinstance(node.body[-1], AstStatements) else ast.Return(node.body[-1])]], [], None))
-            return ast.Name(name, ast.Load())
+            body = [make_stmt(x) for x in node.body[:-1] + [node.body[-1] if isinstance(node.body[-1], AstStatements) else ast.Return(node.body[-1])]]
         elif isinstance(node.body, AstStatements):
-            self.counter += 1
-            name = "_lambda_{0}".format(self.counter)
-            self.lifted.append(ast.FunctionDef(name, node.args, [self.visit(node.body)], [], None))
-            return ast.Name(name, ast.Load())
+            body = [node.body]
         else:
-            return self.generic_visit(node)
+            # a lambda lifted out of this one must go into its body to
+            # see its parameters, so then this one is lifted as well
+            outer = self.lifted
+            self.lifted = []
+            node = self.generic_visit(node)
+            inner, self.lifted = self.lifted, outer
+            if not inner:
+                return node
+            self.context.lambdas += 1
+            name = "_lambda_{0}".format(self.context.lambdas)
+            self.lifted = outer + [ast.FunctionDef(name, node.args, inner + [ast.Return(node.body)], [], None)]
+            return ast.Name(name, ast.Load())
+        self.context.lambdas += 1
+        name = "_lambda_{0}".format(self.context.lambdas)
+        # lambdas inside this one are lifted into its body, where they
+        # can still see its locals
+        outer = self.lifted
+        self.lifted = []
+        fn = self.visit_FunctionDef(ast.FunctionDef(name, node.args, body, [], None))
+        self.lifted = outer + [fn]
+        return ast.Name(name, ast.Load())
 
-def psilc(p):
-    tree = build_ast(p)
+def psilc(p, context = None):
+    """Compile the top level form p to a list of statements. Forms that
+    run in the same module must share a context."""
+    if context is None:
+        context = Context()
+    saved = getattr(_local, "context", None)
+    _local.context = context
+    context.hoisted = []
+    context.nodes = False
+    try:
+        tree = compile_statements(p)
+    finally:
+        _local.context = saved
     def dump(node, depth):
         print("  "*depth, node, sep="")
         for x in ast.iter_child_nodes(node):
             dump(x, depth+1)
     #print("ast:")
-    #dump(tree, 0)
-    lift = LiftLambda()
-    tree = lift.visit(tree)
-    if lift.lifted:
-        return ast.TryFinally(lift.lifted + [make_stmt(tree)], [])
-    else:
-        return make_stmt(tree)
+    #for x in tree: dump(x, 0)
+    lift = LiftLambda(context)
+    tree = [lift.visit(x) for x in tree]
+    prefix = []
+    imports = []
+    if context.hoisted:
+        imports.append(("psil.symbol", "Symbol", "_psil_Symbol"))
+    if context.nodes:
+        imports.append(("psil.hashcons", "node", "_psil_node"))
+    for module, name, asname in imports:
+        if asname not in context.imported:
+            context.imported.add(asname)
+            prefix.append(ast.ImportFrom(module, [ast.alias(name, asname)], 0))
+    prefix.extend(context.hoisted)
+    return prefix + lift.lifted + tree
@@ -1,18 +1,39 @@
 import ast
+import keyword
+import re
 import sys
 
+RE_IDENT = re.compile(r"[A-Za-z_][A-Za-z0-9_]*$")
+
 class SourceGenerator(object):
     def __init__(self):
-        self.source = ""
+        self.lines = []
         self.depth = 0
     def line(self, s):
-        self.source += "    "*self.depth + s + "\n"
+        self.lines.append("    "*self.depth + s + "\n")
     def indent(self):
         self.depth += 1
     def dedent(self):
         self.depth -= 1
     def __str__(self):
-        return self.source
+        return "".join(self.lines)
+
+def ident(s):
+    """
+    >>> ident("foo")
+    'foo'
+    >>> ident("make-list")
+    'make_2d_list'
+    >>> ident("null?")
+    'null_3f_'
+    >>> ident("if")
+    'if_'
+    """
+    if RE_IDENT.match(s):
+        if keyword.iskeyword(s):
+            return s + "_"
+        return s
+    return "".join(c if c.isalnum() or c == "_" else "_%02x_" % ord(c) for c in s)
 
 #InlineFuncs = {
 #    "+": "(lambda *x: sum(x))",
@@ -33,6 +54,8 @@ def operator(op):
         return "+"
     elif isinstance(op, ast.BitAnd):
         return "&"
+    elif isinstance(op, ast.BitOr):
+        return "|"
     elif isinstance(op, ast.BitXor):
         return "^"
     elif isinstance(op, ast.Div):
@@ -79,53 +102,57 @@ def operator(op):
         print("unhandled operator:", op, file=sys.stderr)
         sys.exit(1)
 
+def params(args):
+    r = [ident(x.arg) for x in args.args]
+    if args.kwonlyargs:
+        r.append("*")
+        r.extend(ident(x.arg) + "=" + expr(d) for x, d in zip(args.kwonlyargs, args.kw_defaults))
+    return ", ".join(r)
+
 def expr(node):
     #print("node:", node)
     if isinstance(node, ast.Attribute):
         return "{0}.{1}".format(expr(node.value), node.attr)
+    elif isinstance(node, ast.BoolOp):
+        return "({0})".format(" {0} ".format("and" if isinstance(node.op, ast.And) else "or").join(expr(x) for x in node.values))
     elif isinstance(node, ast.BinOp):
         return "({0} {1} {2})".format(expr(node.left), operator(node.op), expr(node.right))
     elif isinstance(node, ast.Call):
         func = ("({0})" if isinstance(node.func, ast.Lambda) else "{0}").format(expr(node.func))
-        args = ""
-        if node.args:
-            args += ", ".join(expr(x) for x in node.args)
-        if node.starargs is not None:
-            if len(args) > 0:
-                args += ", "
-            if isinstance(node.starargs, list):
-                args += ", ".join(expr(x) for x in node.starargs)
-            else:
-                args += "*" + expr(node.starargs)
-        return "{0}({1})".format(func, args)
+        args = [expr(x) for x in node.args]
+        args.extend(("**" if x.arg is None else x.arg + "=") + expr(x.value) for x in node.keywords)
+        return "{0}({1})".format(func, ", ".join(args))
     elif isinstance(node, ast.Compare):
         return "({0} {1})".format(expr(node.left), " ".join("{0} {1}".format(operator(op), expr(comp)) for op, comp in zip(node.ops, node.comparators)))
+    elif isinstance(node, ast.Dict):
+        return "{{{0}}}".format(", ".join("{0}: {1}".format(expr(k), expr(v)) for k, v in zip(node.keys, node.values)))
+    elif isinstance(node, ast.Set):
+        return "{{{0}}}".format(", ".join(expr(x) for x in node.elts))
     elif isinstance(node, ast.IfExp):
         return "({1} if {0} else {2})".format(expr(node.test), expr(node.body), expr(node.orelse) if node.orelse else "None")
     elif isinstance(node, ast.Lambda):
-        return "lambda {0}: {1}".format(", ".join(x.arg for x in node.args.args), expr(node.body))
+        return "lambda {0}: {1}".format(params(node.args), expr(node.body))
     elif isinstance(node, ast.List):
         return "[{0}]".format(", ".join(expr(x) for x in node.elts))
-    elif isinstance(node, ast.Num):
-        return repr(node.n)
+    elif isinstance(node, ast.Tuple):
+        return "({0})".format("".join(expr(x) + ", " for x in node.elts).rstrip(" "))
+    elif isinstance(node, ast.Constant):
+        return repr(node.value)
     elif isinstance(node, ast.Name):
         f = None #InlineFuncs.get(node.id)
         if f:
             return f
         else:
-            return node.id
+            return ident(node.id)
+    elif isinstance(node, ast.Starred):
+        return "*" + expr(node.value)
     elif isinstance(node, ast.Subscript):
-        if isinstance(node.slice, ast.Index):
-            return "{0}[{1}]".format(expr(node.value), expr(node.slice.value))
-        elif isinstance(node.slice, ast.Slice):
+        if isinstance(node.slice, ast.Slice):
             return "{0}[{1}:{2}]".format(expr(node.value), expr(node.slice.lower) if node.slice.lower else "", expr(node.slice.upper) if node.slice.upper else "")
         else:
-            print("unhandled slice:", node.slice, file=sys.stderr)
-            sys.exit(1)
+            return "{0}[{1}]".format(expr(node.value), expr(node.slice))
     elif isinstance(node, ast.Pass):
         return "pass"
-    elif isinstance(node, ast.Str):
-        return repr(node.s)
     elif isinstance(node, ast.UnaryOp):
         return "({0}{1})".format(operator(node.op), expr(node.operand))
     else:
@@ -141,23 +168,48 @@ def stmt(node, source):
     elif isinstance(node, ast.Expr):
         source.line(expr(node.value))
     elif isinstance(node, ast.FunctionDef):
-        source.line("def " + node.name + "(" + ", ".join(x.arg for x in node.args.args) + "):")
+        source.line("def " + ident(node.name) + "(" + params(node.args) + "):")
         source.indent()
         stmt(node.body, source)
         source.dedent()
+    elif isinstance(node, ast.ImportFrom):
+        source.line("from {0} import {1}".format(node.module, ", ".join(x.name + (" as " + x.asname if x.asname else "") for x in node.names)))
     elif isinstance(node, ast.If):
-        source.line("if " + expr(node.tests[0][0]) + ":")
-        source.indent()
-        stmt(node.tests[0][1], source)
-        source.dedent()
-        if node.else_:
+        keyword = "if "
+        while True:
+            source.line(keyword + expr(node.test) + ":")
+            source.indent()
+            stmt(node.body, source)
+            source.dedent()
+            if len(node.orelse) == 1 and isinstance(node.orelse[0], ast.If):
+                keyword = "elif "
+                node = node.orelse[0]
+            else:
+                break
+        if node.orelse:
             source.line("else:")
             source.indent()
-            stmt(node.else_, source)
+            stmt(node.orelse, source)
             source.dedent()
     elif isinstance(node, ast.Return):
         source.line("return " + expr(node.value))
-    elif isinstance(node, ast.TryFinally):
+    elif isinstance(node, ast.While):
+        source.line("while " + expr(node.test) + ":")
+        source.indent()
+        stmt(node.body, source)
+        source.dedent()
+    elif isinstance(node, ast.For):
+        source.line("for " + expr(node.target) + " in " + expr(node.iter) + ":")
+        source.indent()
+        stmt(node.body, source)
+        source.dedent()
+    elif isinstance(node, ast.Break):
+        source.line("break")
+    elif isinstance(node, ast.Continue):
+        source.line("continue")
+    elif isinstance(node, ast.Pass):
+        source.line("pass")
+    elif isinstance(node, ast.Try) and not node.handlers:
         source.line("try:")
         source.indent()
         stmt(node.body, source)
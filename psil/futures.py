@@ -0,0 +1,136 @@
+"""Futures: run blocking calls on a pool of threads.
+
+future starts a call on the pool and returns at once; touch waits for
+its value. A future that no thread has started yet is run by the thread
+that touches it, so touching from inside another future never waits on
+work queued behind it.
+
+>>> import time
+>>> f = future(lambda: time.sleep(0.05) or 42)
+>>> g = future(pow, 2, 10)
+>>> touch(f), touch(g), touch(7)
+(42, 1024, 7)
+>>> start = time.time()
+>>> touch_all([future(time.sleep, 0.1) for i in range(4)])
+[None, None, None, None]
+>>> time.time() - start < 0.35
+True
+
+A future writes to the output port that was current where it was made:
+
+>>> with_output_to_string(lambda: touch(future(print, "inside")))
+'inside\\n'
+
+It also runs within the budgets of psil.limits that were active there, so
+a future cannot be used to get around them.
+
+Errors are raised again by touch:
+
+>>> touch(future(int, "x"))
+Traceback (most recent call last):
+  ...
+ValueError: invalid literal for int() with base 10: 'x'
+>>> import sys
+>>> touch(future(sys.exit, 3))
+Traceback (most recent call last):
+  ...
+SystemExit: 3
+
+Futures share Globals with the thread that made them. Definitions and
+set! are single dictionary operations, and the symbol table and memoize
+caches take a lock, so they stay consistent; several futures updating the
+same variable still need to coordinate among themselves.
+"""
+
+import concurrent.futures
+import threading
+
+from . import limits
+from . import ports
+from .ports import with_output_to_string
+
+# Threads in the pool, which is made on first use.
+Workers = 8
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = concurrent.futures.ThreadPoolExecutor(Workers)
+    return _pool
+
+def set_workers(n):
+    """Use a pool of n threads for futures made from now on."""
+    global Workers, _pool
+    with _pool_lock:
+        Workers = n
+        old, _pool = _pool, None
+    if old is not None:
+        old.shutdown(wait=False)
+
+def _run(port, fn, args):
+    if port is None:
+        return fn(*args)
+    return ports.with_output_to(port, lambda: fn(*args))
+
+class Future(object):
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.port = ports.redirected()
+        self.budgets = limits.budgets() if limits.Active else []
+        self.lock = threading.Lock()
+        self.started = False
+        self.finished = threading.Event()
+        self.value = None
+        self.error = None
+    def __str__(self):
+        return "<Future %s>" % ("done" if self.finished.is_set() else "pending")
+    def run(self):
+        """Run the call unless some thread already has; return whether
+        this one did."""
+        with self.lock:
+            if self.started:
+                return False
+            self.started = True
+        try:
+            if self.budgets:
+                self.value = limits.within(self.budgets, lambda: _run(self.port, self.fn, self.args))
+            else:
+                self.value = _run(self.port, self.fn, self.args)
+        except BaseException as x:
+            # including control flow such as a continuation invoked in
+            # the call, which touch passes on to the thread that waits
+            self.error = x
+        finally:
+            self.finished.set()
+        return True
+    def touch(self):
+        if not self.run():
+            self.finished.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+def future(fn, *args):
+    f = Future(fn, args)
+    pool().submit(f.run)
+    return f
+
+def is_future(x):
+    return isinstance(x, Future)
+
+def is_done(f):
+    return f.finished.is_set()
+
+def touch(x):
+    if isinstance(x, Future):
+        return x.touch()
+    return x
+
+def touch_all(xs):
+    return [touch(x) for x in xs]
@@ -0,0 +1,94 @@
+"""Hash-consed, immutable trees for quoted and read data.
+
+intern() turns a tree of lists into Nodes, making each distinct subtree
+only once: equal trees are the same object, so they compare and hash by
+identity in constant time and can be used as dictionary keys. Nodes are
+tuples, so the list builtins, the compiler and external() take them as
+they are, while set-car! and the like fail instead of changing every
+place the tree is shared.
+
+>>> t = intern(read('(rule (match "x" 1) (match "y" 2))'))
+>>> t[1] is intern(read('(match "x" 1)'))
+True
+>>> t is intern(read('(rule (match "x" 1) (match "y" 2))'))
+True
+>>> {t: "found"}[intern(read('(rule (match "x" 1) (match "y" 2))'))]
+'found'
+>>> from psil.interpreter import external
+>>> print(external(t))
+(rule (match "x" 1) (match "y" 2))
+>>> node([1]) is node([1.0])
+False
+>>> node([-0.0]) is node([0.0])
+False
+>>> t[1][0] = 3
+Traceback (most recent call last):
+  ...
+TypeError: 'Node' object does not support item assignment
+
+A Node cannot be weakly referenced, so the table keeps every node made
+for the life of the process, as Symbol.names does for symbols read from
+source. It is meant for data that is loaded once and used many times.
+"""
+
+import sys
+import threading
+
+from .reader import parse, read, tokenise
+
+class Node(tuple):
+    __slots__ = ()
+    # every Node is unique by contents
+    __hash__ = object.__hash__
+    def __eq__(self, other):
+        return self is other
+    def __ne__(self, other):
+        return self is not other
+
+# items of each Node, with Nodes among them hashed by identity -> Node
+_table = {}
+_lock = threading.Lock()
+
+def _key(x):
+    # 1, 1.0 and True are equal, but are different data; so are 0.0 and
+    # -0.0, which hex() tells apart
+    if x.__class__ is float:
+        return (float, x.hex())
+    if x.__class__ is bool:
+        return (bool, x)
+    return x
+
+def node(items):
+    """Return the Node with the given items, which must be Nodes or
+    atoms."""
+    items = tuple(items)
+    key = items
+    if any(x.__class__ is float or x.__class__ is bool for x in items):
+        key = tuple(_key(x) for x in items)
+    n = _table.get(key)
+    if n is None:
+        with _lock:
+            n = _table.setdefault(key, Node(items))
+    return n
+
+def intern(p):
+    """Return tree p with its lists made into shared Nodes."""
+    if isinstance(p, (list, tuple)) and not isinstance(p, Node):
+        return node([intern(x) for x in p])
+    if isinstance(p, str):
+        return sys.intern(p)
+    return p
+
+def read_data(s):
+    """Read all the forms in s as a Node."""
+    tokens = tokenise(s)
+    forms = []
+    while True:
+        p = parse(tokens)
+        if p is None:
+            break
+        forms.append(intern(p))
+    return node(forms)
+
+def table_size():
+    return len(_table)
@@ -11,20 +11,40 @@
 
 """
 
-import ast
-import functools
-import operator
+import marshal
 import os
 import re
 import sys
 
-from . import deparse
+from . import limits
+from . import memprofile
+from . import metrics
+from . import ports
+from . import runtime
+from . import hashcons
 from .symbol import Symbol
 from .reader import tokenise, parse, read
-from .compiler import psilc
 
 Compile = False
 
+Source = False
+
+Evaluator = None
+
+TierThreshold = None
+
+FreezeQuoted = False
+
+# Quoted data becomes shared, immutable hashcons.Node trees.
+HashConsQuoted = False
+
+TrimClosures = True
+
+Optimize = False
+
+# Warn when a top level definition replaces another.
+WarnRedefine = True
+
 Symbols = {}
 
 class UndefinedSymbolError(Exception):
@@ -51,6 +71,10 @@ class TailCall(Exception):
 
 class Scope(object):
     NotFound = object()
+    # names this frame binds over its lifetime, and those that may be
+    # rebound; None when not known
+    names = None
+    assigned = frozenset()
     def __init__(self, parent = None):
         self.parent = parent
         self.symbols = {}
@@ -58,7 +82,7 @@ class Scope(object):
     def setglobals(self, globals):
         self.globals = globals
     def define(self, name, value):
-        if name in self.symbols:
+        if WarnRedefine and name in self.symbols:
             print("*** warning: redefining", name, file=sys.stderr)
         self.symbols[name] = value
         return value
@@ -83,6 +107,10 @@ class Scope(object):
             s = s.parent
         return (False, None)
     def eval(self, s, tail=False):
+        if metrics.Active:
+            metrics.fire("eval", s)
+        if limits.Active:
+            limits.step()
         try:
             if isinstance(s, list) and len(s) > 0:
                 f = s[0]
@@ -91,7 +119,7 @@ class Scope(object):
                         if isinstance(s[1], Symbol):
                             return self.define(s[1].name, self.eval(s[2]))
                         else:
-                            return self.define(s[1][0].name, Function(s[1][0].name, s[1][1:], s[2:], self))
+                            return self.define(s[1][0].name, make_function(s, self))
                     if f is Symbol.defmacro:
                         return self.define(s[1].name, Macro(s[1].name, s[2], s[3:], self))
                     if f is Symbol.if_:
@@ -102,31 +130,102 @@ class Scope(object):
                         else:
                             return None
                     if f is Symbol.lambda_:
-                        return Function("lambda", s[1], s[2:], self)
-                    if f is Symbol.quasiquote:
-                        def qq(t, depth=1):
-                            if isinstance(t, list):
-                                if len(t) > 0 and isinstance(t[0], Symbol):
-                                    if t[0] is Symbol.quasiquote:
-                                        return [t[0], qq(t[1], depth + 1)]
-                                    if t[0] is Symbol.unquote:
-                                        if depth == 1:
-                                            return self.eval(t[1])
-                                        else:
-                                            return [t[0], qq(t[1], depth - 1)]
-                                r = []
-                                for x in t:
-                                    if isinstance(x, list) and len(x) > 0 and isinstance(x[0], Symbol) and x[0] is Symbol.unquote_splicing:
-                                        if depth == 1:
-                                            r.extend(self.eval(x[1]))
-                                        else:
-                                            r.append([x[0], qq(x[1], depth - 1)])
-                                    else:
-                                        r.append(qq(x, depth))
+                        return make_function(s, self)
+                    if f is Symbol.and_:
+                        if len(s) == 1:
+                            return True
+                        for x in s[1:-1]:
+                            r = self.eval(x)
+                            if not r:
                                 return r
-                            else:
-                                return t
-                        return qq(s[1])
+                        return self.eval(s[-1], tail)
+                    if f is Symbol.or_:
+                        if len(s) == 1:
+                            return False
+                        for x in s[1:-1]:
+                            r = self.eval(x)
+                            if r:
+                                return r
+                        return self.eval(s[-1], tail)
+                    if f is Symbol.cond:
+                        for clause in s[1:]:
+                            r = clause[0] is Symbol.else_ or self.eval(clause[0])
+                            if r:
+                                if len(clause) == 1:
+                                    # a bare (else) is (else None)
+                                    return None if clause[0] is Symbol.else_ else r
+                                for x in clause[1:-1]:
+                                    self.eval(x)
+                                return self.eval(clause[-1], tail)
+                        return None
+                    if f is Symbol.when:
+                        if self.eval(s[1]) and len(s) > 2:
+                            for x in s[2:-1]:
+                                self.eval(x)
+                            return self.eval(s[-1], tail)
+                        return None
+                    if f is Symbol.while_:
+                        while self.eval(s[1]):
+                            # a fresh frame for each pass, so closures made
+                            # in the body keep their own bindings
+                            frame = Scope(self)
+                            for x in s[2:]:
+                                frame.eval(x)
+                        return None
+                    if f is Symbol.dotimes or f is Symbol.for_:
+                        frame = Scope(self)
+                        name = s[1][0].name
+                        seq = self.eval(s[1][1])
+                        for v in (range(seq) if f is Symbol.dotimes else seq):
+                            frame = Scope(self)
+                            frame.symbols[name] = v
+                            for x in s[2:]:
+                                frame.eval(x)
+                        if len(s[1]) > 2:
+                            return frame.eval(s[1][2], tail)
+                        return None
+                    if f is Symbol.do:
+                        frame = Scope(self)
+                        names = [b[0].name for b in s[1]]
+                        values = [self.eval(b[1]) for b in s[1]]
+                        frame.symbols.update(zip(names, values))
+                        while not frame.eval(s[2][0]):
+                            for x in s[3:]:
+                                frame.eval(x)
+                            values = [frame.eval(b[2]) if len(b) > 2 else frame.symbols[b[0].name] for b in s[1]]
+                            frame = Scope(self)
+                            frame.symbols.update(zip(names, values))
+                        for x in s[2][1:-1]:
+                            frame.eval(x)
+                        if len(s[2]) > 1:
+                            return frame.eval(s[2][-1], tail)
+                        return None
+                    if f is Symbol.named_let:
+                        # a call to the loop in tail position binds a new
+                        # frame and goes round again; other calls recurse
+                        outer = Scope(self)
+                        fn = outer.define(s[1].name, Function(s[1].name, [b[0] for b in s[2]], s[3:], outer))
+                        frame = fn.bind([self.eval(b[1]) for b in s[2]])
+                        while True:
+                            try:
+                                for x in s[3:-1]:
+                                    frame.eval(x)
+                                return frame.eval(s[-1], True)
+                            except TailCall as t:
+                                if t.fn is not fn:
+                                    raise
+                                assert len(t.args) == len(fn.params)
+                                frame = fn.bind(t.args)
+                    if f is Symbol.quasiquote:
+                        plan = QuasiquoteCache.get(id(s))
+                        if plan is None or plan[0] is not s:
+                            if len(QuasiquoteCache) >= QuasiquoteCacheSize:
+                                QuasiquoteCache.clear()
+                            plan = (s,) + quasiquote_plan(s[1])
+                            QuasiquoteCache[id(s)] = plan
+                        if plan[1]:
+                            return plan[2]
+                        return plan[2](self)
                     if f is Symbol.quote:
                         return s[1]
                     if f is Symbol.set:
@@ -137,7 +236,11 @@ class Scope(object):
                         return val
                     if f.name.startswith("."):
                         return getattr(self.eval(s[1]), f.name[1:])(*[self.eval(x) for x in s[2:]])
-                fn = self.eval(f)
+                if isinstance(f, list) and len(f) > 0 and f[0] is Symbol.lambda_:
+                    # applied at once, so the closure does not outlive this frame
+                    fn = make_function(f, self, False)
+                else:
+                    fn = self.eval(f)
                 if isinstance(fn, Macro):
                     assert False, "unexpected macro call: " + str(fn)
                     return self.eval(fn(*s[1:]), tail)
@@ -150,7 +253,7 @@ class Scope(object):
                 else:
                     raise NotCallableError(fn)
             elif isinstance(s, Symbol):
-                if s.name[0].startswith(":"):
+                if s.keyword:
                     return s
                 else:
                     found, r = self.lookup(s.name)
@@ -170,15 +273,140 @@ class Scope(object):
                 raise
             a = t
             while True:
+                if metrics.Active:
+                    metrics.fire("tailcall", a.fn, a.args)
                 try:
                     return a.apply()
                 except TailCall as t:
                     a = t
                     a.__traceback__ = None
         except Exception as x:
+            if metrics.Active:
+                metrics.fire("error", s, x)
             print("*", external(s))
             raise
 
+# Quasiquote templates are analysed once into a plan: (True, value) for a
+# constant subtree, which is shared between evaluations, or (False, build)
+# where build(scope) evaluates the holes and assembles a fresh list.
+QuasiquoteCache = {}
+QuasiquoteCacheSize = 10000
+
+def _quasiquote_build(t, parts):
+    if all(const for splice, const, v in parts):
+        return True, t
+    def build(scope):
+        r = []
+        for splice, const, v in parts:
+            if const:
+                r.append(v)
+            elif splice:
+                r.extend(v(scope))
+            else:
+                r.append(v(scope))
+        return r
+    return False, build
+
+def quasiquote_plan(t, depth=1):
+    """
+    >>> quasiquote_plan(read("(a (b c))"))
+    (True, [<a>, [<b>, <c>]])
+    >>> const, build = quasiquote_plan(read("(a ,(+ 1 2) ,@(list 4 5) (b c))"))
+    >>> const, build(Globals)
+    (False, [<a>, 3, 4, 5, [<b>, <c>]])
+    """
+    if not isinstance(t, list):
+        return True, t
+    if len(t) > 0 and t[0] is Symbol.unquote:
+        if depth == 1:
+            x = t[1]
+            return False, lambda scope: scope.eval(x)
+        parts = [(False, True, t[0]), (False,) + quasiquote_plan(t[1], depth - 1)]
+    elif len(t) > 0 and t[0] is Symbol.quasiquote:
+        parts = [(False, True, t[0]), (False,) + quasiquote_plan(t[1], depth + 1)]
+    else:
+        parts = []
+        for x in t:
+            if isinstance(x, list) and len(x) > 0 and x[0] is Symbol.unquote_splicing:
+                if depth == 1:
+                    parts.append((True, False, lambda scope, e=x[1]: scope.eval(e)))
+                else:
+                    parts.append((False,) + _quasiquote_build(x, [(False, True, x[0]), (False,) + quasiquote_plan(x[1], depth - 1)]))
+            else:
+                parts.append((False,) + quasiquote_plan(x, depth))
+    return _quasiquote_build(t, parts)
+
+# Each lambda form is analysed once for the names its frame binds and the
+# free variables it refers to, so that closures can capture just those.
+ClosureCache = {}
+ClosureCacheSize = 10000
+
+def closure_info(s):
+    info = ClosureCache.get(id(s))
+    if info is None or info[0] is not s:
+        if len(ClosureCache) >= ClosureCacheSize:
+            ClosureCache.clear()
+        if s[0] is Symbol.lambda_:
+            params = s[1]
+        else:
+            params = s[1][1:]
+        from . import analysis
+        info = (s, analysis.frame_names(params, s[2:]), analysis.free_variables(params, s[2:]))
+        ClosureCache[id(s)] = info
+    return info
+
+def closure_scope(scope, free):
+    """Return a scope holding only the bindings in free that scope's local
+    frames provide, on top of the global scope.
+
+    The frames' own scope is returned unchanged when a binding could still
+    change (set!, redefinition, or a define not yet evaluated), or when a
+    frame was not created by a Function call.
+
+    >>> outer = Function("outer", [Symbol.new("big"), Symbol.new("n")], [], Globals)
+    >>> outer.frame = ({"big", "n"}, frozenset())
+    >>> frame = outer.bind([list(range(1000)), 3])
+    >>> trimmed = closure_scope(frame, {"n", "print"})
+    >>> trimmed.symbols, trimmed.parent is Globals
+    ({'n': 3}, True)
+    >>> outer.frame = ({"big", "n"}, frozenset(["n"]))
+    >>> closure_scope(outer.bind([[], 3]), {"n"}).symbols
+    {'big': [], 'n': 3}
+    """
+    root = scope
+    while root.parent is not None:
+        root = root.parent
+    if scope is root:
+        return scope
+    trimmed = Scope(root)
+    s = scope
+    while s is not root:
+        if s.names is None:
+            return scope
+        for name in free:
+            if name in trimmed.symbols:
+                continue
+            if name in s.symbols:
+                if name in s.assigned:
+                    return scope
+                trimmed.symbols[name] = s.symbols[name]
+            elif name in s.names:
+                return scope
+        s = s.parent
+    return trimmed
+
+def make_function(s, scope, trim = True):
+    """Create the Function for a lambda form or a function define form."""
+    s, frame, free = closure_info(s)
+    if trim and TrimClosures:
+        scope = closure_scope(scope, free)
+    if s[0] is Symbol.lambda_:
+        fn = Function("lambda", s[1], s[2:], scope)
+    else:
+        fn = Function(s[1][0].name, s[1][1:], s[2:], scope)
+    fn.frame = frame
+    return fn
+
 class Function(object):
     def __init__(self, name, params, body, scope):
         self.name = name
@@ -199,12 +427,22 @@ class Function(object):
                 self.fixed += 1
         self.body = body
         self.scope = scope
+        self.calls = 0
+        self.compiled = None
+        self.frame = None
+        # where it was defined, while memory is being profiled
+        self.position = memprofile.Position
     def __str__(self):
         return "<Function %s>" % self.name
     def __call__(self, *args):
         return self.apply(args, tail=False)
-    def apply(self, args, tail=True):
+    def bind(self, args):
         scope = Scope(self.scope)
+        if self.frame is not None:
+            scope.names, scope.assigned = self.frame
+        if metrics.Active:
+            metrics.fire("apply", self, args)
+            metrics.fire("scope", scope)
         if self.params is not None:
             if isinstance(self.params, list):
                 assert len(args) >= self.fixed
@@ -219,6 +457,18 @@ class Function(object):
                     scope.define(p.name, a)
             else:
                 scope.define(self.params.name, list(args))
+        return scope
+    def apply(self, args, tail=True):
+        if self.compiled is not None:
+            return self.compiled(*args)
+        if TierThreshold is not None:
+            self.calls += 1
+            if self.calls == TierThreshold:
+                from . import tiered
+                self.compiled = tiered.compile_function(self)
+                if self.compiled is not None:
+                    return self.compiled(*args)
+        scope = self.bind(args)
         r = None
         if self.body:
             for b in self.body[:-1]:
@@ -251,6 +501,8 @@ def macroexpand(p, once = False):
     while isinstance(p, list) and len(p) > 0 and isinstance(p[0], Symbol):
         found, f = Globals.lookup(p[0].name)
         if found and isinstance(f, Macro):
+            if metrics.Active:
+                metrics.fire("macroexpand", p)
             p = f(*p[1:])
         else:
             break
@@ -258,22 +510,35 @@ def macroexpand(p, once = False):
             break
     return p
 
+def freeze(p):
+    """
+    >>> freeze(read("(a (b) c)"))
+    (<a>, (<b>,), <c>)
+    """
+    if isinstance(p, list):
+        return tuple(freeze(x) for x in p)
+    return p
+
 def macroexpand_r(p, depth=0, quoted=False):
     """
     >>> macroexpand_r(read("(foo bar)"))
     [<foo>, <bar>]
-    >>> macroexpand_r(read("(and)"))
-    True
-    >>> macroexpand_r(read("(and a b)"))
-    [<if>, <a>, [<if>, <b>, True, <False>], <False>]
-    >>> macroexpand_r(read("(lambda (and) a)"))
-    [<lambda>, [<and>], <a>]
+    >>> macroexpand_r(read("(begin)"))
+    [[<lambda>, []]]
+    >>> macroexpand_r(read("(let ((a 1)) (when a b))"))
+    [[<lambda>, [<a>], [<when>, <a>, <b>]], 1]
+    >>> macroexpand_r(read("(lambda (let) a)"))
+    [<lambda>, [<let>], <a>]
     """
     if isinstance(p, list):
         if len(p) > 0 and isinstance(p[0], Symbol):
             if p[0] is Symbol.lambda_:
                 return p[:2] + [x for x in [macroexpand_r(x, depth, quoted) for x in p[2:]] if x is not None]
             if p[0] is Symbol.quote:
+                if HashConsQuoted and depth == 0:
+                    return [p[0], hashcons.intern(p[1])]
+                if FreezeQuoted and depth == 0:
+                    return [p[0], freeze(p[1])]
                 return [p[0], macroexpand_r(p[1], depth, True)]
             if p[0] is Symbol.quasiquote:
                 return [p[0], macroexpand_r(p[1], depth+1, quoted)]
@@ -298,91 +563,44 @@ Globals.symbols["macroexpand-1"] = lambda x: macroexpand(x, True)
 Globals.symbols["macroexpand"] = macroexpand
 Globals.symbols["macroexpand_r"] = macroexpand_r
 
-Globals.symbols["+"]         = lambda *args: sum(args)
-Globals.symbols["-"]         = lambda *args: -args[0] if len(args) == 1 else functools.reduce(operator.sub, args)
-Globals.symbols["*"]         = lambda *args: functools.reduce(operator.mul, args, 1)
-Globals.symbols["**"]        = operator.pow
-Globals.symbols["/"]         = lambda *args: 1.0/args[0] if len(args) == 1 else functools.reduce(operator.truediv, args)
-Globals.symbols["//"]        = lambda *args: functools.reduce(operator.floordiv, args)
-Globals.symbols["%"]         = lambda x, y: x % tuple(y) if isinstance(y, list) else x % y
-Globals.symbols["<<"]        = operator.lshift
-Globals.symbols[">>"]        = operator.rshift
-Globals.symbols["&"]         = lambda *args: functools.reduce(operator.and_, args, -1)
-Globals.symbols["|"]         = lambda *args: functools.reduce(operator.or_, args, 0)
-Globals.symbols["^"]         = operator.xor
-Globals.symbols["~"]         = operator.invert
-def _all(p, a):
-    for i in range(len(a)-1):
-        if not p(a[i], a[i+1]):
-            return False
-    return True
-def _any(p, a):
-    for i in range(len(a)-1):
-        if p(a[i], a[i+1]):
-            return True
-    return False
-Globals.symbols["<"]         = lambda *args: _all(operator.lt, args)
-Globals.symbols[">"]         = lambda *args: _all(operator.gt, args)
-Globals.symbols["<="]        = lambda *args: _all(operator.le, args)
-Globals.symbols[">="]        = lambda *args: _all(operator.ge, args)
-Globals.symbols["=="]        = lambda *args: _all(operator.eq, args)
-Globals.symbols["!="]        = operator.ne
-Globals.symbols["is"]        = lambda *args: _all(operator.is_, args)
-Globals.symbols["is-not"]    = operator.is_not
-Globals.symbols["in"]        = lambda x, y: x in y
-Globals.symbols["not-in"]    = lambda x, y: x not in y
-Globals.symbols["not"]       = operator.not_
-
-def _del(x, y):
-    del x[y]
-Globals.symbols["del"]       = _del
+Globals.symbols.update(runtime.Builtins)
+
 # TODO: raise
 Globals.symbols["include"] = lambda x: include(x)
-
-Globals.symbols["list"]     = lambda *args: list(args)
-Globals.symbols["make-list"]= lambda args: list(args)
-Globals.symbols["list?"]    = lambda x: isinstance(x, list)
-Globals.symbols["cons"]     = lambda x, y: [x] + y if isinstance(y, list) else [x]
-def _set_car(x, y): x[0] = y
-Globals.symbols["set-car!"] = _set_car
-Globals.symbols["car"]    = lambda x: x[0]
-Globals.symbols["cdr"]    = lambda x: x[1:]
-Globals.symbols["caar"]   = lambda x: x[0][0]
-Globals.symbols["cadr"]   = lambda x: x[1]
-Globals.symbols["cdar"]   = lambda x: x[0][1:]
-Globals.symbols["cddr"]   = lambda x: x[2:]
-Globals.symbols["caaar"]  = lambda x: x[0][0][0]
-Globals.symbols["caadr"]  = lambda x: x[1][0]
-Globals.symbols["caddr"]  = lambda x: x[2]
-Globals.symbols["cadddr"] = lambda x: x[3]
-#Globals.symbols["cadar"]  = lambda x: x[0][1][0] # TODO
-#Globals.symbols["caddr"]  = lambda x: x[0][0][0]
-#Globals.symbols["cdaar"]  = lambda x: x[0][0][0]
-#Globals.symbols["cdadr"]  = lambda x: x[0][0][0]
-#Globals.symbols["cddar"]  = lambda x: x[0][0][0]
-#Globals.symbols["cdddr"]  = lambda x: x[0][0][0]
-Globals.symbols["caaaar"] = lambda x: x[0][0][0][0]
-#...
-Globals.symbols["null?"]  = lambda x: isinstance(x, list) and len(x) == 0
-Globals.symbols["append"] = lambda *args: functools.reduce(operator.concat, map(list, args), [])
-Globals.symbols["reverse"] = lambda x: list(reversed(x))
-Globals.symbols["list-tail"] = lambda x, y: x[y:]
-Globals.symbols["list-ref"] = lambda x, y: x[y]
-
-Globals.symbols["symbol?"] = lambda x: isinstance(x, Symbol)
-Globals.symbols["symbol->string"] = lambda x: x.name
-Globals.symbols["string->symbol"] = lambda x: Symbol.new(x)
-
-Globals.symbols["apply"] = lambda *args: args[0](*args[1])
-Globals.symbols["concat"] = lambda *args: "".join(str(x) for x in args)
-Globals.symbols["format"] = lambda x, *y: x % y
-Globals.symbols["index"] = lambda x, y: x[y]
-Globals.symbols["slice"] = lambda x, y, z: x[y:z]
-def _set(x, y, z):
-    x[y] = z
-Globals.symbols["dict-set"] = _set
-
-Globals.symbols["gensym"] = Symbol.gensym
+Globals.symbols["read-data"] = hashcons.read_data
+Globals.symbols["hash-cons"] = hashcons.intern
+Globals.symbols["metrics"] = metrics.metrics
+Globals.symbols["check-limits"] = limits.check
+
+Globals.symbols["open-output-string"] = ports.open_output_string
+Globals.symbols["get-output-string"] = ports.get_output_string
+Globals.symbols["open-output-file"] = ports.open_output_file
+Globals.symbols["close-port"] = ports.close_port
+Globals.symbols["current-output-port"] = ports.current
+Globals.symbols["with-output-to-port"] = ports.with_output_to
+Globals.symbols["with-output-to-string"] = ports.with_output_to_string
+Globals.symbols["with-output-to-file"] = ports.with_output_to_file
+Globals.symbols["call-with-output-string"] = ports.call_with_output_string
+# these return None rather than the count from the port's write()
+def _display(x, port=None): ports.current(port).write(display_string(x))
+def _write(x, port=None): ports.current(port).write(external(x))
+def _write_string(x, port=None): ports.current(port).write(x)
+def _newline(port=None): ports.current(port).write("\n")
+Globals.symbols["display"] = _display
+Globals.symbols["write"] = _write
+Globals.symbols["write-string"] = _write_string
+Globals.symbols["newline"] = _newline
+
+# psil.futures pulls in concurrent.futures, so it is imported on first use
+def _futures():
+    from . import futures
+    return futures
+Globals.symbols["future"] = lambda fn, *args: _futures().future(fn, *args)
+Globals.symbols["future?"] = lambda x: _futures().is_future(x)
+Globals.symbols["future-done?"] = lambda f: _futures().is_done(f)
+Globals.symbols["touch"] = lambda x: _futures().touch(x)
+Globals.symbols["touch-all"] = lambda xs: _futures().touch_all(xs)
+Globals.symbols["set-future-workers!"] = lambda n: _futures().set_workers(n)
 
 #Globals.symbols["rt"] = __import__("psil", fromlist=["rt"], level=0)
 Globals.symbols["_import"] = lambda x, g: __import__("psil", fromlist=["rt"], level=0).rt._import(x, g)
@@ -393,6 +611,7 @@ def call_with_current_continuation(f):
     stackless.tasklet(f)(channel.send)
     return channel.receive()
 Globals.symbols["call-with-current-continuation"] = call_with_current_continuation
+Globals.symbols["call/cc"] = call_with_current_continuation
 
 def external(x):
     """
@@ -402,13 +621,15 @@ def external(x):
     "abc"
     >>> print(external([123, "abc"]))
     (123 "abc")
+    >>> print(external({"a": [1, 2], Symbol.new("b"): set([3])}))
+    {"a" (1 2) b #{3}}
     >>> print(external(r'a\"b'))
     "a\\\"b"
 
     #>>> print([ord(x) for x in external(r'a\"b')])
     #[34, 97, 92, 92, 92, 34, 98, 34]
     """
-    if isinstance(x, list):
+    if isinstance(x, (list, tuple)):
         if len(x) > 0:
             if x[0] is Symbol.quote:
                 return "'" + external(x[1])
@@ -419,6 +640,16 @@ def external(x):
             if x[0] is Symbol.unquote_splicing:
                 return ",@" + external(x[1])
         return "(" + " ".join(external(i) for i in x) + ")"
+    if isinstance(x, dict):
+        return "{" + " ".join(external(i) for e in x.items() for i in e) + "}"
+    if isinstance(x, (set, frozenset)):
+        return "#{" + " ".join(external(i) for i in x) + "}"
+    # no persistent collections exist until psil.persistent is imported
+    persistent = sys.modules.get(__package__ + ".persistent")
+    if persistent is not None and isinstance(x, persistent.Vector):
+        return "(" + " ".join(["pvector"] + [external(i) for i in x]) + ")"
+    if persistent is not None and isinstance(x, persistent.HashMap):
+        return "(" + " ".join(["pmap"] + [external(i) for e in x.items() for i in e]) + ")"
     if isinstance(x, Symbol):
         return x.name
     if isinstance(x, str):
@@ -426,63 +657,240 @@ def external(x):
         return '"' + re.sub('"', r'\"', x) + '"'
     return str(x)
 
-def psil(s, compiled = True, glob = None):
+def display_string(x):
+    """
+    >>> print(display_string(["abc", 1, Symbol.new("d")]))
+    (abc 1 d)
+    """
+    if isinstance(x, str):
+        return x
+    if isinstance(x, (list, tuple)):
+        return "(" + " ".join(display_string(i) for i in x) + ")"
+    return external(x)
+
+def psil(s, compiled = True, glob = None, each = None):
+    """Evaluate the forms in s and return the value of the last one. each,
+    if given, is called as each(p, pos, run) for every top level form p,
+    before macro expansion, where pos is the (line, column) the form starts
+    at and run() expands and evaluates it."""
     tokens = tokenise(s)
     r = None
     compiled &= Compile
     g = dict(globals())
     for k, v in Globals.symbols.items():
         g[k] = v
+    context = None
+    def run(p):
+        nonlocal context
+        if compiled and (not isinstance(p, list) or not isinstance(p[0], Symbol) or p[0] is not Symbol.defmacro):
+            import ast
+            from . import deparse
+            from .compiler import Context, psilc
+            # the forms share g, so their quoted data must not share names
+            if context is None:
+                context = Context()
+            tree = ast.Module(psilc(p, context), [])
+            ast.fix_missing_locations(tree)
+
+            #print(ast.dump(tree))
+
+            if Source:
+                src = deparse.SourceGenerator()
+                deparse.gen_source(tree, src)
+                print(str(src), end="", file=sys.stderr)
+
+            return exec(compile(tree, "<psil>", "exec"), g)
+        else:
+            return evaluate(p, glob)
     while True:
-        p = parse(tokens)
+        if each is None:
+            p = parse(tokens)
+        else:
+            t = next(tokens, None)
+            p = None if t is None else parse(tokens, t)
         #print(external(p))
         if p is None:
             break
+        if each is not None:
+            r = each(p, t[2], lambda: _expand_run(p, run))
+            continue
         p = macroexpand_r(p)
         if p is None:
             continue
         #print(external(p))
-        if compiled and (not isinstance(p, list) or not isinstance(p[0], Symbol) or p[0] is not Symbol.defmacro):
-            tree = psilc(p)
-
-            tree = ast.Module([tree])
-            ast.fix_missing_locations(tree)
-
-            #print(ast.dump(tree))
-
-            src = deparse.SourceGenerator()
-            deparse.gen_source(tree, src)
-            #print("source:", str(src))
+        r = run(p)
+    return r
 
-            r = exec(compile(tree, "<psil>", "exec"), g)
-        else:
+def _expand_run(p, run):
+    p = macroexpand_r(p)
+    if p is None:
+        return None
+    return run(p)
+
+def evaluate(p, glob = None):
+    Globals.setglobals(glob)
+    if Evaluator is not None:
+        return Evaluator(p)
+    try:
+        return Globals.eval(p, tail=True)
+    except TailCall as t:
+        a = t
+        while True:
+            if metrics.Active:
+                metrics.fire("tailcall", a.fn, a.args)
             try:
-                Globals.setglobals(glob)
-                r = Globals.eval(p, tail=True)
+                return a.apply()
             except TailCall as t:
                 a = t
-                while True:
-                    try:
-                        r = a.apply()
-                        break
-                    except TailCall as t:
-                        a = t
-                        a.__traceback__ = None
-    return r
+                a.__traceback__ = None
 
 def rep(s):
     r = psil(s)
     if r is not None:
         print(external(r))
 
-def include(fn):
+def read_source(fn):
+    """Return the text of the file fn, without any #! line."""
     f = open(fn)
     text = f.read()
     f.close()
     m = re.match(r"#!.*?$", text, re.MULTILINE)
     if m is not None:
         text = text[m.end(0):]
-    psil(text)
+    return text
+
+def include(fn):
+    text = read_source(fn)
+    if memprofile.Active:
+        memprofile.include(fn, text)
+    else:
+        psil(text)
+
+# Snapshots hold lists as they are and every other form that marshal
+# cannot keep apart as a (tag, contents) tuple: symbols, tuples such as
+# those made by freeze(), and hashcons Nodes.
+def _freeze(p):
+    """
+    >>> _freeze(read('(a (b 1) "c")'))
+    [('s', 'a'), [('s', 'b'), 1], 'c']
+    >>> _freeze([freeze(read("(a 1)")), hashcons.node([2])])
+    [('t', [('s', 'a'), 1]), ('n', [2])]
+    """
+    if isinstance(p, list):
+        return [_freeze(x) for x in p]
+    if isinstance(p, Symbol):
+        return ("s", p.name)
+    if isinstance(p, hashcons.Node):
+        return ("n", [_freeze(x) for x in p])
+    if isinstance(p, tuple):
+        return ("t", [_freeze(x) for x in p])
+    return p
+
+def _thaw(p):
+    """
+    >>> _thaw(_freeze(read('(a (b 1) "c")')))
+    [<a>, [<b>, 1], 'c']
+    >>> _thaw(_freeze([freeze(read("(a 1)")), hashcons.node([2])]))
+    [(<a>, 1), (2,)]
+    """
+    if isinstance(p, list):
+        return [_thaw(x) for x in p]
+    if isinstance(p, tuple):
+        tag, x = p
+        if tag == "s":
+            return Symbol.new(x)
+        if tag == "n":
+            return hashcons.node([_thaw(y) for y in x])
+        return tuple(_thaw(y) for y in x)
+    return p
+
+# The code that reads and expands the source, which a snapshot depends on.
+_SnapshotSources = ("interpreter.py", "reader.py", "symbol.py")
+
+def _snapshot_stat():
+    """The mtime and size of each file a snapshot depends on."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    r = []
+    for name in _SnapshotSources:
+        st = os.stat(os.path.join(here, name))
+        r.append((st.st_mtime_ns, st.st_size))
+    return r
+
+def _snapshot_digest():
+    """A hash of the contents of those files, looked at only when their
+    stat data has changed since the snapshot was written."""
+    import hashlib
+    h = hashlib.sha1()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in _SnapshotSources:
+        with open(os.path.join(here, name), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def _write_snapshot(snapname, key, forms):
+    # written under another name and renamed, so that a process starting
+    # at the same time never reads half a snapshot
+    import tempfile
+    try:
+        fd, tmpname = tempfile.mkstemp(".tmp", os.path.basename(snapname) + ".", os.path.dirname(snapname))
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "wb") as f:
+            marshal.dump((key, forms), f)
+        os.replace(tmpname, snapname)
+    except (OSError, ValueError):
+        try:
+            os.remove(tmpname)
+        except OSError:
+            pass
+
+def prelude(fn):
+    """Load a file of definitions, reusing a snapshot of its expanded forms.
+
+    The snapshot sits next to the source file and holds the forms after
+    reading and macro expansion, so a fresh process only has to evaluate
+    them. It is rebuilt whenever the source is newer, or the Python version
+    or psil's reader and expander differ. Those are told apart by their
+    stat data, and by their contents only when that has changed.
+    """
+    snapname = os.path.splitext(fn)[0] + ".snapshot"
+    stat = _snapshot_stat()
+    digest = None
+    forms = None
+    try:
+        if os.stat(snapname).st_mtime >= os.stat(fn).st_mtime:
+            with open(snapname, "rb") as f:
+                (version, saved_stat, saved_digest), forms = marshal.load(f)
+            if version != sys.hexversion:
+                forms = None
+            elif saved_stat != stat:
+                # touched, checked out again or edited
+                digest = _snapshot_digest()
+                if digest == saved_digest:
+                    _write_snapshot(snapname, (sys.hexversion, stat, digest), forms)
+                else:
+                    forms = None
+    except (OSError, EOFError, ValueError, TypeError):
+        forms = None
+    if forms is not None:
+        for p in forms:
+            Globals.eval(_thaw(p))
+        return
+    forms = []
+    with open(fn) as f:
+        tokens = tokenise(f.read())
+    while True:
+        p = parse(tokens)
+        if p is None:
+            break
+        p = macroexpand_r(p)
+        if p is None:
+            continue
+        Globals.eval(p)
+        forms.append(_freeze(p))
+    if digest is None:
+        digest = _snapshot_digest()
+    _write_snapshot(snapname, (sys.hexversion, stat, digest), forms)
 
-with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "stdmacros.psil")) as f:
-    psil(f.read(), compiled=False)
+prelude(os.path.join(os.path.dirname(os.path.abspath(__file__)), "stdmacros.psil"))
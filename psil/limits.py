@@ -0,0 +1,217 @@
+"""Budgets for evaluating code that is not trusted.
+
+limited(thunk, ...) calls thunk() and raises LimitExceeded if it takes
+more evaluation steps, seconds, nested psil calls or bytes of memory
+than allowed. Steps are counted in Scope.eval and by the heap machine; the
+clock, the stack and the object count are looked at every CheckEvery
+steps, so a limit may be overrun by that many steps before it is noticed.
+Memory is measured with tracemalloc, which is started for the budget if it
+is not already running and slows evaluation down while it is.
+Compiled code counts a step at each (check-limits) call, which the
+compiler puts in function and loop bodies when CompileChecks is set
+(psil.py --check-limits, and always in the server). Budgets nest: an inner
+one is checked together with those around it.
+
+>>> from psil.interpreter import psil
+>>> psil("(define (spin n) (spin (+ n 1)))") and None
+>>> limited(lambda: psil("(spin 0)"), steps=10000)
+Traceback (most recent call last):
+  ...
+psil.limits.LimitExceeded: more than 10000 evaluation steps
+>>> limited(lambda: psil("(spin 0)"), seconds=0.2)
+Traceback (most recent call last):
+  ...
+psil.limits.LimitExceeded: more than 0.2 seconds
+>>> psil("(define (deep n) (if (== n 0) 0 (+ 1 (deep (- n 1)))))") and None
+>>> limited(lambda: psil("(deep 30)"), depth=50)
+30
+>>> limited(lambda: psil("(deep 100)"), depth=50)
+Traceback (most recent call last):
+  ...
+psil.limits.LimitExceeded: more than 50 nested calls
+>>> limited(lambda: psil('(define (grow l) (.append l (* "x" 1000)) (grow l)) (grow (list))'), memory=1000000)
+Traceback (most recent call last):
+  ...
+psil.limits.LimitExceeded: more than 1000000 bytes allocated
+>>> limited(lambda: psil("(+ 1 2)"), steps=100)
+3
+>>> from psil import interpreter, limits
+>>> interpreter.Compile = limits.CompileChecks = True
+>>> limited(lambda: psil("(define (loop n) (while True (set! n (+ n 1)))) (loop 0)"), steps=10000)
+Traceback (most recent call last):
+  ...
+psil.limits.LimitExceeded: more than 10000 evaluation steps
+>>> interpreter.Compile = limits.CompileChecks = False
+>>> limited(lambda: psil("(+ 1 2)"), steps=0)
+Traceback (most recent call last):
+  ...
+psil.limits.LimitExceeded: more than 0 evaluation steps
+>>> Active
+False
+
+Budgets belong to the thread that made them; steps taken in other threads
+are not charged to them:
+
+>>> import threading
+>>> done = []
+>>> t = threading.Thread(target=lambda: done.append(limited(lambda: time.sleep(0.2) or "slept", steps=10)))
+>>> t.start(); psil("(deep 100)"); t.join()
+100
+>>> done
+['slept']
+
+A future made within a budget runs within it too, on whichever thread
+picks it up:
+
+>>> from psil.futures import future, touch
+>>> limited(lambda: touch(future(psil, "(spin 0)")), steps=10000)
+Traceback (most recent call last):
+  ...
+psil.limits.LimitExceeded: more than 10000 evaluation steps
+"""
+
+import sys
+import threading
+import time
+
+# Steps between looks at the clock, the stack and memory.
+CheckEvery = 1000
+
+# Compile a (check-limits) call into each function and loop body, so that
+# compiled code can be stopped too.
+CompileChecks = False
+
+# Whether any thread is running within a budget.
+Active = False
+
+class LimitExceeded(Exception):
+    pass
+
+class Budget(object):
+    def __init__(self, steps, seconds, depth, memory):
+        self.steps = steps
+        self.seconds = seconds
+        self.depth = depth
+        self.memory = memory
+        self.used = 0
+        self.start = time.time()
+        self.traced = None
+        if memory is not None:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.traced = True
+            self.base = _traced()
+        self.frame = sys._getframe(2)
+
+def _traced():
+    # tracemalloc is only imported by budgets on memory, as it is slow to
+    # import
+    import tracemalloc
+    return tracemalloc.get_traced_memory()[0]
+
+class _State(threading.local):
+    def __init__(self):
+        self.budgets = []
+        # steps left before the next check, out of interval
+        self.countdown = 0
+        self.interval = 0
+
+_state = _State()
+# limited() calls running in all threads
+_running = 0
+_lock = threading.Lock()
+
+def _calls(frame, stop):
+    """Count the calls of psil functions on the stack above stop."""
+    from .interpreter import Function
+    n = 0
+    apply = Function.apply.__code__
+    while frame is not None and frame is not stop:
+        code = frame.f_code
+        if code is apply or code.co_filename.endswith(".psil") or code.co_filename == "<psil>":
+            n += 1
+        frame = frame.f_back
+    return n
+
+def _charge():
+    """Add the steps taken since the last check to every budget of this
+    thread, and start counting again."""
+    s = _state
+    for b in s.budgets:
+        b.used += s.interval - s.countdown
+    _restart()
+
+def _restart():
+    s = _state
+    s.countdown = CheckEvery
+    for b in s.budgets:
+        if b.steps is not None:
+            s.countdown = max(1, min(s.countdown, b.steps - b.used + 1))
+    s.interval = s.countdown
+
+def _check():
+    _charge()
+    now = time.time()
+    for b in _state.budgets:
+        if b.steps is not None and b.used > b.steps:
+            raise LimitExceeded("more than {0} evaluation steps".format(b.steps))
+        if b.seconds is not None and now - b.start > b.seconds:
+            raise LimitExceeded("more than {0} seconds".format(b.seconds))
+        if b.memory is not None and _traced() - b.base > b.memory:
+            raise LimitExceeded("more than {0} bytes allocated".format(b.memory))
+        if b.depth is not None and _calls(sys._getframe(1), b.frame) > b.depth:
+            raise LimitExceeded("more than {0} nested calls".format(b.depth))
+
+def step():
+    s = _state
+    s.countdown -= 1
+    if s.countdown <= 0:
+        _check()
+
+def check():
+    """Count a step from compiled code; the check-limits builtin."""
+    if Active:
+        step()
+
+def budgets():
+    """The budgets of this thread, for work it hands to another thread."""
+    return list(_state.budgets)
+
+def within(budgets, thunk):
+    """Call thunk() within budgets taken from another thread by budgets(),
+    besides those of this thread, and return its value."""
+    global Active, _running
+    s = _state
+    # steps so far belong to the budgets already running
+    _charge()
+    saved = s.budgets
+    s.budgets = saved + [b for b in budgets if b not in saved]
+    # the countdown has to allow for the new budgets from the first step
+    _restart()
+    with _lock:
+        _running += 1
+        Active = True
+    try:
+        r = thunk()
+        # the steps since the last check, which a short thunk may not
+        # have reached
+        _check()
+        return r
+    finally:
+        _charge()
+        s.budgets = saved
+        _restart()
+        with _lock:
+            _running -= 1
+            Active = _running > 0
+
+def limited(thunk, steps = None, seconds = None, depth = None, memory = None):
+    """Call thunk() within the given budget and return its value."""
+    b = Budget(steps, seconds, depth, memory)
+    try:
+        return within([b], thunk)
+    finally:
+        if b.traced:
+            import tracemalloc
+            tracemalloc.stop()
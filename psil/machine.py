@@ -0,0 +1,377 @@
+"""Evaluator that keeps the psil control stack on the heap.
+
+Scope.eval recurses through Python for every nested call, which limits
+non-tail recursion to a few hundred psil levels. This module evaluates the
+same (macro-expanded) forms with an explicit continuation: a chain of frame
+tuples (op, scope, ..., next). Recursion depth is bounded only by memory,
+tail calls need no trampoline, and call/cc captures the frame chain as a
+first class, re-entrant continuation.
+
+>>> from psil.interpreter import read, macroexpand_r
+>>> def run(s): return execute(macroexpand_r(read(s)))
+>>> run("(define (count n) (if (== n 0) 0 (+ 1 (count (- n 1)))))")
+<psil.interpreter.Function object at 0x...>
+>>> run("(count 100000)")
+100000
+>>> run("(+ 1 (call/cc (lambda (k) (* 10 (k 2)))))")
+3
+>>> run("(define saved None)")
+>>> run("(+ 1 (call/cc (lambda (k) (set! saved k) 1)))")
+2
+>>> run("(saved 41)")
+42
+>>> run("(call/cc (lambda (k) (make-list (map (lambda (x) (if (> x 2) (k x) x)) '(1 2 3 4)))))")
+3
+>>> run("(let ((x 1)) `(a ,x ,@(list 2 3) (b ,(+ x 1))))")
+[<a>, 1, 2, 3, [<b>, 2]]
+>>> run("(list (and 1 2) (and 1 0 2) (or 0 3) (or) (when 1 2 3) (when 0 1))")
+[2, 0, 3, False, 3, None]
+>>> run("(cond ((== 1 2) 'a) ((+ 1 2)) (else 'c))")
+3
+>>> run("(cond ((== 1 2) 'a) (else))") is None
+True
+>>> run("(let loop ((i 0) (acc '())) (if (== i 3) acc (loop (+ i 1) (cons i acc))))")
+[2, 1, 0]
+>>> run("(do ((i 0 (+ i 1)) (s 0 (+ s i))) ((== i 100000) s))")
+4999950000
+
+Python code (builtins such as map) that calls back into a psil Function
+still goes through Function.apply; a continuation invoked from there
+escapes back to the frame that captured it.
+"""
+
+from . import interpreter
+from . import limits
+from .interpreter import Function, Macro, NotCallableError, SetNotSymbolError, Symbol, make_function
+
+IF, SEQ, ARGS, METHOD, DEFINE, SET, AND, OR, COND, WHEN, WHILE, LOOP, ITER, NEXT = range(14)
+
+NoForm = object()
+
+class Continuation(object):
+    def __init__(self, k, run):
+        self.k = k
+        self.run = run
+    def __str__(self):
+        return "<Continuation>"
+    def __call__(self, *args):
+        raise ContinuationInvoked(self, args[0] if args else None)
+
+# Control flow rather than an error, so it derives from BaseException to pass
+# through the diagnostic handler in Scope.eval.
+class ContinuationInvoked(BaseException):
+    def __init__(self, cont, value):
+        BaseException.__init__(self, cont, value)
+        self.cont = cont
+        self.value = value
+
+def _list(*args):
+    return list(args)
+
+def _append(*args):
+    r = []
+    for x in args:
+        r.extend(x)
+    return r
+
+def quasiquote(t, depth=1):
+    """Rewrite a quasiquote template into calls that build it.
+
+    >>> read = interpreter.read
+    >>> quasiquote(read("(a ,b)")) == [_append, [_list, [Symbol.quote, read("a")]], [_list, read("b")]]
+    True
+    """
+    if isinstance(t, list):
+        if len(t) > 0 and isinstance(t[0], Symbol):
+            if t[0] is Symbol.quasiquote:
+                return [_list, [Symbol.quote, t[0]], quasiquote(t[1], depth + 1)]
+            if t[0] is Symbol.unquote:
+                if depth == 1:
+                    return t[1]
+                return [_list, [Symbol.quote, t[0]], quasiquote(t[1], depth - 1)]
+        r = [_append]
+        for x in t:
+            if isinstance(x, list) and len(x) > 0 and x[0] is Symbol.unquote_splicing:
+                if depth == 1:
+                    r.append(x[1])
+                else:
+                    r.append([_list, [_list, [Symbol.quote, x[0]], quasiquote(x[1], depth - 1)]])
+            else:
+                r.append([_list, quasiquote(x, depth)])
+        return r
+    return [Symbol.quote, t]
+
+# do and named let are run as a local function calling itself in tail
+# position; the rewritten form is kept so that it is built only once.
+Rewritten = {}
+RewrittenSize = 10000
+
+def loop_function(s):
+    """
+    >>> read = interpreter.read
+    >>> interpreter.external(loop_function(read("(named-let f ((i 0)) (f i))")))
+    '(((lambda () (define (f i) (f i)) f)) 0)'
+    """
+    r = Rewritten.get(id(s))
+    if r is None or r[0] is not s:
+        if len(Rewritten) >= RewrittenSize:
+            Rewritten.clear()
+        p = s
+        if p[0] is Symbol.do:
+            name = Symbol.gensym()
+            step = [b[2] if len(b) > 2 else b[0] for b in p[1]]
+            done = p[2] if len(p[2]) > 1 else [p[2][0], None]
+            p = [Symbol.named_let, name, [b[:2] for b in p[1]], [Symbol.cond, done, [Symbol.else_] + p[3:] + [[name] + step]]]
+        fn = [Symbol.lambda_, [], [Symbol.define, [p[1]] + [b[0] for b in p[2]]] + p[3:], p[1]]
+        r = (s, [[fn]] + [b[1] for b in p[2]])
+        Rewritten[id(s)] = r
+    return r[1]
+
+def execute(s, scope = None):
+    if scope is None:
+        scope = interpreter.Globals
+    run = object()
+    k = None
+    form = s
+    value = None
+    while True:
+        if form is not NoForm:
+            if limits.Active:
+                limits.step()
+            s = form
+            form = NoForm
+            if isinstance(s, list) and len(s) > 0:
+                f = s[0]
+                if isinstance(f, Symbol):
+                    if f is Symbol.define:
+                        if isinstance(s[1], Symbol):
+                            k = (DEFINE, scope, s[1].name, k)
+                            form = s[2]
+                        else:
+                            value = scope.define(s[1][0].name, make_function(s, scope))
+                        continue
+                    if f is Symbol.defmacro:
+                        value = scope.define(s[1].name, Macro(s[1].name, s[2], s[3:], scope))
+                        continue
+                    if f is Symbol.if_:
+                        k = (IF, scope, s, k)
+                        form = s[1]
+                        continue
+                    if f is Symbol.lambda_:
+                        value = make_function(s, scope)
+                        continue
+                    if f is Symbol.and_ or f is Symbol.or_:
+                        if len(s) == 1:
+                            value = f is Symbol.and_
+                            continue
+                        if len(s) > 2:
+                            k = (AND if f is Symbol.and_ else OR, scope, s, 2, k)
+                        form = s[1]
+                        continue
+                    if f is Symbol.cond:
+                        k = (COND, scope, s, 0, k)
+                        value = None
+                        continue
+                    if f is Symbol.when:
+                        k = (WHEN, scope, s, k)
+                        form = s[1]
+                        continue
+                    if f is Symbol.while_:
+                        k = (WHILE, scope, s, k)
+                        form = s[1]
+                        continue
+                    if f is Symbol.dotimes or f is Symbol.for_:
+                        k = (ITER, scope, s, k)
+                        form = s[1][1]
+                        continue
+                    if f is Symbol.do or f is Symbol.named_let:
+                        form = loop_function(s)
+                        continue
+                    if f is Symbol.quasiquote:
+                        form = quasiquote(s[1])
+                        continue
+                    if f is Symbol.quote:
+                        value = s[1]
+                        continue
+                    if f is Symbol.set:
+                        if not isinstance(s[1], Symbol):
+                            raise SetNotSymbolError(s[1])
+                        k = (SET, scope, s[1].name, k)
+                        form = s[2]
+                        continue
+                    if f.name.startswith("."):
+                        k = (METHOD, scope, s, (), k)
+                        form = s[1]
+                        continue
+                k = (ARGS, scope, s, (), k)
+                form = f
+            else:
+                value = scope.eval(s)
+            continue
+        if k is None:
+            return value
+        op = k[0]
+        if op == ARGS or op == METHOD:
+            s = k[2]
+            done = k[3] + (value,)
+            n = len(done) if op == ARGS else len(done) + 1
+            if n < len(s):
+                scope = k[1]
+                k = (op, scope, s, done, k[4])
+                form = s[n]
+                continue
+            k = k[4]
+            if op == METHOD:
+                value = getattr(done[0], s[0].name[1:])(*done[1:])
+                continue
+            fn = done[0]
+            args = done[1:]
+            if fn is interpreter.call_with_current_continuation:
+                fn = args[0]
+                args = (Continuation(k, run),)
+            if isinstance(fn, Continuation):
+                k = fn.k
+                value = args[0] if args else None
+            elif isinstance(fn, Macro):
+                assert False, "unexpected macro call: " + str(fn)
+            elif isinstance(fn, Function):
+                scope = fn.bind(args)
+                if not fn.body:
+                    value = None
+                    continue
+                if len(fn.body) > 1:
+                    k = (SEQ, scope, fn.body, 1, k)
+                form = fn.body[0]
+            elif hasattr(fn, "__call__"):
+                try:
+                    value = fn(*args)
+                except ContinuationInvoked as c:
+                    if c.cont.run is not run:
+                        raise
+                    k = c.cont.k
+                    value = c.value
+            else:
+                raise NotCallableError(fn)
+        elif op == IF:
+            s = k[2]
+            scope = k[1]
+            k = k[3]
+            if value:
+                form = s[2]
+            elif len(s) >= 4:
+                form = s[3]
+            else:
+                form = NoForm
+                value = None
+        elif op == AND or op == OR:
+            if (not value) if op == AND else value:
+                k = k[4]
+                continue
+            scope = k[1]
+            s = k[2]
+            i = k[3]
+            if i + 1 < len(s):
+                k = (op, scope, s, i + 1, k[4])
+            else:
+                k = k[4]
+            form = s[i]
+        elif op == COND:
+            scope = k[1]
+            s = k[2]
+            i = k[3]
+            if i > 0 and value:
+                clause = s[i]
+                k = k[4]
+                if len(clause) > 1:
+                    if len(clause) > 2:
+                        k = (SEQ, scope, clause, 2, k)
+                    form = clause[1]
+                elif clause[0] is Symbol.else_:
+                    # a bare (else) is (else None)
+                    value = None
+                continue
+            i += 1
+            if i >= len(s):
+                k = k[4]
+                value = None
+                continue
+            k = (COND, scope, s, i, k[4])
+            if s[i][0] is Symbol.else_:
+                value = True
+            else:
+                form = s[i][0]
+        elif op == WHEN:
+            s = k[2]
+            scope = k[1]
+            k = k[3]
+            if value and len(s) > 2:
+                if len(s) > 3:
+                    k = (SEQ, scope, s, 3, k)
+                form = s[2]
+            else:
+                value = None
+        elif op == WHILE:
+            if not value:
+                value = None
+                k = k[3]
+                continue
+            s = k[2]
+            # a fresh frame for each pass, as in Scope.eval
+            scope = interpreter.Scope(k[1])
+            k = (LOOP, k)
+            if len(s) > 2:
+                if len(s) > 3:
+                    k = (SEQ, scope, s, 3, k)
+                form = s[2]
+        elif op == LOOP:
+            # the body is done; test again
+            k = k[1]
+            scope = k[1]
+            form = k[2][1]
+        elif op == ITER:
+            s = k[2]
+            seq = range(value) if s[0] is Symbol.dotimes else value
+            k = (NEXT, k[1], interpreter.Scope(k[1]), s, iter(seq), k[3])
+            value = None
+        elif op == NEXT:
+            s = k[3]
+            try:
+                v = next(k[4])
+            except StopIteration:
+                scope = k[2]
+                k = k[5]
+                if len(s[1]) > 2:
+                    form = s[1][2]
+                else:
+                    value = None
+                continue
+            # a fresh frame for each pass; the result form sees the last
+            scope = interpreter.Scope(k[1])
+            scope.symbols[s[1][0].name] = v
+            k = (NEXT, k[1], scope, s, k[4], k[5])
+            if len(s) > 2:
+                if len(s) > 3:
+                    k = (SEQ, scope, s, 3, k)
+                form = s[2]
+        elif op == SEQ:
+            scope = k[1]
+            body = k[2]
+            i = k[3]
+            if i + 1 < len(body):
+                k = (SEQ, scope, body, i + 1, k[4])
+            else:
+                k = k[4]
+            form = body[i]
+        elif op == DEFINE:
+            value = k[1].define(k[2], value)
+            k = k[3]
+        elif op == SET:
+            k[1].set(k[2], value)
+            k = k[3]
+
+def install():
+    """Make psil() and include() evaluate top level forms with execute()."""
+    interpreter.Evaluator = execute
+
+def uninstall():
+    interpreter.Evaluator = None
@@ -0,0 +1,104 @@
+"""Memoization with a bounded LRU cache.
+
+>>> calls = []
+>>> def slow(x):
+...     calls.append(x)
+...     return x * 2
+>>> m = Memoized(slow, maxsize=2)
+>>> m(1), m(2), m(1), m(3), m(2)
+(2, 4, 2, 6, 4)
+>>> calls
+[1, 2, 3, 2]
+>>> sorted(m.stats().items())
+[('evictions', 2), ('expired', 0), ('hits', 1), ('maxsize', 2), ('misses', 4), ('size', 2)]
+
+Arguments are hashed structurally, so psil lists work as keys:
+
+>>> m = Memoized(len)
+>>> m([1, [2, 3]]), m([1, [2, 3]]), m.stats()["hits"]
+(2, 2, 1)
+
+but a list is never the same argument as a tuple with the same items:
+
+>>> m = Memoized(type)
+>>> m([1, 2]), m((1, 2)), m.stats()["hits"]
+(<class 'list'>, <class 'tuple'>, 0)
+"""
+
+import collections
+import threading
+import time
+
+_missing = object()
+
+class _ListKey(tuple):
+    """The key of a list argument, which equals only the keys of lists."""
+    __slots__ = ()
+    def __eq__(self, other):
+        return type(other) is _ListKey and tuple.__eq__(self, other)
+    def __ne__(self, other):
+        return not self == other
+    def __hash__(self):
+        return hash((_ListKey, tuple.__hash__(self)))
+
+def key(x):
+    if isinstance(x, list):
+        return _ListKey(key(i) for i in x)
+    if isinstance(x, tuple):
+        return tuple(key(i) for i in x)
+    return x
+
+class Memoized(object):
+    def __init__(self, fn, maxsize = 128, ttl = None, name = None):
+        self.fn = fn
+        self.maxsize = maxsize
+        self.ttl = ttl
+        if name is None:
+            name = getattr(fn, "name", None) or getattr(fn, "__name__", "?")
+        self.name = str(name)
+        self.cache = collections.OrderedDict()
+        # held while the cache is updated, not while fn runs
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+    def __str__(self):
+        return "<Memoized %s>" % self.name
+    def __call__(self, *args):
+        k = key(args)
+        try:
+            hash(k)
+        except TypeError:
+            return self.fn(*args)
+        with self.lock:
+            entry = self.cache.pop(k, _missing)
+            if entry is not _missing:
+                if self.ttl is None or time.time() - entry[1] < self.ttl:
+                    self.hits += 1
+                    self.cache[k] = entry
+                    return entry[0]
+                self.expired += 1
+            self.misses += 1
+        r = self.fn(*args)
+        with self.lock:
+            self.cache[k] = (r, time.time() if self.ttl is not None else None)
+            if self.maxsize is not None and len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+                self.evictions += 1
+        return r
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "size": len(self.cache),
+            "maxsize": self.maxsize,
+        }
+
+def memoize(fn, maxsize = 128, ttl = None, name = None):
+    return Memoized(fn, maxsize, ttl, name)
@@ -0,0 +1,243 @@
+"""Allocation profiling by psil function, using tracemalloc.
+
+While the profiler runs, each call of a psil function goes through a small
+Python function made for it, whose code is named after the psil function
+and the line of the top level form that defined it. tracemalloc records
+that frame with every block allocated during the call, so a snapshot can
+count live blocks against the innermost psil function they were allocated
+under. A snapshot is taken every SampleEvery calls and once more when the
+report is made.
+
+Live blocks miss memory that a function allocates and frees again, so each
+call also records how far traced memory rose above where it started, with
+tracemalloc's peak reset at every call. calls() gives, for each function,
+the highest such peak and their sum over all calls, which is the least the
+function and its callees must have allocated. include() records the same
+peak for each top level form and the memory it left allocated.
+
+>>> start()
+>>> include("grow.psil", '''
+... (define (grow n) (* (list 0) n))
+... (define kept (grow 100000))
+... ''')
+>>> [(name, where, size > 800000) for name, where, size, blocks in functions() if name == "grow"]
+[('grow', 'grow.psil:2', True)]
+>>> [(where, peak > 800000, kept > 800000) for where, text, peak, kept in forms()]
+[('grow.psil:2', False, False), ('grow.psil:3', True, True)]
+>>> include("churn.psil", '''
+... (define (churn n) (len (* (list 0) n)))
+... (define counts (list (churn 100000) (churn 100000) (churn 100000)))
+... ''')
+>>> [(name, n, peak > 800000, total > 2400000) for name, where, n, peak, total in calls() if name == "churn"]
+[('churn', 3, True, True)]
+>>> [size > 800000 for name, where, size, blocks in functions() if name == "churn"]
+[False]
+>>> stop()
+>>> Active
+False
+"""
+
+import sys
+
+Active = False
+
+# Calls of psil functions between snapshots.
+SampleEvery = 1000
+
+# Frames recorded for each block. The innermost call of a psil function
+# is usually a few interpreter frames above the allocation.
+Frames = 32
+
+# Rows in each table of the report.
+Top = 20
+
+# (file, line) of the top level form being included; given to the
+# functions it defines.
+Position = None
+
+_apply = None
+_calls = 0
+_samples = 0
+_sizes = {}
+_allocated = {}
+_forms = []
+_peaks = []
+_trampolines = {}
+_where = {}
+
+def _trampoline(fn):
+    key = (fn.name, fn.position)
+    t = _trampolines.get(key)
+    if t is None:
+        filename = "<psil {0}>".format(len(_where))
+        line = fn.position[1] if fn.position is not None else 1
+        ns = {}
+        # the call sits on the defining line, so the frame carries it
+        code = "\n" * (line - 1) + "def call(apply, fn, args, tail): return apply(fn, args, tail)\n"
+        exec(compile(code, filename, "exec"), ns)
+        t = _trampolines[key] = ns["call"]
+        _where[filename] = key
+    return t
+
+def _enter():
+    """Start a region whose peak memory is wanted; return the memory
+    traced at its start."""
+    import tracemalloc
+    # reset_peak() loses the peak of the enclosing region, so keep it on
+    # a stack
+    if _peaks:
+        _peaks[-1] = max(_peaks[-1], tracemalloc.get_traced_memory()[1])
+    _peaks.append(0)
+    tracemalloc.reset_peak()
+    return tracemalloc.get_traced_memory()[0]
+
+def _leave(before):
+    """End the region started by _enter(); return the memory it left
+    allocated and the peak it reached, both above its start."""
+    import tracemalloc
+    size, peak = tracemalloc.get_traced_memory()
+    peak = max(_peaks.pop(), peak)
+    if _peaks:
+        _peaks[-1] = max(_peaks[-1], peak)
+    return size - before, peak - before
+
+def _profiled(fn, args, tail=True):
+    global _calls
+    _calls += 1
+    if _calls % SampleEvery == 0:
+        sample()
+    before = _enter()
+    try:
+        return _trampoline(fn)(_apply, fn, args, tail)
+    finally:
+        kept, peak = _leave(before)
+        key = (fn.name, fn.position)
+        a = _allocated.get(key)
+        if a is None:
+            a = _allocated[key] = [0, 0, 0]
+        a[0] += 1
+        a[1] = max(a[1], peak)
+        a[2] += peak
+
+def start():
+    """Start tracing allocations and routing psil calls through their
+    trampolines."""
+    global Active, _apply
+    from .interpreter import Function
+    import tracemalloc
+    if Active:
+        return
+    reset()
+    tracemalloc.start(Frames)
+    _apply = Function.apply
+    Function.apply = _profiled
+    Active = True
+
+def stop():
+    global Active
+    from .interpreter import Function
+    if not Active:
+        return
+    import tracemalloc
+    Function.apply = _apply
+    tracemalloc.stop()
+    Active = False
+
+def reset():
+    global _calls, _samples
+    _calls = 0
+    _samples = 0
+    _sizes.clear()
+    _allocated.clear()
+    del _forms[:]
+
+def sample():
+    """Count the blocks allocated now against the psil functions they
+    were allocated under."""
+    global _samples
+    import tracemalloc
+    snapshot = tracemalloc.take_snapshot()
+    for trace in snapshot.traces:
+        key = None
+        # innermost frame last
+        for frame in reversed(trace.traceback):
+            key = _where.get(frame.filename)
+            if key is not None:
+                break
+        s = _sizes.get(key)
+        if s is None:
+            s = _sizes[key] = [0, 0]
+        s[0] += trace.size
+        s[1] += 1
+    _samples += 1
+
+def functions():
+    """Return (name, position, bytes, blocks) for each psil function, with
+    bytes and blocks averaged over the samples, largest first."""
+    sample()
+    r = []
+    for key, (size, blocks) in _sizes.items():
+        if key is None:
+            name, where = "(outside psil functions)", ""
+        else:
+            name, position = key
+            where = _where_defined(position)
+        r.append((name, where, size / _samples, blocks / _samples))
+    r.sort(key=lambda x: -x[2])
+    return r
+
+def _where_defined(position):
+    return "{0}:{1}".format(*position) if position is not None else "?"
+
+def calls():
+    """Return (name, position, calls, peak bytes, total bytes) for each psil
+    function called while profiling, where peak is the most memory a single
+    call rose to above its start and total is that summed over the calls,
+    largest total first."""
+    r = [(name, _where_defined(position), n, peak, total) for (name, position), (n, peak, total) in _allocated.items()]
+    r.sort(key=lambda x: -x[4])
+    return r
+
+def forms():
+    """Return (position, text, peak bytes, retained bytes) for each top
+    level form included so far."""
+    return [("{0}:{1}".format(fn, line), text, peak, kept) for fn, line, text, peak, kept in _forms]
+
+def include(fn, text):
+    """Evaluate the forms in text, from file fn, recording the memory used
+    by each one."""
+    from . import interpreter
+    lines = text.splitlines()
+    def each(p, pos, run):
+        global Position
+        saved = Position
+        Position = (fn, pos[0])
+        before = _enter()
+        try:
+            return run()
+        finally:
+            kept, peak = _leave(before)
+            Position = saved
+            _forms.append((fn, pos[0], lines[pos[0] - 1].strip(), peak, kept))
+    interpreter.psil(text, each=each)
+
+def report(file=None):
+    if file is None:
+        file = sys.stderr
+    rows = functions()
+    print("memory by psil function, average of {0} samples".format(_samples), file=file)
+    print("{0:>10} {1:>8}  {2}".format("KiB", "blocks", "function"), file=file)
+    for name, where, size, blocks in rows[:Top]:
+        print("{0:>10.1f} {1:>8.0f}  {2} {3}".format(size / 1024, blocks, name, where), file=file)
+    if _allocated:
+        print(file=file)
+        print("memory allocated by psil function, including its callees", file=file)
+        print("{0:>10} {1:>10} {2:>8}  {3}".format("total KiB", "peak KiB", "calls", "function"), file=file)
+        for name, where, n, peak, total in calls()[:Top]:
+            print("{0:>10.1f} {1:>10.1f} {2:>8}  {3} {4}".format(total / 1024, peak / 1024, n, name, where), file=file)
+    if _forms:
+        print(file=file)
+        print("memory by top level form", file=file)
+        print("{0:>10} {1:>10}  {2}".format("peak KiB", "kept KiB", "form"), file=file)
+        for where, text, peak, kept in sorted(forms(), key=lambda x: -x[2])[:Top]:
+            print("{0:>10.1f} {1:>10.1f}  {2} {3}".format(peak / 1024, kept / 1024, where, text[:50]), file=file)
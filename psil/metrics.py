@@ -0,0 +1,98 @@
+"""Evaluation instrumentation hooks and runtime counters.
+
+Hooks are plain callables registered against an event name; they are called
+as fn(event, *args) whenever the interpreter, reader or module loader reaches
+the corresponding point. While no hook is registered and counting is off,
+each instrumented site costs a single flag test.
+
+>>> from psil.interpreter import psil
+>>> reset()
+>>> enable()
+>>> psil("(define (sq x) (* x x)) (sq 3)")
+9
+>>> m = metrics()
+>>> m["apply"], m["scope"], m["parse"], m["read"]
+(1, 1, 2, 30)
+>>> m["eval"] > 0
+True
+>>> seen = []
+>>> add_hook("apply", lambda event, fn, args: seen.append((fn.name, list(args))))
+>>> psil("(sq 4)")
+16
+>>> seen
+[('sq', [4])]
+>>> remove_hook("apply", seen.append) # not registered, ignored
+>>> disable()
+>>> clear_hooks()
+>>> Active
+False
+
+"""
+
+Events = (
+    "eval",                 # form passed to Scope.eval
+    "apply",                # Function.apply
+    "tailcall",             # TailCall bounced through a trampoline
+    "macroexpand",          # single macro expansion step
+    "scope",                # Scope allocated for a function call
+    "read",                 # characters handed to the tokeniser
+    "parse",                # top level form produced by the parser
+    "error",                # exception escaping Scope.eval
+    "compile-cache-hit",    # rt._import found an up to date .pyc
+    "compile-cache-miss",   # rt._import had to compile a module
+)
+
+Active = False
+
+Counting = False
+
+_hooks = {}
+
+_counters = dict.fromkeys(Events, 0)
+
+def _update():
+    global Active
+    Active = Counting or any(_hooks.values())
+
+def add_hook(event, fn):
+    if event not in _counters:
+        raise ValueError("unknown event: " + event)
+    _hooks.setdefault(event, []).append(fn)
+    _update()
+
+def remove_hook(event, fn):
+    try:
+        _hooks.get(event, []).remove(fn)
+    except ValueError:
+        pass
+    _update()
+
+def clear_hooks():
+    _hooks.clear()
+    _update()
+
+def enable():
+    global Counting
+    Counting = True
+    _update()
+
+def disable():
+    global Counting
+    Counting = False
+    _update()
+
+def reset():
+    for k in _counters:
+        _counters[k] = 0
+
+def metrics():
+    return dict(_counters)
+
+def fire(event, *args):
+    if Counting:
+        if event == "read":
+            _counters[event] += args[0]
+        else:
+            _counters[event] += 1
+    for fn in _hooks.get(event, ()):
+        fn(event, *args)
@@ -0,0 +1,336 @@
+"""Whole-module optimization for compiled code.
+
+optimize() works on the expanded top-level forms of a module before they
+are turned into Python. It inlines calls to small non-recursive functions
+and drops definitions that nothing refers to:
+
+>>> forms = [read(x) for x in [
+...     "(define (sq x) (* x x))",
+...     "(define (unused) 1)",
+...     "(define (fact n) (if (< n 2) 1 (* n (fact (- n 1)))))",
+...     "(print (sq 3) (fact (sq 2)))"]]
+>>> for p in optimize(forms, keep=set()):
+...     print(external(p))
+(define (fact n) (if (< n 2) 1 (* n (fact (- n 1)))))
+(print (* 3 3) (fact (* 2 2)))
+
+bind_globals() then works on the generated Python: module level functions
+get the globals they use as keyword-only defaults, so a call to another
+function in the module is a local lookup rather than a global one.
+"""
+
+from .analysis import loop_names
+from .interpreter import external, read
+from .symbol import Symbol
+
+# Largest body, counted in atoms, that is copied into its callers.
+InlineSize = 12
+
+# Heads whose calls have no side effects, so reordering them around an
+# argument expression is harmless.
+Pure = set([
+    "+", "-", "*", "/", "//", "%", "**",
+    "<", ">", "<=", ">=", "==", "!=", "not", "is", "is-not", "in", "not-in",
+    "car", "cdr", "cadr", "cddr", "caddr", "null?", "list?", "symbol?",
+    "list", "cons", "index", "slice", "len",
+])
+
+# Forms that may skip, or repeat, evaluating some of their arguments.
+Conditional = set([Symbol.if_, Symbol.and_, Symbol.or_, Symbol.cond, Symbol.when,
+    Symbol.while_, Symbol.dotimes, Symbol.for_, Symbol.do, Symbol.named_let])
+
+def _defined_function(p):
+    if (isinstance(p, list) and len(p) > 2 and p[0] is Symbol.define
+            and isinstance(p[1], list) and p[1]
+            and all(isinstance(x, Symbol) for x in p[1])):
+        return p[1][0].name
+    return None
+
+def _defined_name(p):
+    if isinstance(p, list) and len(p) > 2 and p[0] is Symbol.define:
+        if isinstance(p[1], Symbol):
+            return p[1].name
+        return _defined_function(p)
+    return None
+
+def _symbols(p):
+    if isinstance(p, Symbol):
+        yield p.name
+    elif isinstance(p, list) and p:
+        if p[0] is Symbol.quote:
+            return
+        for x in p:
+            for name in _symbols(x):
+                yield name
+
+def _assigned(forms):
+    """Names that are the target of set! anywhere, or defined twice."""
+    r = set()
+    seen = set()
+    def walk(p):
+        if isinstance(p, list) and p:
+            if p[0] is Symbol.quote:
+                return
+            if p[0] is Symbol.set and len(p) > 1 and isinstance(p[1], Symbol):
+                r.add(p[1].name)
+            for x in p:
+                walk(x)
+    for p in forms:
+        name = _defined_name(p)
+        if name is not None:
+            if name in seen:
+                r.add(name)
+            seen.add(name)
+        walk(p)
+    return r
+
+def call_graph(forms):
+    """
+    >>> g = call_graph([read("(define (a) (b))"), read("(define (b) (a) (c))"), read("(define (c) 1)")])
+    >>> sorted((k, sorted(v)) for k, v in g.items())
+    [('a', ['b']), ('b', ['a', 'c']), ('c', [])]
+    """
+    defs = {}
+    for p in forms:
+        name = _defined_name(p)
+        if name is not None:
+            defs[name] = p
+    graph = {}
+    for name, p in defs.items():
+        graph[name] = set(x for x in _symbols(p[2:]) if x in defs)
+    return graph
+
+def recursive(graph):
+    """Return the names that can reach themselves in graph."""
+    r = set()
+    for start in graph:
+        stack = list(graph[start])
+        seen = set()
+        while stack:
+            name = stack.pop()
+            if name == start:
+                r.add(start)
+                break
+            if name in seen:
+                continue
+            seen.add(name)
+            stack.extend(graph.get(name, ()))
+    return r
+
+def _size(p):
+    if isinstance(p, list):
+        return sum(_size(x) for x in p)
+    return 1
+
+def _simple_body(p):
+    if isinstance(p, list) and p:
+        if p[0] is Symbol.quote:
+            return True
+        if p[0] in (Symbol.define, Symbol.defmacro, Symbol.set, Symbol.lambda_, Symbol.quasiquote):
+            return False
+        if loop_names(p):
+            return False
+        return all(_simple_body(x) for x in p)
+    return True
+
+def _trivial(p):
+    if isinstance(p, list):
+        return len(p) == 2 and p[0] is Symbol.quote and not isinstance(p[1], list)
+    return True
+
+def _straight(p, params, events):
+    """Record parameter uses and impure calls in evaluation order."""
+    if isinstance(p, Symbol):
+        if p.name in params:
+            events.append(p.name)
+        return True
+    if not isinstance(p, list) or not p:
+        return True
+    if p[0] is Symbol.quote:
+        return True
+    if not isinstance(p[0], Symbol) or p[0] in Conditional or p[0].name in params:
+        return False
+    for x in p[1:]:
+        if not _straight(x, params, events):
+            return False
+    if p[0].name not in Pure:
+        events.append(None)
+    return True
+
+def _substitutable(params, body, args):
+    """Can args be substituted for params in body without changing the
+    number or order of their evaluations?"""
+    heavy = [x.name for x, a in zip(params, args) if not _trivial(a)]
+    if not heavy:
+        return True
+    events = []
+    if not _straight(body, set(heavy), events):
+        return False
+    uses = [x for x in events if x is not None]
+    if uses != heavy:
+        return False
+    last = max(i for i, x in enumerate(events) if x is not None)
+    return None not in events[:last]
+
+def _substitute(p, env):
+    if isinstance(p, Symbol):
+        return env.get(p.name, p)
+    if isinstance(p, list) and p:
+        if p[0] is Symbol.quote:
+            return p
+        return [_substitute(x, env) for x in p]
+    return p
+
+def _params(p):
+    return set(x.name for x in p if isinstance(x, Symbol) and x.name != ".")
+
+class Inliner(object):
+    def __init__(self, forms):
+        self.defs = {}
+        for p in forms:
+            name = _defined_function(p)
+            if name is not None:
+                self.defs[name] = p
+        graph = call_graph(forms)
+        excluded = recursive(graph) | _assigned(forms)
+        self.candidates = {}
+        for name, p in self.defs.items():
+            params = p[1][1:]
+            if (name not in excluded
+                    and len(p) == 3
+                    and all(x.name != "." for x in params)
+                    and _simple_body(p[2])):
+                self.candidates[name] = p
+        self.bodies = {}
+    def body(self, name):
+        if name not in self.bodies:
+            p = self.candidates[name]
+            body = self.visit(p[2], _params(p[1][1:]))
+            if _size(body) > InlineSize:
+                body = None
+            self.bodies[name] = body
+        return self.bodies[name]
+    def inline(self, p, bound):
+        name = p[0].name
+        if name in bound or name not in self.candidates:
+            return None
+        body = self.body(name)
+        if body is None:
+            return None
+        params = self.candidates[name][1][1:]
+        args = p[1:]
+        if len(args) != len(params):
+            return None
+        free = set(_symbols(body)) - _params(params)
+        if free & bound:
+            return None
+        if not _substitutable(params, body, args):
+            return None
+        return _substitute(body, dict((x.name, a) for x, a in zip(params, args)))
+    def visit(self, p, bound):
+        if not isinstance(p, list) or not p:
+            return p
+        head = p[0]
+        if head is Symbol.quote:
+            return p
+        if head is Symbol.quasiquote:
+            return p
+        if head is Symbol.lambda_ and len(p) > 2 and isinstance(p[1], list):
+            inner = bound | _params(p[1])
+            return [head, p[1]] + [self.visit(x, inner) for x in p[2:]]
+        if head is Symbol.define and len(p) > 2:
+            if isinstance(p[1], list):
+                inner = bound | _params(p[1][1:])
+                return [head, p[1]] + [self.visit(x, inner) for x in p[2:]]
+            return [head, p[1], self.visit(p[2], bound)]
+        if head is Symbol.defmacro:
+            return p
+        names = loop_names(p)
+        if names:
+            return [self.visit(x, bound | names) for x in p]
+        p = [self.visit(x, bound) for x in p]
+        if isinstance(p[0], Symbol):
+            r = self.inline(p, bound)
+            if r is not None:
+                return r
+        return p
+
+def optimize(forms, keep = None):
+    """Inline small functions in forms and drop unreachable definitions.
+
+    A definition is kept if a top level expression, a name in keep, or
+    another kept definition refers to it. When keep is None every public
+    name (not starting with "_") is kept, which suits modules that are
+    imported by others.
+    """
+    inliner = Inliner(forms)
+    forms = [inliner.visit(p, set()) for p in forms]
+    graph = call_graph(forms)
+    live = set()
+    stack = []
+    for p in forms:
+        name = _defined_name(p)
+        if name is None:
+            stack.extend(x for x in _symbols(p) if x in graph)
+        elif (keep is None and not name.startswith("_")) or (keep is not None and name in keep):
+            stack.append(name)
+        elif not isinstance(p[1], list):
+            # the value expression may have side effects
+            stack.append(name)
+    while stack:
+        name = stack.pop()
+        if name in live:
+            continue
+        live.add(name)
+        stack.extend(graph[name])
+    return [p for p in forms if _defined_name(p) is None or _defined_name(p) in live]
+
+def _stores(node):
+    """Names bound by node in the scope it appears in."""
+    import ast
+    if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+        yield node.name
+        for n in ast.walk(node):
+            if isinstance(n, (ast.Global, ast.Nonlocal)):
+                for x in n.names:
+                    yield x
+        return
+    if isinstance(node, ast.Lambda):
+        return
+    if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+        yield node.id
+    elif isinstance(node, (ast.Import, ast.ImportFrom)):
+        for x in node.names:
+            yield x.asname or x.name.split(".")[0]
+    for n in ast.iter_child_nodes(node):
+        for x in _stores(n):
+            yield x
+
+def bind_globals(body, known = ()):
+    """Give each module level function the module globals it reads as
+    keyword-only defaults, for names that are already bound when the
+    function is defined and are never rebound afterwards.
+    """
+    import ast
+    counts = {}
+    for node in body:
+        for name in _stores(node):
+            counts[name] = counts.get(name, 0) + 1
+    bound = set(x for x in known if x not in counts)
+    for stmt in body:
+        if isinstance(stmt, ast.FunctionDef):
+            args = stmt.args
+            local = set(x.arg for x in args.args + args.kwonlyargs)
+            for x in stmt.body:
+                local.update(_stores(x))
+            used = set()
+            for n in ast.walk(stmt):
+                if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Load):
+                    used.add(n.id)
+            names = sorted(x for x in used & bound if x not in local)
+            args.kwonlyargs = args.kwonlyargs + [ast.arg(arg=x) for x in names]
+            args.kw_defaults = args.kw_defaults + [ast.Name(x, ast.Load()) for x in names]
+        for name in _stores(stmt):
+            if counts.get(name) == 1:
+                bound.add(name)
+    return body
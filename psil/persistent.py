@@ -0,0 +1,440 @@
+"""Persistent vectors and hash maps with structural sharing.
+
+Vector is a 32-way trie with a tail buffer and HashMap is a hash array
+mapped trie. Updates return a new collection that shares all untouched
+nodes with the old one, so assoc, update and lookup are O(log32 n).
+A transient is a private, mutable view used to build a collection in a
+batch; nodes it creates are updated in place until persistent() hands
+them back as an ordinary immutable collection.
+
+>>> v = vector(*range(100))
+>>> w = v.assoc(50, "x")
+>>> v[50], w[50], len(w), w[99]
+(50, 'x', 100, 99)
+>>> list(v.conj(100))[-3:]
+[98, 99, 100]
+>>> t = Vector().transient()
+>>> for i in range(2000):
+...     t = t.conj(i)
+>>> v = t.persistent()
+>>> len(v), v[1999], v.update(1999, lambda x: -x)[1999], v[1999]
+(2000, 1999, -1999, 1999)
+
+>>> m = hash_map("a", 1, "b", 2)
+>>> n = m.assoc("c", 3).dissoc("a")
+>>> sorted(m.items()), sorted(n.items())
+([('a', 1), ('b', 2)], [('b', 2), ('c', 3)])
+>>> n.lookup("a", "missing"), "b" in n, len(n)
+('missing', True, 2)
+>>> t = HashMap().transient()
+>>> for i in range(5000):
+...     t = t.assoc(i, i * i)
+>>> m = t.persistent()
+>>> len(m), m[4321], len(m.dissoc(17)), m.update(3, lambda x: x + 1)[3]
+(5000, 18671041, 4999, 10)
+"""
+
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+
+class TransientError(Exception):
+    pass
+
+class _Node(object):
+    def __init__(self, edit, array):
+        self.edit = edit
+        self.array = array
+    def editable(self, edit):
+        if edit is not None and self.edit is edit:
+            return self
+        return _Node(edit, list(self.array))
+
+def _tailoff(count):
+    if count < WIDTH:
+        return 0
+    return ((count - 1) >> BITS) << BITS
+
+def _new_path(edit, level, node):
+    while level > 0:
+        node = _Node(edit, [node])
+        level -= BITS
+    return node
+
+def _push_tail(edit, count, level, parent, tailnode):
+    subidx = ((count - 1) >> level) & MASK
+    ret = parent.editable(edit)
+    if level == BITS:
+        node = tailnode
+    elif subidx < len(parent.array):
+        node = _push_tail(edit, count, level - BITS, parent.array[subidx], tailnode)
+    else:
+        node = _new_path(edit, level - BITS, tailnode)
+    if subidx < len(ret.array):
+        ret.array[subidx] = node
+    else:
+        ret.array.append(node)
+    return ret
+
+def _do_assoc(edit, level, node, i, x):
+    ret = node.editable(edit)
+    if level == 0:
+        ret.array[i & MASK] = x
+    else:
+        subidx = (i >> level) & MASK
+        ret.array[subidx] = _do_assoc(edit, level - BITS, node.array[subidx], i, x)
+    return ret
+
+class _VectorBase(object):
+    def __len__(self):
+        return self.count
+    def _array_for(self, i):
+        if i < 0 or i >= self.count:
+            raise IndexError(i)
+        if i >= _tailoff(self.count):
+            return self.tail
+        node = self.root
+        level = self.shift
+        while level > 0:
+            node = node.array[(i >> level) & MASK]
+            level -= BITS
+        return node.array
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        return self._array_for(i)[i & MASK]
+    def lookup(self, i, default = None):
+        if -self.count <= i < self.count:
+            return self[i]
+        return default
+    def __iter__(self):
+        for i in range(0, self.count, WIDTH):
+            for x in self._array_for(i):
+                yield x
+    def _conj(self, edit, x):
+        count, shift, root, tail = self.count, self.shift, self.root, self.tail
+        if count - _tailoff(count) < WIDTH:
+            if edit is not None:
+                tail.append(x)
+            else:
+                tail = tail + [x]
+            return count + 1, shift, root, tail
+        tailnode = _Node(edit, tail)
+        if (count >> BITS) > (1 << shift):
+            root = _Node(edit, [root, _new_path(edit, shift, tailnode)])
+            shift += BITS
+        else:
+            root = _push_tail(edit, count, shift, root, tailnode)
+        return count + 1, shift, root, [x]
+    def _assoc(self, edit, i, x):
+        if i < 0:
+            i += self.count
+        if i == self.count:
+            return self._conj(edit, x)
+        if i < 0 or i > self.count:
+            raise IndexError(i)
+        root, tail = self.root, self.tail
+        if i >= _tailoff(self.count):
+            if edit is None:
+                tail = list(tail)
+            tail[i & MASK] = x
+        else:
+            root = _do_assoc(edit, self.shift, root, i, x)
+        return self.count, self.shift, root, tail
+
+class Vector(_VectorBase):
+    def __init__(self, count = 0, shift = BITS, root = None, tail = None):
+        self.count = count
+        self.shift = shift
+        self.root = root if root is not None else _Node(None, [])
+        self.tail = tail if tail is not None else []
+        self._hash = None
+    def conj(self, x):
+        return Vector(*self._conj(None, x))
+    def assoc(self, i, x):
+        return Vector(*self._assoc(None, i, x))
+    def update(self, i, fn):
+        return self.assoc(i, fn(self[i]))
+    def transient(self):
+        return TransientVector(self.count, self.shift, self.root, list(self.tail))
+    def __eq__(self, other):
+        if not isinstance(other, Vector) or len(self) != len(other):
+            return False
+        for x, y in zip(self, other):
+            if x != y:
+                return False
+        return True
+    def __ne__(self, other):
+        return not self == other
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(tuple(self))
+        return self._hash
+    def __repr__(self):
+        return "vector(%s)" % ", ".join(repr(x) for x in self)
+
+class TransientVector(_VectorBase):
+    def __init__(self, count, shift, root, tail):
+        self.edit = object()
+        self.count = count
+        self.shift = shift
+        self.root = root
+        self.tail = tail
+    def _check(self):
+        if self.edit is None:
+            raise TransientError("transient used after persistent!")
+    def conj(self, x):
+        self._check()
+        self.count, self.shift, self.root, self.tail = self._conj(self.edit, x)
+        return self
+    def assoc(self, i, x):
+        self._check()
+        self.count, self.shift, self.root, self.tail = self._assoc(self.edit, i, x)
+        return self
+    def persistent(self):
+        self._check()
+        self.edit = None
+        return Vector(self.count, self.shift, self.root, self.tail)
+
+def vector(*args):
+    t = Vector().transient()
+    for x in args:
+        t.conj(x)
+    return t.persistent()
+
+def _hash(key):
+    return hash(key) & 0xFFFFFFFFFFFFFFFF
+
+def _bitpos(h, shift):
+    return 1 << ((h >> shift) & MASK)
+
+def _index(bitmap, bit):
+    return bin(bitmap & (bit - 1)).count("1")
+
+class _BitmapNode(object):
+    def __init__(self, edit, bitmap, array):
+        self.edit = edit
+        self.bitmap = bitmap
+        self.array = array
+    def editable(self, edit):
+        if edit is not None and self.edit is edit:
+            return self
+        return _BitmapNode(edit, self.bitmap, list(self.array))
+
+class _CollisionNode(object):
+    def __init__(self, edit, h, array):
+        self.edit = edit
+        self.h = h
+        self.array = array
+    def editable(self, edit):
+        if edit is not None and self.edit is edit:
+            return self
+        return _CollisionNode(edit, self.h, list(self.array))
+
+def _make_node(edit, shift, e1, h1, e2, h2):
+    if h1 == h2:
+        return _CollisionNode(edit, h1, [e1, e2])
+    b1 = _bitpos(h1, shift)
+    b2 = _bitpos(h2, shift)
+    if b1 == b2:
+        return _BitmapNode(edit, b1, [_make_node(edit, shift + BITS, e1, h1, e2, h2)])
+    return _BitmapNode(edit, b1 | b2, [e1, e2] if b1 < b2 else [e2, e1])
+
+def _node_assoc(node, edit, shift, h, key, val):
+    if isinstance(node, _CollisionNode):
+        if h != node.h:
+            wrapper = _BitmapNode(edit, _bitpos(node.h, shift), [node])
+            return _node_assoc(wrapper, edit, shift, h, key, val)
+        for i, e in enumerate(node.array):
+            if e[0] == key:
+                if e[1] is val:
+                    return node, False
+                n = node.editable(edit)
+                n.array[i] = (key, val)
+                return n, False
+        n = node.editable(edit)
+        n.array.append((key, val))
+        return n, True
+    bit = _bitpos(h, shift)
+    idx = _index(node.bitmap, bit)
+    if not node.bitmap & bit:
+        n = node.editable(edit)
+        n.array.insert(idx, (key, val))
+        n.bitmap |= bit
+        return n, True
+    x = node.array[idx]
+    if isinstance(x, tuple):
+        if x[0] == key:
+            if x[1] is val:
+                return node, False
+            sub = (key, val)
+            added = False
+        else:
+            sub = _make_node(edit, shift + BITS, x, _hash(x[0]), (key, val), h)
+            added = True
+    else:
+        sub, added = _node_assoc(x, edit, shift + BITS, h, key, val)
+        if sub is x:
+            return node, added
+    n = node.editable(edit)
+    n.array[idx] = sub
+    return n, added
+
+def _node_find(node, shift, h, key, default):
+    while node is not None:
+        if isinstance(node, _CollisionNode):
+            for e in node.array:
+                if e[0] == key:
+                    return e[1]
+            return default
+        bit = _bitpos(h, shift)
+        if not node.bitmap & bit:
+            return default
+        x = node.array[_index(node.bitmap, bit)]
+        if isinstance(x, tuple):
+            return x[1] if x[0] == key else default
+        node = x
+        shift += BITS
+    return default
+
+def _node_without(node, edit, shift, h, key):
+    if isinstance(node, _CollisionNode):
+        for i, e in enumerate(node.array):
+            if e[0] == key:
+                if len(node.array) == 1:
+                    return None, True
+                n = node.editable(edit)
+                del n.array[i]
+                return n, True
+        return node, False
+    bit = _bitpos(h, shift)
+    if not node.bitmap & bit:
+        return node, False
+    idx = _index(node.bitmap, bit)
+    x = node.array[idx]
+    if isinstance(x, tuple):
+        if x[0] != key:
+            return node, False
+        sub = None
+    else:
+        sub, removed = _node_without(x, edit, shift + BITS, h, key)
+        if not removed:
+            return node, False
+    if sub is None:
+        if node.bitmap == bit:
+            return None, True
+        n = node.editable(edit)
+        del n.array[idx]
+        n.bitmap ^= bit
+        return n, True
+    n = node.editable(edit)
+    n.array[idx] = sub
+    return n, True
+
+def _node_items(node):
+    if node is None:
+        return
+    for x in node.array:
+        if isinstance(x, tuple):
+            yield x
+        else:
+            for e in _node_items(x):
+                yield e
+
+_missing = object()
+
+class _MapBase(object):
+    def __len__(self):
+        return self.count
+    def lookup(self, key, default = None):
+        return _node_find(self.root, 0, _hash(key), key, default)
+    def __getitem__(self, key):
+        r = _node_find(self.root, 0, _hash(key), key, _missing)
+        if r is _missing:
+            raise KeyError(key)
+        return r
+    def __contains__(self, key):
+        return _node_find(self.root, 0, _hash(key), key, _missing) is not _missing
+    def __iter__(self):
+        for k, v in _node_items(self.root):
+            yield k
+    def keys(self):
+        return iter(self)
+    def values(self):
+        for k, v in _node_items(self.root):
+            yield v
+    def items(self):
+        return _node_items(self.root)
+    def _assoc(self, edit, key, val):
+        h = _hash(key)
+        if self.root is None:
+            return 1, _BitmapNode(edit, _bitpos(h, 0), [(key, val)])
+        root, added = _node_assoc(self.root, edit, 0, h, key, val)
+        return self.count + (1 if added else 0), root
+    def _dissoc(self, edit, key):
+        if self.root is None:
+            return self.count, self.root
+        root, removed = _node_without(self.root, edit, 0, _hash(key), key)
+        return self.count - (1 if removed else 0), root
+
+class HashMap(_MapBase):
+    def __init__(self, count = 0, root = None):
+        self.count = count
+        self.root = root
+        self._hash = None
+    def assoc(self, key, val):
+        count, root = self._assoc(None, key, val)
+        if root is self.root:
+            return self
+        return HashMap(count, root)
+    def dissoc(self, key):
+        count, root = self._dissoc(None, key)
+        if root is self.root:
+            return self
+        return HashMap(count, root)
+    def update(self, key, fn, default = None):
+        return self.assoc(key, fn(self.lookup(key, default)))
+    def transient(self):
+        return TransientMap(self.count, self.root)
+    def __eq__(self, other):
+        if not isinstance(other, HashMap) or len(self) != len(other):
+            return False
+        for k, v in self.items():
+            if other.lookup(k, _missing) != v:
+                return False
+        return True
+    def __ne__(self, other):
+        return not self == other
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(frozenset(self.items()))
+        return self._hash
+    def __repr__(self):
+        return "hash_map(%s)" % ", ".join("%r, %r" % e for e in self.items())
+
+class TransientMap(_MapBase):
+    def __init__(self, count, root):
+        self.edit = object()
+        self.count = count
+        self.root = root
+    def _check(self):
+        if self.edit is None:
+            raise TransientError("transient used after persistent!")
+    def assoc(self, key, val):
+        self._check()
+        self.count, self.root = self._assoc(self.edit, key, val)
+        return self
+    def dissoc(self, key):
+        self._check()
+        self.count, self.root = self._dissoc(self.edit, key)
+        return self
+    def persistent(self):
+        self._check()
+        self.edit = None
+        return HashMap(self.count, self.root)
+
+def hash_map(*args):
+    t = HashMap().transient()
+    for i in range(0, len(args), 2):
+        t.assoc(args[i], args[i + 1])
+    return t.persistent()
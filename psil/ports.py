@@ -0,0 +1,109 @@
+"""Output ports.
+
+A port is anything with a write method: a string port, a file or
+sys.stdout. The current output port is sys.stdout itself, so print,
+display and write all follow the redirection done by with_output_to.
+Redirection applies to the calling thread only.
+
+>>> p = StringPort()
+>>> p.write("abc"); p.write("def")
+>>> p.getvalue()
+'abcdef'
+>>> def thunk():
+...     print("hello")
+...     current().write("world")
+>>> with_output_to_string(thunk)
+'hello\\nworld'
+"""
+
+import sys
+import threading
+
+class StringPort(object):
+    """Output port that collects text in memory.
+
+    Writes append to a list that is only joined when the contents are
+    asked for, so building a large string piecewise stays linear.
+    """
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+    def write(self, s):
+        self.parts.append(s)
+    def flush(self):
+        pass
+    def close(self):
+        self.closed = True
+    def getvalue(self):
+        if len(self.parts) > 1:
+            self.parts = ["".join(self.parts)]
+        return self.parts[0] if self.parts else ""
+
+def current(port = None):
+    if port is None:
+        return sys.stdout
+    return port
+
+def open_output_string():
+    return StringPort()
+
+def get_output_string(port):
+    return port.getvalue()
+
+def open_output_file(fn, buffering = -1, append = False):
+    return open(fn, "a" if append else "w", buffering)
+
+def close_port(port):
+    port.close()
+
+class ThreadOutput(object):
+    """Stands in for sys.stdout once output has been redirected, so that
+    each thread writes to the port it redirected to, or else to the
+    original stream."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+    def target(self):
+        port = getattr(self.local, "port", None)
+        return self.stream if port is None else port
+    def write(self, s):
+        return self.target().write(s)
+    def flush(self):
+        self.target().flush()
+    def __getattr__(self, name):
+        return getattr(self.target(), name)
+
+def redirected():
+    """Return the port this thread's output is redirected to, or None."""
+    out = sys.stdout
+    if isinstance(out, ThreadOutput):
+        return getattr(out.local, "port", None)
+    return None
+
+def with_output_to(port, thunk):
+    out = sys.stdout
+    if not isinstance(out, ThreadOutput):
+        out = sys.stdout = ThreadOutput(out)
+    saved = getattr(out.local, "port", None)
+    out.local.port = port
+    try:
+        return thunk()
+    finally:
+        out.local.port = saved
+
+def with_output_to_string(thunk):
+    port = StringPort()
+    with_output_to(port, thunk)
+    return port.getvalue()
+
+def with_output_to_file(fn, thunk, buffering = -1):
+    port = open_output_file(fn, buffering)
+    try:
+        return with_output_to(port, thunk)
+    finally:
+        port.close()
+
+def call_with_output_string(proc):
+    port = StringPort()
+    proc(port)
+    return port.getvalue()
@@ -1,5 +1,6 @@
 import re
 
+from . import metrics
 from .symbol import Symbol
 
 # adapted from http://code.activestate.com/recipes/475109/
@@ -16,7 +17,7 @@ PY_STRING_LITERAL_RE = (r'''
 ''')
 
 RE_NUMBER = re.compile(r"(?:[-+]?\d+(\.\d+)?(e[-+]?\d+)?|(0x[0-9a-f]+))(?!\w)", re.IGNORECASE)
-RE_SYMBOL = re.compile(r"[^ \t\n\(\)]+", re.IGNORECASE)
+RE_SYMBOL = re.compile(r"[^ \t\n\(\)\{\}]+", re.IGNORECASE)
 RE_STRING = re.compile(PY_STRING_LITERAL_RE, re.VERBOSE)
 
 class SyntaxError(Exception):
@@ -32,6 +33,9 @@ class Singleton(object):
 class Token(object):
     LPAREN = Singleton("LPAREN")
     RPAREN = Singleton("RPAREN")
+    LBRACE = Singleton("LBRACE")
+    RBRACE = Singleton("RBRACE")
+    LSET   = Singleton("LSET")
     QUOTE  = Singleton("QUOTE")
     QQUOTE = Singleton("QQUOTE")
     COMMA  = Singleton("COMMA")
@@ -62,11 +66,15 @@ def tokenise(s):
     ['(', 'a', ',@', 'b', 'c', ')']
     >>> [x[1] for x in tokenise("(a(b))")]
     ['(', 'a', '(', 'b', ')', ')']
+    >>> [x[1] for x in tokenise("{a 1} #{b}")]
+    ['{', 'a', 1, '}', '#{', 'b', '}']
     >>> list(tokenise("foo bar baz"))
     [(SYMBOL, 'foo', (1, 0)), (SYMBOL, 'bar', (1, 4)), (SYMBOL, 'baz', (1, 8))]
     >>> list(tokenise("( ) ' `\\n, ,@ \\"a\\" ; comment\\n1.234 symbol"))
     [(LPAREN, '(', (1, 0)), (RPAREN, ')', (1, 2)), (QUOTE, "'", (1, 4)), (QQUOTE, '`', (1, 6)), (COMMA, ',', (2, 0)), (SPLICE, ',@', (2, 2)), (STRING, 'a', (2, 5)), (NUMBER, 1.234, (3, 0)), (SYMBOL, 'symbol', (3, 6))]
     """
+    if metrics.Active:
+        metrics.fire("read", len(s))
     lineno = 1
     col_offset = 0
     i = 0
@@ -88,6 +96,18 @@ def tokenise(s):
             yield (Token.RPAREN, s[i], (lineno, col_offset))
             col_offset += 1
             i += 1
+        elif s[i] == "{":
+            yield (Token.LBRACE, s[i], (lineno, col_offset))
+            col_offset += 1
+            i += 1
+        elif s[i] == "}":
+            yield (Token.RBRACE, s[i], (lineno, col_offset))
+            col_offset += 1
+            i += 1
+        elif s[i:i+2] == "#{":
+            yield (Token.LSET, s[i:i+2], (lineno, col_offset))
+            col_offset += 2
+            i += 2
         elif s[i] == "'":
             yield (Token.QUOTE, s[i], (lineno, col_offset))
             col_offset += 1
@@ -146,6 +166,32 @@ Symbol.defmacro         = Symbol.new("defmacro")
 Symbol.if_              = Symbol.new("if")
 Symbol.lambda_          = Symbol.new("lambda")
 Symbol.set              = Symbol.new("set!")
+Symbol.and_             = Symbol.new("and")
+Symbol.or_              = Symbol.new("or")
+Symbol.cond             = Symbol.new("cond")
+Symbol.when             = Symbol.new("when")
+Symbol.else_            = Symbol.new("else")
+Symbol.while_           = Symbol.new("while")
+Symbol.dotimes          = Symbol.new("dotimes")
+Symbol.for_             = Symbol.new("for")
+Symbol.do               = Symbol.new("do")
+Symbol.named_let        = Symbol.new("named-let")
+
+Symbol.make_hash        = Symbol.new("make-hash")
+Symbol.set_of           = Symbol.new("set-of")
+
+def _parse_until(tokens, close):
+    a = []
+    while True:
+        try:
+            nextoken = next(tokens)
+        except StopIteration:
+            raise SyntaxError("unclosed " + ("parenthesis" if close is Token.RPAREN else "brace"))
+        if nextoken[0] is close:
+            return a
+        if nextoken[0] is Token.RPAREN or nextoken[0] is Token.RBRACE:
+            raise SyntaxError("unexpected " + nextoken[1])
+        a.append(parse(tokens, nextoken))
 
 def parse(tokens, nextoken = None):
     """
@@ -159,24 +205,38 @@ def parse(tokens, nextoken = None):
     psil.reader.SyntaxError: unclosed parenthesis
     >>> parse(tokenise("())"))
     []
+
+    Braces are hash table literals and #{ } set literals; their contents
+    are evaluated:
+
+    >>> parse(tokenise("{a 1 'b (f 2)}"))
+    [<make-hash>, <a>, 1, [<quote>, <b>], [<f>, 2]]
+    >>> parse(tokenise("#{1 x}"))
+    [<set-of>, 1, <x>]
+    >>> parse(tokenise("{a}"))
+    Traceback (most recent call last):
+        ...
+    psil.reader.SyntaxError: hash literal needs an even number of forms
     """
     if nextoken is None:
         try:
             nextoken = next(tokens)
         except StopIteration:
             return None
+        if metrics.Active:
+            r = parse(tokens, nextoken)
+            metrics.fire("parse", r)
+            return r
     t, v, pos = nextoken
     if t == Token.LPAREN:
-        a = []
-        while True:
-            try:
-                nextoken = next(tokens)
-            except StopIteration:
-                raise SyntaxError("unclosed parenthesis")
-            if nextoken[0] == Token.RPAREN:
-                break
-            a.append(parse(tokens, nextoken))
-        return a
+        return _parse_until(tokens, Token.RPAREN)
+    elif t == Token.LBRACE:
+        a = _parse_until(tokens, Token.RBRACE)
+        if len(a) % 2:
+            raise SyntaxError("hash literal needs an even number of forms")
+        return [Symbol.make_hash] + a
+    elif t == Token.LSET:
+        return [Symbol.set_of] + _parse_until(tokens, Token.RBRACE)
     elif t == Token.STRING:
         return v
     elif t == Token.NUMBER:
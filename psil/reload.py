@@ -0,0 +1,114 @@
+"""Reload a file by evaluating only the top level forms that changed.
+
+load(fn) remembers each top level form of fn by its text. Loading fn
+again evaluates the forms that are new or edited, and the forms that use
+a macro that was redefined, directly or through another macro; the rest
+are skipped without being expanded. Definitions replace the old ones in
+Globals without the redefinition warning. Definitions deleted from the
+file keep their old value.
+
+>>> import os, tempfile
+>>> d = tempfile.mkdtemp()
+>>> fn = os.path.join(d, "rules.psil")
+>>> def write(text):
+...     f = open(fn, "w")
+...     f.write(text)
+...     f.close()
+>>> write('''
+... (defmacro times-two (x) `(* 2 ,x))
+... (define (double n) (times-two n))
+... (define (square n) (* n n))
+... (print (square 3))
+... ''')
+>>> load(fn)
+9
+['times-two', 'double', 'square', '(print (square 3))']
+>>> write('''
+... (defmacro times-two (x) `(+ ,x ,x))
+... (define (double n) (times-two n))
+... (define (square n) (* n n))
+... (print (square 3))
+... ''')
+>>> load(fn)
+['times-two', 'double']
+>>> psil("(double 21)")
+42
+>>> load(fn)
+[]
+>>> os.remove(fn); os.rmdir(d)
+"""
+
+import os
+import sys
+import time
+import traceback
+
+from . import interpreter
+from .interpreter import Symbol, external, psil
+
+# For each file loaded, the text of its top level forms.
+Loaded = {}
+
+def _symbols(p, r):
+    if isinstance(p, Symbol):
+        r.add(p)
+    elif isinstance(p, list):
+        for x in p:
+            _symbols(x, r)
+    return r
+
+def _name(p):
+    """What the report calls form p: the name it defines, or its text."""
+    if isinstance(p, list) and len(p) > 1 and p[0] in (Symbol.define, Symbol.defmacro):
+        return p[1].name if isinstance(p[1], Symbol) else p[1][0].name
+    return external(p)
+
+def load(fn):
+    """Evaluate the top level forms of fn that changed since it was last
+    loaded, and return what was evaluated."""
+    text = interpreter.read_source(fn)
+    old = Loaded.get(fn, set())
+    new = set()
+    macros = set()
+    done = []
+    def each(p, pos, run):
+        key = external(p)
+        new.add(key)
+        if key in old and not (_symbols(p, set()) & macros):
+            return None
+        if isinstance(p, list) and len(p) > 1 and p[0] is Symbol.defmacro:
+            # forms expanded with it have to be expanded again
+            macros.add(p[1])
+        done.append(_name(p))
+        return run()
+    saved = interpreter.WarnRedefine
+    interpreter.WarnRedefine = False
+    try:
+        psil(text, each=each)
+    finally:
+        interpreter.WarnRedefine = saved
+    # after an error, what changed is evaluated again next time
+    Loaded[fn] = new
+    return done
+
+def watch(fns, interval = 1.0):
+    """Load the files fns, then load each one again whenever it changes."""
+    mtimes = {}
+    while True:
+        for fn in fns:
+            try:
+                mtime = os.stat(fn).st_mtime
+            except OSError:
+                continue
+            if mtimes.get(fn) == mtime:
+                continue
+            reloading = fn in mtimes
+            mtimes[fn] = mtime
+            try:
+                done = load(fn)
+            except Exception:
+                traceback.print_exc()
+                continue
+            if reloading:
+                print("reloaded {0}: {1}".format(fn, ", ".join(done) or "no changes"), file=sys.stderr)
+        time.sleep(interval)
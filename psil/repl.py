@@ -0,0 +1,216 @@
+"""Meta-commands for the interactive loop.
+
+A line starting with ":" is a command rather than psil code. Timings are
+kept in Results for the rest of the session so runs can be compared with
+:results. :time, :bench and :profile run the code compiled when compiled
+mode is on, with the compiling left out of the time.
+
+>>> meta(":expand (let ((a 1)) b c)")
+((lambda (a) b c) 1)
+expanded in ... ms
+>>> meta(":time (+ 1 2)")
+3
+(+ 1 2): ... ms
+>>> meta(":bench 5 (* 2 3)")
+(* 2 3): 5 runs, min ... ms, median ... ms, stddev ... ms
+>>> meta(":bench 0 (* 2 3)")
+usage: :bench count expr, with a count of at least 1
+>>> meta(":compile (.append (list) 1) (len '(a b))")
+2
+(.append (list) 1) (len '(a b)): compiled in ... ms, ran in ... ms
+>>> meta(":compile")
+compiled mode on
+>>> meta(":time (define (f x) (* x 2)) (f 21)")
+42
+(define (f x) (* x 2)) (f 21): ... ms compiled
+>>> meta(":bench 3 (* 2 3)")
+(* 2 3): 3 runs, min ... ms, median ... ms, stddev ... ms compiled
+>>> meta(":compile")
+compiled mode off
+>>> meta(":profile (+ 1 2)")
+3
+...function calls...seconds...
+>>> [r[0] for r in Results]
+[':expand (let ((a 1)) b c)', ':time (+ 1 2)', ':bench 5 (* 2 3)', ":compile (.append (list) 1) (len '(a b))", ':time (define (f x) (* x 2)) (f 21)', ':bench 3 (* 2 3)']
+>>> meta(":nonsense")
+unknown command :nonsense
+commands: :bench :clear :compile :expand :profile :reload :results :time
+"""
+
+import math
+import timeit
+
+from . import interpreter
+from .interpreter import external, macroexpand_r, parse, tokenise
+
+Results = []
+
+def _forms(s):
+    forms = []
+    tokens = tokenise(s)
+    while True:
+        p = parse(tokens)
+        if p is None:
+            break
+        p = macroexpand_r(p)
+        if p is not None:
+            forms.append(p)
+    return forms
+
+def _run(forms):
+    r = None
+    for p in forms:
+        r = interpreter.evaluate(p)
+    return r
+
+def _compiled(forms):
+    """Compile forms as psil() does in compiled mode and return a function
+    that runs them, returning the value of the last."""
+    import ast
+    from .compiler import Context, psilc
+    context = Context()
+    code = []
+    for p in forms:
+        body = psilc(p, context)
+        if isinstance(body[-1], ast.Expr):
+            body[-1] = ast.Assign([ast.Name("_repl_value", ast.Store())], body[-1].value)
+        tree = ast.Module(body, [])
+        ast.fix_missing_locations(tree)
+        code.append(compile(tree, "<psil>", "exec"))
+    # as in psil()
+    g = dict(vars(interpreter))
+    g.update(interpreter.Globals.symbols)
+    def run():
+        for c in code:
+            g["_repl_value"] = None
+            exec(c, g)
+        return g["_repl_value"]
+    return run
+
+def _runner(forms):
+    """A function that runs forms in the current mode, compiling them
+    first if compiled mode is on."""
+    if interpreter.Compile:
+        return _compiled(forms)
+    return lambda: _run(forms)
+
+def _mode():
+    return " compiled" if interpreter.Compile else ""
+
+def _ms(t):
+    return "%.3f" % (t * 1000)
+
+def _stats(times):
+    times = sorted(times)
+    n = len(times)
+    if n % 2:
+        median = times[n // 2]
+    else:
+        median = (times[n // 2 - 1] + times[n // 2]) / 2
+    mean = sum(times) / n
+    stddev = math.sqrt(sum((x - mean) ** 2 for x in times) / n)
+    return times[0], median, stddev
+
+def _record(line, summary):
+    Results.append((line, summary))
+    print(summary)
+
+def do_time(line, arg):
+    run = _runner(_forms(arg))
+    start = timeit.default_timer()
+    r = run()
+    t = timeit.default_timer() - start
+    if r is not None:
+        print(external(r))
+    _record(line, "{0}: {1} ms{2}".format(arg, _ms(t), _mode()))
+
+def do_bench(line, arg):
+    parts = arg.split(None, 1)
+    if len(parts) < 2 or not parts[0].isdigit() or int(parts[0]) < 1:
+        print("usage: :bench count expr, with a count of at least 1")
+        return
+    count, expr = int(parts[0]), parts[1]
+    run = _runner(_forms(expr))
+    times = []
+    for i in range(count):
+        start = timeit.default_timer()
+        run()
+        times.append(timeit.default_timer() - start)
+    lo, median, stddev = _stats(times)
+    _record(line, "{0}: {1} runs, min {2} ms, median {3} ms, stddev {4} ms{5}".format(expr, count, _ms(lo), _ms(median), _ms(stddev), _mode()))
+
+def do_compile(line, arg):
+    if not arg:
+        interpreter.Compile = not interpreter.Compile
+        print("compiled mode", "on" if interpreter.Compile else "off")
+        return
+    # the forms run once, so compiling and running are timed apart; :time
+    # with compiled mode off gives the interpreter's time to compare
+    forms = _forms(arg)
+    start = timeit.default_timer()
+    run = _compiled(forms)
+    compiled = timeit.default_timer() - start
+    start = timeit.default_timer()
+    r = run()
+    ran = timeit.default_timer() - start
+    if r is not None:
+        print(external(r))
+    _record(line, "{0}: compiled in {1} ms, ran in {2} ms".format(arg, _ms(compiled), _ms(ran)))
+
+def do_expand(line, arg):
+    tokens = tokenise(arg)
+    forms = []
+    start = timeit.default_timer()
+    while True:
+        p = parse(tokens)
+        if p is None:
+            break
+        forms.append(macroexpand_r(p))
+    t = timeit.default_timer() - start
+    for p in forms:
+        print(external(p))
+    _record(line, "expanded in {0} ms".format(_ms(t)))
+
+def do_profile(line, arg):
+    import cProfile
+    import pstats
+    run = _runner(_forms(arg))
+    profile = cProfile.Profile()
+    r = profile.runcall(run)
+    if r is not None:
+        print(external(r))
+    pstats.Stats(profile).sort_stats("cumulative").print_stats(20)
+
+def do_reload(line, arg):
+    from . import reload
+    done = reload.load(arg)
+    print("reloaded:", " ".join(done) if done else "no changes")
+
+def do_results(line, arg):
+    for i, (cmd, summary) in enumerate(Results):
+        print("{0:3}  {1}".format(i + 1, summary))
+
+def do_clear(line, arg):
+    del Results[:]
+
+Commands = {
+    "time": do_time,
+    "bench": do_bench,
+    "compile": do_compile,
+    "expand": do_expand,
+    "profile": do_profile,
+    "reload": do_reload,
+    "results": do_results,
+    "clear": do_clear,
+}
+
+def meta(line):
+    parts = line[1:].split(None, 1)
+    name = parts[0] if parts else ""
+    arg = parts[1].strip() if len(parts) > 1 else ""
+    f = Commands.get(name)
+    if f is None:
+        print("unknown command :" + name)
+        print("commands:", " ".join(":" + x for x in sorted(Commands)))
+        return
+    f(line, arg)
@@ -1,54 +1,196 @@
 import ast
 import builtins
+import importlib.util
 import marshal
 import os
-import py_compile
+import re
+import struct
 
+from . import deparse
 from . import interpreter
-from .compiler import psilc
+from . import metrics
+from . import runtime
+from .compiler import Context, psilc
+
+def compile_module(code, keep = None):
+    """Compile the forms in code to a Python module tree.
+
+    With interpreter.Optimize set, the module is optimized as a whole
+    first (see psil.optimize); keep is passed on to say which definitions
+    must survive.
+    """
+    forms = []
+    t = interpreter.tokenise(code)
+    while True:
+        p = interpreter.parse(t)
+        if p is None:
+            break
+        p = interpreter.macroexpand_r(p)
+        if p is None:
+            continue
+        forms.append(p)
+    if interpreter.Optimize:
+        from . import optimize
+        forms = optimize.optimize(forms, keep)
+    context = Context()
+    body = [x for p in forms for x in psilc(p, context)]
+    if interpreter.Optimize:
+        optimize.bind_globals(body)
+    tree = ast.Module(body, [])
+    ast.fix_missing_locations(tree)
+    return tree
+
+def module_source(tree, origin = None):
+    """
+    >>> print(module_source(compile_module("(define (inc x) (+ x 1)) (print (null? (list)))")), end="")
+    from psil.runtime import Builtins as _psil
+    null_3f_ = _psil['null?']
+    def inc(x):
+        return (x + 1)
+    print(null_3f_([]))
+
+    >>> interpreter.Optimize = True
+    >>> try:
+    ...     print(module_source(compile_module('''
+    ...         (define (_double x) (* 2 x))
+    ...         (define (scale l) (make-list (map (lambda (x) (_double x)) l)))
+    ...         (define (twice l) (scale (scale l)))''')), end="")
+    ... finally:
+    ...     interpreter.Optimize = False
+    from psil.runtime import Builtins as _psil
+    make_2d_list = _psil['make-list']
+    def scale(l, *, make_2d_list=make_2d_list):
+        return make_2d_list(map(lambda x: (2 * x), l))
+    def twice(l, *, scale=scale):
+        return scale(scale(l))
+
+    >>> print(module_source(compile_module("(print (if True None False))")), end="")
+    print((None if True else False))
+
+    Quoted data is built once, when the module is loaded:
+
+    >>> print(module_source(compile_module("(define (f) '(a b)) (define (g) '(c))")), end="")
+    from psil.symbol import Symbol as _psil_Symbol
+    _quote_1 = [_psil_Symbol.new('a'), _psil_Symbol.new('b')]
+    def f():
+        return _quote_1
+    _quote_2 = [_psil_Symbol.new('c')]
+    def g():
+        return _quote_2
+    """
+    defined = set()
+    used = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Store):
+                defined.add(node.id)
+            else:
+                used.add(node.id)
+        elif isinstance(node, ast.FunctionDef):
+            defined.add(node.name)
+    src = deparse.SourceGenerator()
+    if origin is not None:
+        src.line("# generated by psilc from " + origin)
+    needed = sorted(x for x in used - defined if x in interpreter.Globals.symbols)
+    # most builtins come from the runtime alone; the rest need the
+    # interpreter and its prelude
+    if any(x in runtime.Builtins for x in needed):
+        src.line("from psil.runtime import Builtins as _psil")
+        for name in needed:
+            if name in runtime.Builtins:
+                src.line("{0} = _psil[{1!r}]".format(deparse.ident(name), name))
+    if any(x not in runtime.Builtins for x in needed):
+        src.line("from psil.interpreter import Globals as _psil_globals")
+        for name in needed:
+            if name not in runtime.Builtins:
+                src.line("{0} = _psil_globals.symbols[{1!r}]".format(deparse.ident(name), name))
+    if interpreter.Optimize:
+        from . import optimize
+        optimize.bind_globals(tree.body, needed)
+    deparse.gen_source(tree, src)
+    return str(src)
+
+def compile_file(psilname, pyname = None, keep = None):
+    if pyname is None:
+        pyname = os.path.splitext(psilname)[0] + ".py"
+    f = open(psilname)
+    code = f.read()
+    f.close()
+    m = re.match(r"#!.*?$", code, re.MULTILINE)
+    if m is not None:
+        code = code[m.end(0):]
+    source = module_source(compile_module(code, keep), os.path.basename(psilname))
+    f = open(pyname, "w")
+    f.write(source)
+    f.close()
+    return pyname
+
+def write_cache(psilname, pycname):
+    """Compile psilname to a bytecode cache that Python can import."""
+    st = os.stat(psilname)
+    code = interpreter.read_source(psilname)
+    source = module_source(compile_module(code))
+    codeobject = compile(source, psilname, 'exec')
+    # magic number, flags (0: checked by timestamp), source mtime and size
+    header = importlib.util.MAGIC_NUMBER + struct.pack("<III", 0, int(st.st_mtime) & 0xFFFFFFFF, st.st_size & 0xFFFFFFFF)
+    fc = open(pycname, 'wb')
+    fc.write(header)
+    marshal.dump(codeobject, fc)
+    fc.close()
+
+def find_module(name, directory = ""):
+    """Return the path of the source of psil module name, looked for in
+    directory (the current one by default) as (import name) does, or None."""
+    path = os.path.join(directory, name + ".psil")
+    return path if os.path.exists(path) else None
+
+def cache_is_current(psilname, pycname):
+    """Whether pycname was written by write_cache from psilname as it is
+    now: the mtime and size in its header match the source, as Python
+    checks them, and it is not older than the source, which also catches
+    edits within the second it was written in."""
+    try:
+        st = os.stat(psilname)
+        cache = os.stat(pycname)
+        with open(pycname, "rb") as f:
+            header = f.read(16)
+    except OSError:
+        return False
+    if len(header) < 16 or header[:4] != importlib.util.MAGIC_NUMBER:
+        return False
+    if struct.unpack("<III", header[4:]) != (0, int(st.st_mtime) & 0xFFFFFFFF, st.st_size & 0xFFFFFFFF):
+        return False
+    return cache.st_mtime >= st.st_mtime
 
 def _import(fn, globals):
+    """Import module fn, compiling fn.psil to fn.pyc first when there is
+    no Python module of that name and the cache is missing or stale.
+
+    >>> import sys, tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> f = open(os.path.join(d, "cached_example.psil"), "w")
+    >>> f.write("(define (inc x) (+ x 1)) (define empty (null? (list)))") and None
+    >>> f.close()
+    >>> cwd = os.getcwd()
+    >>> os.chdir(d); sys.path.insert(0, d)
+    >>> m = _import("cached_example", {})
+    >>> m.inc(41), m.empty, os.path.exists("cached_example.pyc")
+    (42, True, True)
+    >>> os.chdir(cwd); sys.path.remove(d); del sys.modules["cached_example"]
+    >>> for x in os.listdir(d): os.remove(os.path.join(d, x))
+    >>> os.rmdir(d)
+    """
     try:
         return __import__(fn, globals=globals)
     except ImportError:
-        psilname = fn + ".psil"
-        pycname = fn + ".pyc"
-        try:
-            psilstat = os.stat(psilname)
-        except OSError:
+        psilname = find_module(fn)
+        if psilname is None:
             raise ImportError("no such module")
-        timestamp = int(psilstat.st_mtime)
-        try:
-            pycstat = os.stat(pycname)
-        except OSError:
-            pycstat = None
-        if pycstat is None or pycstat.st_mtime < timestamp:
-            f = open(psilname)
-            code = f.read()
-            f.close()
-            body = []
-            t = interpreter.tokenise(code)
-            while True:
-                p = interpreter.parse(t)
-                if p is None:
-                    break
-                p = interpreter.macroexpand_r(p)
-                if p is None:
-                    continue
-                tree = psilc(p)
-                body.append(tree)
-            tree = ast.Module(body)
-            ast.fix_missing_locations(tree)
-            codeobject = compile(tree, psilname, 'exec')
-
-            fc = open(pycname, 'wb')
-            fc.write(b'\0\0\0\0')
-            py_compile.wr_long(fc, timestamp)
-            marshal.dump(codeobject, fc)
-            fc.flush()
-            fc.seek(0, 0)
-            fc.write(py_compile.MAGIC)
-            fc.close()
-            py_compile.set_creator_type(pycname)
-
-            return builtins.__import__(fn, globals=globals)
+        pycname = fn + ".pyc"
+        if not cache_is_current(psilname, pycname):
+            if metrics.Active:
+                metrics.fire("compile-cache-miss", fn)
+            write_cache(psilname, pycname)
+        elif metrics.Active:
+            metrics.fire("compile-cache-hit", fn)
+        return builtins.__import__(fn, globals=globals)
@@ -0,0 +1,162 @@
+"""The builtin functions that compiled code calls.
+
+A module made by psilc imports the builtins it uses from here, which
+does not load the reader, the macro expander or the prelude. The
+interpreter adds them all to Globals.
+
+>>> Builtins["null?"]([])
+True
+>>> Builtins["append"]([1], (2, 3))
+[1, 2, 3]
+"""
+
+import functools
+import operator
+
+from . import memo
+from .symbol import Symbol
+
+Builtins = {}
+
+Builtins["+"]         = lambda *args: sum(args)
+Builtins["-"]         = lambda *args: -args[0] if len(args) == 1 else functools.reduce(operator.sub, args)
+Builtins["*"]         = lambda *args: functools.reduce(operator.mul, args, 1)
+Builtins["**"]        = operator.pow
+Builtins["/"]         = lambda *args: 1.0/args[0] if len(args) == 1 else functools.reduce(operator.truediv, args)
+Builtins["//"]        = lambda *args: functools.reduce(operator.floordiv, args)
+Builtins["%"]         = lambda x, y: x % tuple(y) if isinstance(y, list) else x % y
+Builtins["<<"]        = operator.lshift
+Builtins[">>"]        = operator.rshift
+Builtins["&"]         = lambda *args: functools.reduce(operator.and_, args, -1)
+Builtins["|"]         = lambda *args: functools.reduce(operator.or_, args, 0)
+Builtins["^"]         = operator.xor
+Builtins["~"]         = operator.invert
+def _all(p, a):
+    for i in range(len(a)-1):
+        if not p(a[i], a[i+1]):
+            return False
+    return True
+def _any(p, a):
+    for i in range(len(a)-1):
+        if p(a[i], a[i+1]):
+            return True
+    return False
+Builtins["<"]         = lambda *args: _all(operator.lt, args)
+Builtins[">"]         = lambda *args: _all(operator.gt, args)
+Builtins["<="]        = lambda *args: _all(operator.le, args)
+Builtins[">="]        = lambda *args: _all(operator.ge, args)
+Builtins["=="]        = lambda *args: _all(operator.eq, args)
+Builtins["!="]        = operator.ne
+Builtins["is"]        = lambda *args: _all(operator.is_, args)
+Builtins["is-not"]    = operator.is_not
+Builtins["in"]        = lambda x, y: x in y
+Builtins["not-in"]    = lambda x, y: x not in y
+Builtins["not"]       = operator.not_
+
+def _del(x, y):
+    del x[y]
+Builtins["del"]       = _del
+
+Builtins["list"]     = lambda *args: list(args)
+Builtins["make-list"]= lambda args: list(args)
+Builtins["list?"]    = lambda x: isinstance(x, (list, tuple))
+Builtins["cons"]     = lambda x, y: [x] + list(y) if isinstance(y, (list, tuple)) else [x]
+def _set_car(x, y): x[0] = y
+Builtins["set-car!"] = _set_car
+Builtins["car"]    = lambda x: x[0]
+Builtins["cdr"]    = lambda x: x[1:]
+Builtins["caar"]   = lambda x: x[0][0]
+Builtins["cadr"]   = lambda x: x[1]
+Builtins["cdar"]   = lambda x: x[0][1:]
+Builtins["cddr"]   = lambda x: x[2:]
+Builtins["caaar"]  = lambda x: x[0][0][0]
+Builtins["caadr"]  = lambda x: x[1][0]
+Builtins["caddr"]  = lambda x: x[2]
+Builtins["cadddr"] = lambda x: x[3]
+#Builtins["cadar"]  = lambda x: x[0][1][0] # TODO
+#Builtins["caddr"]  = lambda x: x[0][0][0]
+#Builtins["cdaar"]  = lambda x: x[0][0][0]
+#Builtins["cdadr"]  = lambda x: x[0][0][0]
+#Builtins["cddar"]  = lambda x: x[0][0][0]
+#Builtins["cdddr"]  = lambda x: x[0][0][0]
+Builtins["caaaar"] = lambda x: x[0][0][0][0]
+#...
+Builtins["null?"]  = lambda x: isinstance(x, (list, tuple)) and len(x) == 0
+Builtins["append"] = lambda *args: functools.reduce(operator.concat, map(list, args), [])
+Builtins["reverse"] = lambda x: list(reversed(x))
+Builtins["list-tail"] = lambda x, y: x[y:]
+Builtins["list-ref"] = lambda x, y: x[y]
+
+Builtins["symbol?"] = lambda x: isinstance(x, Symbol)
+Builtins["symbol->string"] = lambda x: x.name
+Builtins["string->symbol"] = Symbol.new_weak
+Builtins["symbol-table-size"] = Symbol.table_size
+
+
+Builtins["apply"] = lambda *args: args[0](*args[1])
+Builtins["concat"] = lambda *args: "".join(str(x) for x in args)
+Builtins["format"] = lambda x, *y: x % y
+Builtins["index"] = lambda x, y: x[y]
+Builtins["slice"] = lambda x, y, z: x[y:z]
+def _set(x, y, z):
+    x[y] = z
+Builtins["dict-set"] = _set
+
+Builtins["gensym"] = Symbol.gensym
+
+def _make_hash(*args):
+    return dict(zip(args[::2], args[1::2]))
+def _hash_ref(h, k, *default):
+    if default:
+        return h.get(k, default[0])
+    return h[k]
+def _hash_set(h, k, v):
+    h[k] = v
+def _hash_update(h, k, f, *default):
+    h[k] = f(h.get(k, default[0]) if default else h[k])
+Builtins["make-hash"] = _make_hash
+Builtins["hash?"] = lambda x: isinstance(x, dict)
+Builtins["hash-ref"] = _hash_ref
+Builtins["hash-set!"] = _hash_set
+Builtins["hash-update!"] = _hash_update
+Builtins["hash-remove!"] = lambda h, k: h.pop(k, None)
+Builtins["hash-has-key?"] = lambda h, k: k in h
+Builtins["hash-keys"] = lambda h: list(h)
+Builtins["hash-values"] = lambda h: list(h.values())
+Builtins["hash->list"] = lambda h: [[k, v] for k, v in h.items()]
+Builtins["hash-count"] = len
+
+Builtins["set-of"] = lambda *args: set(args)
+Builtins["set?"] = lambda x: isinstance(x, (set, frozenset))
+Builtins["list->set"] = set
+Builtins["set->list"] = list
+Builtins["set-member?"] = lambda s, x: x in s
+Builtins["set-add!"] = lambda s, x: s.add(x)
+Builtins["set-remove!"] = lambda s, x: s.discard(x)
+Builtins["set-union"] = lambda s, *args: s.union(*args)
+Builtins["set-intersect"] = lambda s, *args: s.intersection(*args)
+Builtins["set-subtract"] = lambda s, *args: s.difference(*args)
+
+
+
+Builtins["memoize"] = memo.memoize
+Builtins["memo-stats"] = lambda f: f.stats()
+
+# psil.persistent is imported on first use
+def _persistent():
+    from . import persistent
+    return persistent
+Builtins["pvector"] = lambda *args: _persistent().vector(*args)
+Builtins["pmap"] = lambda *args: _persistent().hash_map(*args)
+Builtins["pvector?"] = lambda x: isinstance(x, _persistent().Vector)
+Builtins["pmap?"] = lambda x: isinstance(x, _persistent().HashMap)
+Builtins["assoc"] = lambda c, k, v: c.assoc(k, v)
+Builtins["dissoc"] = lambda c, k: c.dissoc(k)
+Builtins["update"] = lambda c, k, f: c.update(k, f)
+Builtins["lookup"] = lambda c, k, d=None: c.lookup(k, d)
+Builtins["conj"] = lambda c, x: c.conj(x)
+Builtins["transient"] = lambda c: c.transient()
+Builtins["assoc!"] = lambda t, k, v: t.assoc(k, v)
+Builtins["dissoc!"] = lambda t, k: t.dissoc(k)
+Builtins["conj!"] = lambda t, x: t.conj(x)
+Builtins["persistent!"] = lambda t: t.persistent()
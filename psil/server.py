@@ -0,0 +1,246 @@
+"""Evaluation server: keep warm interpreters around between runs.
+
+serve() binds a UNIX socket and forks a pool of workers that have already
+imported the interpreter and loaded the prelude. Each connection carries
+one JSON request, terminated by the client shutting down its side:
+
+    {"op": "eval", "source": "(print 1)", "cwd": "/some/dir"}
+    {"op": "run", "path": "/some/dir/script.psil", "cwd": "/some/dir"}
+
+The reply is a JSON object with the captured "output" and, if the request
+failed, an "error". Every request starts from a copy of the global
+environment as it was after the prelude, so definitions made by one
+request are not seen by the next. Global lists, dictionaries and sets are
+copied too, but state kept anywhere else, such as in the scope of a
+function or in a Python module, is shared by all requests a worker runs.
+
+>>> saved = snapshot()
+>>> handle({"op": "eval", "source": "(define x 20) (print (+ x 1))"}, saved)
+{'output': '21\\n'}
+>>> r = handle({"op": "eval", "source": "(print 1) x"}, saved)
+>>> r["output"], r["error"]
+('1\\n* x\\n', 'psil.interpreter.UndefinedSymbolError: x')
+>>> handle({"op": "frobnicate"}, saved)["error"]
+'unknown op frobnicate'
+>>> from psil import server
+>>> server.MaxSteps = 1000
+>>> handle({"op": "eval", "source": "(define (spin) (spin)) (spin)"}, saved)["error"]
+'psil.limits.LimitExceeded: more than 1000 evaluation steps'
+>>> server.MaxSteps = None
+>>> Globals.symbols["seen"] = []
+>>> saved = snapshot()
+>>> handle({"op": "eval", "source": "(.append seen 1) (print seen)"}, saved)
+{'output': '[1]\\n'}
+>>> handle({"op": "eval", "source": "(.append seen 2) (print seen)"}, saved)
+{'output': '[2]\\n'}
+>>> del Globals.symbols["seen"]
+"""
+
+import copy
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import traceback
+
+from . import interpreter
+from . import limits
+from .interpreter import Globals
+
+# Number of worker processes, and so the number of requests run at once.
+Workers = 4
+
+# Connections waiting for a free worker before new ones are refused.
+Backlog = 64
+
+# A worker is replaced after this many requests, to bound any state that
+# survives the environment reset (symbol table, caches, leaks).
+MaxRequests = 1000
+
+# Seconds a single request may run before it is abandoned.
+Timeout = 60
+
+# Budget for each request's evaluation, enforced by psil.limits; None for
+# no limit. Unlike Timeout, running out leaves the worker to carry on with
+# its next request.
+MaxSteps = None
+MaxDepth = None
+MaxMemory = None
+
+MaxRequestSize = 1 << 20
+
+class RequestTimeout(Exception):
+    pass
+
+def _copy(x):
+    # mutable data is copied, so that a request cannot change it for the
+    # next; anything else is kept as it is
+    if isinstance(x, (list, dict, set, bytearray)):
+        return copy.deepcopy(x)
+    return x
+
+def snapshot():
+    return {k: _copy(v) for k, v in Globals.symbols.items()}
+
+def restore(saved):
+    Globals.symbols.clear()
+    Globals.symbols.update((k, _copy(v)) for k, v in saved.items())
+
+# Whether the alarm set for the current request may still raise
+# RequestTimeout; cleared before anything is put back after the request.
+_armed = False
+
+def _arm():
+    global _armed
+    _armed = True
+    signal.alarm(Timeout)
+
+def _disarm():
+    global _armed
+    _armed = False
+    signal.alarm(0)
+
+def _timeout(signum, frame):
+    if _armed:
+        raise RequestTimeout("request took longer than {0} seconds".format(Timeout))
+
+def _reset(stdout, cwd, saved):
+    sys.stdout = stdout
+    os.chdir(cwd)
+    restore(saved)
+
+def handle(request, saved):
+    reply = {}
+    output = io.StringIO()
+    stdout = sys.stdout
+    cwd = os.getcwd()
+    try:
+        sys.stdout = output
+        if request.get("cwd"):
+            os.chdir(request["cwd"])
+        op = request.get("op")
+        if op == "eval":
+            run = lambda: interpreter.psil(request["source"])
+        elif op == "run":
+            run = lambda: interpreter.include(request["path"])
+        else:
+            run = None
+            reply["error"] = "unknown op {0}".format(op)
+        if run is not None:
+            limits.limited(run, steps=MaxSteps, seconds=Timeout or None, depth=MaxDepth, memory=MaxMemory)
+    except Exception as e:
+        reply["error"] = "".join(traceback.format_exception_only(type(e), e)).strip()
+    finally:
+        # a timeout must not cut the restore short
+        _disarm()
+        _reset(stdout, cwd, saved)
+    reply["output"] = output.getvalue()
+    return reply
+
+def _receive(conn):
+    chunks = []
+    size = 0
+    while True:
+        data = conn.recv(65536)
+        if not data:
+            break
+        size += len(data)
+        if size > MaxRequestSize:
+            raise ValueError("request too large")
+        chunks.append(data)
+    return json.loads(b"".join(chunks).decode("utf-8"))
+
+def _serve_connection(conn, saved):
+    try:
+        request = _receive(conn)
+    except ValueError as e:
+        reply = {"output": "", "error": "bad request: {0}".format(e)}
+    else:
+        stdout = sys.stdout
+        cwd = os.getcwd()
+        if Timeout:
+            _arm()
+        try:
+            reply = handle(request, saved)
+        except RequestTimeout as e:
+            # it went off as handle was finishing, before it disarmed the
+            # alarm, so the environment may be half restored
+            _disarm()
+            _reset(stdout, cwd, saved)
+            reply = {"output": "", "error": str(e)}
+        finally:
+            _disarm()
+    conn.sendall(json.dumps(reply).encode("utf-8"))
+
+def worker(sock, saved):
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGALRM, _timeout)
+    for i in range(MaxRequests):
+        conn, addr = sock.accept()
+        try:
+            _serve_connection(conn, saved)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            conn.close()
+
+def _spawn(sock, saved):
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            worker(sock, saved)
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            os._exit(status)
+    return pid
+
+def _terminate(signum, frame):
+    sys.exit(0)
+
+def serve(path, workers = None):
+    if workers is None:
+        workers = Workers
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o077)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(umask)
+    sock.listen(Backlog)
+    # so that the budgets stop compiled code as well
+    limits.CompileChecks = True
+    saved = snapshot()
+    signal.signal(signal.SIGTERM, _terminate)
+    children = set()
+    try:
+        for i in range(workers):
+            children.add(_spawn(sock, saved))
+        print("psil: serving on {0} with {1} workers".format(path, workers), file=sys.stderr)
+        while True:
+            pid, status = os.wait()
+            if pid in children:
+                children.remove(pid)
+                children.add(_spawn(sock, saved))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        sock.close()
+        os.unlink(path)
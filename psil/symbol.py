@@ -1,18 +1,66 @@
+"""Symbols.
+
+Symbols read from source are interned for the life of the process.
+gensym and string->symbol intern weakly: the symbol stays unique by name
+while something refers to it, and is then collected.
+
+>>> Symbol.new("a") is Symbol.new("a")
+True
+>>> g = Symbol.gensym()
+>>> Symbol.new(g.name) is g
+True
+>>> n = Symbol.table_size()["weak"]
+>>> del g
+>>> Symbol.table_size()["weak"] == n - 1
+True
+>>> Symbol.new(":key").keyword, Symbol.new("key").keyword
+(True, False)
+"""
+
+import itertools
+import threading
+import weakref
+
 class Symbol(object):
+    __slots__ = ("name", "keyword", "__weakref__")
     def __init__(self, name):
         self.name = name
+        # keywords (:name) evaluate to themselves
+        self.keyword = name.startswith(":")
     def __repr__(self):
         return "<%s>" % self.name
     names = {}
-    gensym_counter = 0
+    weak = weakref.WeakValueDictionary()
+    # taken to add a symbol, so that threads agree on one symbol per name
+    lock = threading.Lock()
+    gensym_counter = itertools.count(1)
+    @staticmethod
+    def _find(name):
+        s = Symbol.names.get(name)
+        if s is None:
+            s = Symbol.weak.get(name)
+        return s
     @staticmethod
     def new(name):
-        if name in Symbol.names:
-            return Symbol.names[name]
-        s = Symbol(name)
-        Symbol.names[name] = s
+        s = Symbol.names.get(name)
+        if s is None:
+            with Symbol.lock:
+                s = Symbol._find(name)
+                if s is None:
+                    s = Symbol.names[name] = Symbol(name)
+        return s
+    @staticmethod
+    def new_weak(name):
+        s = Symbol.names.get(name)
+        if s is None:
+            with Symbol.lock:
+                s = Symbol._find(name)
+                if s is None:
+                    s = Symbol.weak[name] = Symbol(name)
         return s
     @staticmethod
     def gensym():
-        Symbol.gensym_counter += 1
-        return Symbol.new("_g_%d" % Symbol.gensym_counter)
+        return Symbol.new_weak("_g_%d" % next(Symbol.gensym_counter))
+    @staticmethod
+    def table_size():
+        return {"interned": len(Symbol.names), "weak": len(Symbol.weak)}
@@ -0,0 +1,149 @@
+"""Tiered execution: compile frequently called functions with psilc.
+
+When interpreter.TierThreshold is set, every Function counts its calls and
+on reaching the threshold asks compile_function for a Python replacement.
+Only functions the compiler translates faithfully are compiled; those
+that use a form in Unsupported, or make calls in tail position other than
+loops, stay interpreted.
+
+>>> from psil import interpreter
+>>> interpreter.TierThreshold = 2
+>>> interpreter.psil("(define (sq x) (* x x))")
+<psil.interpreter.Function object at 0x...>
+>>> interpreter.psil("(list (sq 3) (sq 4) (sq 5))")
+[9, 16, 25]
+>>> interpreter.psil("sq").compiled is not None
+True
+
+Compiled operators give the same results as the builtins:
+
+>>> interpreter.psil("(define (between a b c) (< a b c))") and None
+>>> interpreter.psil("(define (halve3 n) (// n 2 2))") and None
+>>> interpreter.psil("(define (push x l) (cons x l))") and None
+>>> [interpreter.psil("(list (between 1 5 2) (between 1 2 5) (halve3 17) (push 1 (quote (2))))") for i in range(3)]
+[[False, True, 4, [1, 2]], [False, True, 4, [1, 2]], [False, True, 4, [1, 2]]]
+>>> interpreter.psil("between").compiled is not None
+True
+
+Calls in tail position to psil functions rely on the interpreter's
+trampoline, so functions that make them are left alone:
+
+>>> interpreter.psil("(define (down n) (if (== n 0) 0 (down (- n 1))))")
+<psil.interpreter.Function object at 0x...>
+>>> interpreter.psil("(down 10000)")
+0
+>>> interpreter.psil("down").compiled is None
+True
+>>> interpreter.TierThreshold = None
+"""
+
+import ast
+import builtins
+import sys
+
+from . import interpreter
+from .analysis import quasiquote_holes
+from .compiler import CompileFuncs, named_let_loops, psilc
+from .interpreter import Function, Macro, Symbol
+
+# Forms the compiler rejects or translates with different semantics.
+Unsupported = set(Symbol.new(x) for x in [
+    "define",
+    "defmacro",
+    "set!",
+    "unquote",
+    "unquote-splicing",
+    "reverse",
+    "string->symbol",
+    "%",
+])
+
+class ScopeGlobals(dict):
+    """Globals for compiled code that resolve through a psil Scope."""
+    def __init__(self, scope):
+        dict.__init__(self)
+        self.scope = scope
+    def __missing__(self, name):
+        found, r = self.scope.lookup(name)
+        if found:
+            return r
+        try:
+            return getattr(builtins, name)
+        except AttributeError:
+            raise KeyError(name)
+
+def _compilable(p):
+    if isinstance(p, list):
+        if not p:
+            return False
+        head = p[0]
+        if isinstance(head, Symbol):
+            if head in Unsupported:
+                return False
+            if head is Symbol.quote:
+                return True
+            if head is Symbol.quasiquote:
+                return all(_compilable(x) for x in quasiquote_holes(p[1]))
+            if head is Symbol.lambda_:
+                return (isinstance(p[1], list)
+                    and all(isinstance(x, Symbol) and x.name != "." for x in p[1])
+                    and len(p) > 2
+                    and all(_compilable(x) for x in p[2:]))
+        return all(_compilable(x) for x in p)
+    if isinstance(p, Symbol):
+        return True
+    return isinstance(p, (str, int, float))
+
+def _tail_safe(p, params, loop = None):
+    if not isinstance(p, list):
+        return True
+    head = p[0]
+    if head is loop:
+        # compiled to a jump back to the top of the loop
+        return True
+    if head is Symbol.if_:
+        return all(_tail_safe(x, params, loop) for x in p[2:4])
+    if head is Symbol.and_ or head is Symbol.or_ or head is Symbol.when:
+        return _tail_safe(p[-1], params, loop)
+    if head is Symbol.cond:
+        return all(_tail_safe(x[-1], params, loop) for x in p[1:] if len(x) > 1)
+    if head is Symbol.named_let:
+        return named_let_loops(p) and _tail_safe(p[-1], params | set(b[0].name for b in p[2]), p[1])
+    if head is Symbol.dotimes or head is Symbol.for_:
+        return len(p[1]) < 3 or _tail_safe(p[1][2], params)
+    if head is Symbol.do:
+        return len(p[2]) < 2 or _tail_safe(p[2][-1], params | set(b[0].name for b in p[1]))
+    if not isinstance(head, Symbol):
+        return False
+    if head in CompileFuncs or head.name.startswith("."):
+        return True
+    if head.name in params:
+        return False
+    found, f = interpreter.Globals.lookup(head.name)
+    if found:
+        return not isinstance(f, Function)
+    return hasattr(builtins, head.name)
+
+def compile_function(fn):
+    if isinstance(fn, Macro) or fn.scope is not interpreter.Globals:
+        return None
+    if fn.rest is not None or fn.fixed != len(fn.params) or not fn.body:
+        return None
+    if not all(_compilable(x) for x in fn.body):
+        return None
+    if not _tail_safe(fn.body[-1], set(x.name for x in fn.params)):
+        return None
+    name = "_psil_compiled"
+    p = [Symbol.define, [Symbol.new(name)] + fn.params] + fn.body
+    try:
+        tree = ast.Module(psilc(p), [])
+        ast.fix_missing_locations(tree)
+        code = compile(tree, "<psil %s>" % fn.name, "exec")
+    except Exception as x:
+        # the checks above should have turned the function away; say so,
+        # and keep it interpreted rather than failing the call
+        print("*** warning: cannot compile {0}: {1}".format(fn.name, x), file=sys.stderr)
+        return None
+    g = ScopeGlobals(fn.scope)
+    exec(code, g)
+    return g[name]
@@ -0,0 +1,21 @@
+import sys
+
+import psil.rt
+
+Output = None
+
+a = 1
+while a < len(sys.argv) and sys.argv[a].startswith("-"):
+    if sys.argv[a] == "-o":
+        a += 1
+        Output = sys.argv[a]
+    elif sys.argv[a] == "-O":
+        psil.interpreter.Optimize = True
+    a += 1
+
+if a >= len(sys.argv) or (Output is not None and len(sys.argv) - a > 1):
+    print("usage: psilc.py [-O] [-o output.py] file.psil ...", file=sys.stderr)
+    sys.exit(1)
+
+for fn in sys.argv[a:]:
+    print(psil.rt.compile_file(fn, Output))
@@ -0,0 +1,32 @@
+import json
+import os
+import socket
+import sys
+
+if len(sys.argv) != 3 and not (len(sys.argv) == 4 and sys.argv[2] == "-e"):
+    print("usage: psilclient.py socket (-e expr | file.psil)", file=sys.stderr)
+    sys.exit(2)
+
+if sys.argv[2] == "-e":
+    request = {"op": "eval", "source": sys.argv[3]}
+else:
+    request = {"op": "run", "path": os.path.abspath(sys.argv[2])}
+request["cwd"] = os.getcwd()
+
+sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+sock.connect(sys.argv[1])
+sock.sendall(json.dumps(request).encode("utf-8"))
+sock.shutdown(socket.SHUT_WR)
+chunks = []
+while True:
+    data = sock.recv(65536)
+    if not data:
+        break
+    chunks.append(data)
+sock.close()
+
+reply = json.loads(b"".join(chunks).decode("utf-8"))
+sys.stdout.write(reply["output"])
+if "error" in reply:
+    print(reply["error"], file=sys.stderr)
+    sys.exit(1)